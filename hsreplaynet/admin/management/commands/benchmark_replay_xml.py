@@ -0,0 +1,67 @@
+import gzip
+import json
+import time
+
+from django.core.management.base import BaseCommand
+from django.utils.timezone import now
+from hsreplay.document import HSReplayDocument
+
+from hsreplaynet.games.processing import HSREPLAY_SOURCE_META_KEYS, _parse_log
+
+
+class Command(BaseCommand):
+	help = (
+		"Compare the processing cost of generating hsreplay.xml files eagerly against "
+		"storing the source used by REPLAY_XML_LAZY_GENERATION."
+	)
+
+	def add_arguments(self, parser):
+		parser.add_argument("file", nargs="+", help="Power.log files to benchmark")
+
+	def handle(self, *args, **options):
+		totals = {"parse": 0.0, "xml": 0.0, "xml_bytes": 0, "gzip_bytes": 0, "source_bytes": 0}
+
+		for file in options["file"]:
+			start = time.process_time()
+			with open(file, "rb") as log_file:
+				parser = _parse_log(log_file, now())
+			parse_time = time.process_time() - start
+
+			# The lazy source keeps a copy of the (gzipped) uploaded log
+			with open(file, "rb") as log_file:
+				log_bytes = len(gzip.compress(log_file.read()))
+
+			start = time.process_time()
+			xml = HSReplayDocument.from_parser(parser, build=0).to_xml().encode("utf-8")
+			# What actually gets stored on S3 (AWS_IS_GZIPPED)
+			compressed = gzip.compress(xml)
+			xml_time = time.process_time() - start
+
+			source = {k: None for k in HSREPLAY_SOURCE_META_KEYS}
+			source.update(log=file, match_start=now().isoformat(), upload_created=None)
+			source_bytes = len(json.dumps(source).encode("utf-8")) + log_bytes
+
+			self.stdout.write(
+				"%s: parse %.3fs, xml+gzip %.3fs, %i bytes of XML (%i gzipped), "
+				"%i bytes of lazy source and log" % (
+					file, parse_time, xml_time, len(xml), len(compressed), source_bytes
+				)
+			)
+			totals["parse"] += parse_time
+			totals["xml"] += xml_time
+			totals["xml_bytes"] += len(xml)
+			totals["gzip_bytes"] += len(compressed)
+			totals["source_bytes"] += source_bytes
+
+		num_files = len(options["file"])
+		self.stdout.write(
+			"Average over %i files: parse %.3fs, xml+gzip %.3fs (%.1f%% of processing saved "
+			"when lazy), %i gzipped bytes stored eagerly vs %i lazily" % (
+				num_files,
+				totals["parse"] / num_files,
+				totals["xml"] / num_files,
+				100 * totals["xml"] / ((totals["parse"] + totals["xml"]) or 1),
+				totals["gzip_bytes"] / num_files,
+				totals["source_bytes"] / num_files,
+			)
+		)
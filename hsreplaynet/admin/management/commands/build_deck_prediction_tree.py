@@ -1,5 +1,6 @@
 import json
 import time
+from collections import defaultdict
 from datetime import date, timedelta
 
 import redis
@@ -65,6 +66,8 @@ AND p.game_date BETWEEN :start_date AND :end_date
 
 
 class Command(BaseCommand):
+	BATCH_SIZE = 1000
+
 	def add_arguments(self, parser):
 		parser.add_argument("--redis_host", nargs=1)
 		parser.add_argument("--look_back", nargs=1)
@@ -84,9 +87,8 @@ class Command(BaseCommand):
 		redis_host = options["redis_host"]
 		if redis_host:
 			redis_client = redis.StrictRedis(host=redis_host[0])
-			pipeline = redis_client.pipeline(transaction=False)
 		else:
-			pipeline = None
+			redis_client = None
 
 		params = {
 			"start_date": start_ts,
@@ -94,7 +96,16 @@ class Command(BaseCommand):
 		}
 		compiled_statement = REDSHIFT_QUERY.params(params).compile(bind=conn)
 		start_ts = time.time()
-		for row in conn.execute(compiled_statement):
+
+		trees = {}
+		observations = defaultdict(list)
+
+		def flush():
+			for key, tree_observations in observations.items():
+				trees[key].observe_many(tree_observations)
+			observations.clear()
+
+		for num_rows, row in enumerate(conn.execute(compiled_statement), start=1):
 			as_of = row["match_start"]
 			deck_id = row["deck_id"]
 			dbf_map = {dbf_id: count for dbf_id, count in json.loads(row["deck_list"])}
@@ -102,24 +113,21 @@ class Command(BaseCommand):
 			format = FormatType.FT_STANDARD if row["game_type"] == 2 else FormatType.FT_WILD
 			played_cards = json.loads(row["played_cards"])
 
-			tree = deck_prediction_tree(player_class, format, redis_client=pipeline)
+			key = (player_class, format)
+			if key not in trees:
+				trees[key] = deck_prediction_tree(player_class, format, redis_client=redis_client)
+			tree = trees[key]
 			min_played_cards = tree.max_depth - 1
 			played_card_dbfs = played_cards[:min_played_cards]
 			deck_size = sum(dbf_map.values())
 
 			if deck_size == 30:
-				tree.observe(
-					deck_id,
-					dbf_map,
-					played_card_dbfs,
-					as_of=as_of
-				)
-
-			if len(pipeline) >= 8000:
-				pipeline.execute()
-
-		if len(pipeline):
-			pipeline.execute()
+				observations[key].append((deck_id, dbf_map, played_card_dbfs, as_of))
+
+			if num_rows % self.BATCH_SIZE == 0:
+				flush()
+
+		flush()
 
 		end_ts = time.time()
 		duration_seconds = round(end_ts - start_ts)
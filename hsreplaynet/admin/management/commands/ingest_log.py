@@ -69,4 +69,4 @@ class Command(BaseCommand):
 					event.game.user = user
 					event.game.save()
 				self.stdout.write("%r: %s" % (event.game, event.game.get_absolute_url()))
-				self.stdout.write("Replay: %s" % (event.game.replay_xml.url))
+				self.stdout.write("Replay: %s" % (event.game.replay_xml_url))
@@ -4,11 +4,11 @@ from datetime import date, datetime, timedelta
 
 from django.core.management.base import BaseCommand
 from hearthstone.enums import CardClass, FormatType
-from hsarchetypes import classify_deck
 from sqlalchemy import Date, Integer, String
 from sqlalchemy.sql import bindparam, text
 
-from hsreplaynet.decks.models import Archetype, ClusterSnapshot, Deck
+from hsreplaynet.decks.classification import ArchetypeClassifier
+from hsreplaynet.decks.models import Archetype, Deck
 from hsreplaynet.utils.aws import redshift
 
 
@@ -60,10 +60,7 @@ class Command(BaseCommand):
 	def __init__(self, *args, **kwargs):
 		self.archetype_map = {}
 		self.timestamp = datetime.now().isoformat(sep=" ")
-		self.signature_weights = {
-			FormatType.FT_WILD: {},
-			FormatType.FT_STANDARD: {},
-		}
+		self.classifiers = {}
 		super().__init__(*args, **kwargs)
 
 	def add_arguments(self, parser):
@@ -95,25 +92,10 @@ class Command(BaseCommand):
 				for a in Archetype.objects.live().filter(player_class=card_class):
 					self.archetype_map[a.id] = a
 
-				# Standard Signature Weights
-				standard_weight_values = ClusterSnapshot.objects.get_signature_weights(
-					FormatType.FT_STANDARD,
-					card_class
-				)
-				if len(standard_weight_values):
-					self.signature_weights[
-						FormatType.FT_STANDARD
-					][card_class] = standard_weight_values
-
-				# Wild Signature Weights
-				wild_weight_values = ClusterSnapshot.objects.get_signature_weights(
-					FormatType.FT_WILD,
-					card_class
-				)
-				if len(wild_weight_values):
-					self.signature_weights[
-						FormatType.FormatType.FT_WILD
-					][card_class] = wild_weight_values
+				for format in (FormatType.FT_STANDARD, FormatType.FT_WILD):
+					classifier = ArchetypeClassifier.for_live_signatures(format, card_class)
+					if len(classifier):
+						self.classifiers[(format, card_class)] = classifier
 
 		result_set = list(conn.execute(compiled_statement))
 		total_rows = len(result_set)
@@ -122,14 +104,14 @@ class Command(BaseCommand):
 		if is_dry_run:
 			self.stdout.write("This is a dry run, will not save results")
 
-		archetypes_to_update = {}
+		# Group the decks by format and class so that each group is classified in one go
+		decks_to_classify = {}
 		for counter, row in enumerate(result_set):
 			deck_id = row["deck_id"]
 			if deck_id is None:
 				self.stderr.write("Got deck_id %r ... skipping" % (deck_id))
 				continue
 
-			current_archetype_id = row["archetype_id"]
 			player_class = CardClass(row["player_class"])
 			if player_class == CardClass.NEUTRAL:
 				# Most likely noise
@@ -137,16 +119,24 @@ class Command(BaseCommand):
 				continue
 			format = FormatType.FT_STANDARD if row["game_type"] == 2 else FormatType.FT_WILD
 
-			dbf_map = {dbf_id: count for dbf_id, count in json.loads(row["deck_list"])}
-			if player_class not in self.signature_weights[format]:
+			if (format, player_class) not in self.classifiers:
 				raise RuntimeError(
 					"%r not found for %r. Are signatures present?" % (player_class, format)
 				)
 
-			if self.signature_weights[format][player_class]:
-				new_archetype_id = classify_deck(
-					dbf_map, self.signature_weights[format][player_class]
-				)
+			dbf_map = {dbf_id: count for dbf_id, count in json.loads(row["deck_list"])}
+			decks_to_classify.setdefault((format, player_class), []).append(
+				(counter, row, dbf_map)
+			)
+
+		archetypes_to_update = {}
+		for key, decks in decks_to_classify.items():
+			new_archetype_ids = self.classifiers[key].classify_many(
+				[dbf_map for _, _, dbf_map in decks]
+			)
+			for (counter, row, _), new_archetype_id in zip(decks, new_archetype_ids):
+				deck_id = row["deck_id"]
+				current_archetype_id = row["archetype_id"]
 
 				if new_archetype_id == current_archetype_id and not options["force"]:
 					if verbosity > 1:
@@ -16,7 +16,8 @@ from sqlalchemy.sql import and_
 
 from hearthsim.identity.accounts.models import BlizzardAccount
 from hsreplaynet.analytics.utils import (
-	attempt_request_triggered_query_execution, execute_query, trigger_if_stale
+	attempt_request_triggered_query_execution, execute_query,
+	fetch_query_results_in_bulk, trigger_many_if_stale
 )
 from hsreplaynet.decks.models import Deck
 from hsreplaynet.utils import log
@@ -411,22 +412,28 @@ RANK_MAP = [
 ]
 
 
-def refresh_meta_preview():
-	from hsreplaynet.utils.aws.redshift import get_redshift_query
-	query = get_redshift_query("archetype_popularity_distribution_stats")
-
+def _get_meta_preview_queries(query):
 	ranks = [x for x in range(0, 21)]
 	regions = ["REGION_EU", "REGION_US", "REGION_KR", "REGION_CN"]
 
 	for rank in ranks:
 		for region in regions:
-			parameterized_query = query.build_full_params(dict(
+			yield rank, region, query.build_full_params(dict(
 				TimeRange="LAST_1_DAY",
 				GameType="RANKED_STANDARD",
 				RankRange=RANK_MAP[rank],
 				Region=region
 			))
-			trigger_if_stale(parameterized_query)
+
+
+def refresh_meta_preview():
+	from hsreplaynet.utils.aws.redshift import get_redshift_query
+	query = get_redshift_query("archetype_popularity_distribution_stats")
+
+	trigger_many_if_stale(
+		parameterized_query for rank, region, parameterized_query in
+		_get_meta_preview_queries(query)
+	)
 
 
 def get_meta_preview(num_items=10):
@@ -443,42 +450,38 @@ def get_meta_preview(num_items=10):
 	unique_archetypes = set()
 	data = []
 
-	ranks = [x for x in range(0, 21)]
-
-	for rank in ranks:
-		regions = ["REGION_EU", "REGION_US", "REGION_KR", "REGION_CN"]
-		for region in regions:
-			parameterized_query = query.build_full_params(dict(
-				TimeRange="LAST_1_DAY",
-				GameType="RANKED_STANDARD",
-				RankRange=RANK_MAP[rank],
-				Region=region
-			))
-
-			if not parameterized_query.result_available:
-				continue
-
-			response = parameterized_query.response_payload
-
-			archetypes = []
-			for class_values in response["series"]["data"].values():
-				for value in class_values:
-					if (
-						value["archetype_id"] > 0 and value["pct_of_total"] > 0.5 and
-						value["total_games"] > 30 and value["win_rate"] > 51
-					):
-						archetypes.append(value)
-			if not len(archetypes):
-				continue
+	# Stale queries are refreshed by do_refresh_meta_preview, so just read the results.
+	queries = list(_get_meta_preview_queries(query))
+	results = fetch_query_results_in_bulk(
+		(parameterized_query for rank, region, parameterized_query in queries),
+		trigger=False
+	)
 
-			archetype = list(sorted(archetypes, key=lambda a: a["win_rate"], reverse=True))[0]
-			unique_archetypes.add(archetype["archetype_id"])
-			data.append({
-				"rank": rank,
-				"region": region,
-				"data": archetype,
-				"as_of": response["as_of"]
-			})
+	for (rank, region, _), result in zip(queries, results):
+		if not result.available:
+			continue
+
+		response = result.payload
+
+		archetypes = []
+		for class_values in response["series"]["data"].values():
+			for value in class_values:
+				if (
+					value["archetype_id"] > 0 and value["pct_of_total"] > 0.5 and
+					value["total_games"] > 30 and value["win_rate"] > 51
+				):
+					archetypes.append(value)
+		if not len(archetypes):
+			continue
+
+		archetype = list(sorted(archetypes, key=lambda a: a["win_rate"], reverse=True))[0]
+		unique_archetypes.add(archetype["archetype_id"])
+		data.append({
+			"rank": rank,
+			"region": region,
+			"data": archetype,
+			"as_of": response["as_of"]
+		})
 
 	results = []
 	for archetype_id in unique_archetypes:
@@ -1,3 +1,6 @@
+import threading
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 
 from django.conf import settings
@@ -49,6 +52,112 @@ def trigger_if_stale(parameterized_query, run_local=False, priority=None):
 	return result
 
 
+QueryResult = namedtuple(
+	"QueryResult", ["parameterized_query", "available", "payload", "triggered_refresh"]
+)
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def _get_executor():
+	"""
+	Return the process-wide thread pool the bulk helpers run their cache lookups on, so
+	that the number of lookup threads stays bounded however many requests use them.
+	"""
+	global _executor
+
+	with _executor_lock:
+		if _executor is None:
+			_executor = ThreadPoolExecutor(
+				max_workers=settings.REDSHIFT_BULK_FETCH_MAX_WORKERS,
+				thread_name_prefix="query_results"
+			)
+		return _executor
+
+
+def _safe_trigger_if_stale(parameterized_query, run_local=False, priority=None):
+	try:
+		return trigger_if_stale(parameterized_query, run_local, priority)
+	except OSError as err:
+		log.warning("Failed to trigger stale query refresh: %s", err)
+		return False
+
+
+def _read_query_result(parameterized_query, raw):
+	available = parameterized_query.result_available
+	if not available:
+		return available, None
+	if raw:
+		return available, parameterized_query.response_payload_data
+	return available, parameterized_query.response_payload
+
+
+def fetch_query_results_in_bulk(
+	parameterized_queries, trigger=True, raw=False, run_local=False, priority=None
+):
+	"""
+	Look up the cached results of several parameterized queries at once.
+
+	Each lookup is a handful of cache round trips (availability, payload), so they are
+	run concurrently on a shared thread pool rather than one query after the other. Stale
+	queries are scheduled for a refresh alongside the lookups unless trigger is False.
+	With raw, the payloads are returned serialized (response_payload_data).
+
+	With run_local, the refreshes run synchronously in the calling thread before the
+	results are read, so that the refreshed payloads are returned and long local queries
+	do not tie up the shared pool.
+
+	Returns a list of QueryResult tuples in the order of parameterized_queries.
+	"""
+	parameterized_queries = list(parameterized_queries)
+	if not parameterized_queries:
+		return []
+
+	if run_local:
+		results = []
+		for parameterized_query in parameterized_queries:
+			triggered_refresh = (
+				_safe_trigger_if_stale(parameterized_query, run_local, priority)
+				if trigger else False
+			)
+			available, payload = _read_query_result(parameterized_query, raw)
+			results.append(QueryResult(parameterized_query, available, payload, triggered_refresh))
+		return results
+
+	executor = _get_executor()
+	triggers = [
+		executor.submit(_safe_trigger_if_stale, parameterized_query, run_local, priority)
+		if trigger else None
+		for parameterized_query in parameterized_queries
+	]
+	reads = [
+		executor.submit(_read_query_result, parameterized_query, raw)
+		for parameterized_query in parameterized_queries
+	]
+
+	results = []
+	for parameterized_query, read, triggered in zip(parameterized_queries, reads, triggers):
+		available, payload = read.result()
+		triggered_refresh = triggered.result() if triggered is not None else False
+		results.append(QueryResult(parameterized_query, available, payload, triggered_refresh))
+	return results
+
+
+def trigger_many_if_stale(parameterized_queries, priority=None):
+	"""
+	Concurrently call trigger_if_stale() on several parameterized queries.
+
+	Returns the number of queries that were scheduled for a refresh.
+	"""
+	executor = _get_executor()
+	futures = [
+		executor.submit(trigger_if_stale, parameterized_query, priority=priority)
+		for parameterized_query in parameterized_queries
+	]
+	return sum(future.result() for future in futures)
+
+
 def attempt_request_triggered_query_execution(
 	parameterized_query,
 	run_local=False,
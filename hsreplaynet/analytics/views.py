@@ -21,7 +21,7 @@ from hsredshift.analytics.filters import Region
 from hsredshift.analytics.library.base import InvalidOrMissingQueryParameterError
 from hsredshift.analytics.scheduling import QueryRefreshPriority
 from hsreplaynet.analytics.processing import get_meta_preview, get_mulligan_preview
-from hsreplaynet.analytics.utils import trigger_if_stale
+from hsreplaynet.analytics.utils import fetch_query_results_in_bulk, trigger_if_stale
 from hsreplaynet.decks.models import Archetype, ClusterSetSnapshot, ClusterSnapshot, Deck
 from hsreplaynet.features.decorators import view_requires_feature_access
 from hsreplaynet.utils import influx, log
@@ -206,16 +206,19 @@ def fetch_query_results(request, name):
 
 		is_cache_hit = parameterized_query.result_available
 		if is_cache_hit:
-			trigger_if_stale(parameterized_query)
 			# Try to return a minimal response
 			response = get_conditional_response(request, last_modified=last_modified)
+			if response or request.method == "HEAD":
+				trigger_if_stale(parameterized_query)
 
 		if not response:
 			if request.method == "HEAD":
 				response = HttpResponse(204)
 			else:
-				# Resort to a full response
-				response = _fetch_query_results(parameterized_query, user=request.user)
+				# Resort to a full response (which triggers stale queries itself)
+				response = _fetch_query_results(
+					parameterized_query, user=request.user, is_cache_hit=is_cache_hit
+				)
 
 		# Add Last-Modified header
 		if response.status_code in (200, 204, 304):
@@ -255,16 +258,25 @@ def fetch_local_query_results(request, name):
 	return _fetch_query_results(parameterized_query, run_local=True, user=request.user)
 
 
-def _fetch_query_results(parameterized_query, run_local=False, user=None, priority=None):
+def _fetch_query_results(
+	parameterized_query, run_local=False, user=None, priority=None, is_cache_hit=None
+):
 	cache_is_populated = parameterized_query.cache_is_populated
-	is_cache_hit = parameterized_query.result_available
+	if is_cache_hit is None:
+		is_cache_hit = parameterized_query.result_available
 	triggered_refresh = False
 
 	if is_cache_hit:
-		triggered_refresh = trigger_if_stale(parameterized_query, run_local, priority)
+		# Refresh the result if it is stale while reading it, rather than before
+		result = fetch_query_results_in_bulk(
+			[parameterized_query], raw=True, run_local=run_local, priority=priority
+		)[0]
+		is_cache_hit = result.available
+		triggered_refresh = result.triggered_refresh
 
+	if is_cache_hit:
 		response = HttpResponse(
-			content=parameterized_query.response_payload_data,
+			content=result.payload,
 			content_type=parameterized_query.response_payload_type
 		)
 	elif cache_is_populated and parameterized_query.is_global:
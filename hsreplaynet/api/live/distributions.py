@@ -1,6 +1,9 @@
+import time
 from datetime import timedelta
+from itertools import chain
 
 import requests
+from django.conf import settings
 from django.core.cache import caches
 
 from hsreplaynet.utils.redis import (
@@ -33,9 +36,10 @@ class PopularityWinrateDistribution:
 		)
 
 	def increment(self, key, win=False, as_of=None):
-		self.observations.increment(key, as_of=as_of)
+		increments = [(self.observations, key)]
 		if win:
-			self.wins.increment(key, as_of=as_of)
+			increments.append((self.wins, key))
+		RedisPopularityDistribution.increment_many(increments, as_of=as_of)
 
 	def distribution(self, start_ts, end_ts):
 		games = self.observations.distribution(
@@ -54,6 +58,61 @@ class PopularityWinrateDistribution:
 			}
 		return result
 
+	def distribution_series(self, window_end_timestamps, window):
+		"""
+		Return the distribution over each of several windows of the same length.
+
+		window_end_timestamps is an ascending list of datetimes; for each one, the result
+		holds the same data distribution() would return for the window (end_ts - window,
+		end_ts). Rather than summarizing every window in Redis, the raw buckets covering all
+		of them are fetched once and the windows are summed from their prefix sums.
+		"""
+		import numpy as np
+
+		if not window_end_timestamps:
+			return []
+
+		start_ts = window_end_timestamps[0] - window
+		end_ts = window_end_timestamps[-1]
+		start_token, games_buckets = self.observations.buckets(start_ts, end_ts)
+		_, wins_buckets = self.wins.buckets(start_ts, end_ts)
+
+		keys = sorted(set(chain.from_iterable(games_buckets)))
+		columns = {key: i for i, key in enumerate(keys)}
+
+		def prefix_sums(buckets):
+			# Row i holds the totals of the first i buckets
+			counts = np.zeros((len(buckets) + 1, len(keys)), dtype=np.int64)
+			for row, bucket in enumerate(buckets, 1):
+				for key, count in bucket.items():
+					if key in columns:
+						counts[row, columns[key]] = count
+			return np.cumsum(counts, axis=0)
+
+		games_sums = prefix_sums(games_buckets)
+		wins_sums = prefix_sums(wins_buckets)
+
+		# The window (start_ts, end_ts) covers the buckets from the one containing start_ts
+		# to the one containing end_ts, like distribution().
+		first_buckets = np.array([
+			(self.observations._to_start_token(ts - window) - start_token) // self.bucket_size
+			for ts in window_end_timestamps
+		])
+		last_buckets = np.array([
+			(self.observations._to_start_token(ts) - start_token) // self.bucket_size
+			for ts in window_end_timestamps
+		])
+		games = games_sums[last_buckets + 1] - games_sums[first_buckets]
+		wins = wins_sums[last_buckets + 1] - wins_sums[first_buckets]
+
+		result = []
+		for window_games, window_wins in zip(games.tolist(), wins.tolist()):
+			result.append({
+				key: {"games": window_games[i], "wins": window_wins[i]}
+				for i, key in enumerate(keys) if window_games[i] > 0
+			})
+		return result
+
 
 def get_player_class_distribution(game_type, redis_client=None, ttl=3200, use_lua=None):
 	if redis_client:
@@ -98,6 +157,53 @@ def get_replay_feed(comparator=None):
 	)
 
 
+# A sorted set of the live_stats cache keys holding the details of the Twitch streams
+# currently being played, scored by the time of their last heartbeat.
+ACTIVE_TWITCH_STREAMS_KEY = "ACTIVE_TWITCH_STREAMS"
+
+
+def record_twitch_stream_heartbeat(twitch_user_id, details, timeout):
+	"""
+	Store the details of a Twitch stream in the live_stats cache for timeout seconds and
+	mark it as active in the ACTIVE_TWITCH_STREAMS_KEY index.
+	"""
+	cache = caches["live_stats"]
+	cache_key = "twitch_%s" % twitch_user_id
+	cache.set(cache_key, details, timeout=timeout)
+
+	now = time.time()
+	pipe = get_live_stats_redis().pipeline()
+	pipe.zadd(ACTIVE_TWITCH_STREAMS_KEY, now, cache_key)
+	# Streams whose details have expired can't be live anymore
+	pipe.zremrangebyscore(ACTIVE_TWITCH_STREAMS_KEY, "-inf", now - timeout)
+	pipe.expire(ACTIVE_TWITCH_STREAMS_KEY, timeout)
+	pipe.execute()
+
+
+def get_active_twitch_stream_keys(max_age):
+	"""
+	Return the live_stats cache keys of the Twitch streams with a heartbeat in the last
+	max_age seconds, most recent first.
+
+	The stream details are published outside this repository, and the publisher does not
+	maintain the index yet: while it is empty, look for their keys with SCAN (never KEYS,
+	which would block the live stats Redis).
+	"""
+	redis = get_live_stats_redis()
+	pipe = redis.pipeline()
+	pipe.zremrangebyscore(ACTIVE_TWITCH_STREAMS_KEY, "-inf", time.time() - max_age)
+	pipe.zrevrange(ACTIVE_TWITCH_STREAMS_KEY, 0, -1)
+	_, cache_keys = pipe.execute()
+	if cache_keys:
+		return [cache_key.decode() for cache_key in cache_keys]
+
+	# Strip the ":<version>:" prefix Django adds to cache keys
+	return [
+		key.decode().split(":", 2)[2]
+		for key in redis.scan_iter(match=":*:twitch_*", count=1000)
+	]
+
+
 def get_daily_game_counter():
 	return RedisCounter(
 		redis=get_live_stats_redis(),
@@ -112,7 +218,8 @@ def get_daily_contributor_set():
 		redis=get_live_stats_redis(),
 		name="DAILY_CONTRIBUTORS",
 		bucket_size=int(timedelta(days=1).total_seconds()),
-		ttl=int(timedelta(days=14).total_seconds())
+		ttl=int(timedelta(days=14).total_seconds()),
+		hyperloglog=settings.LIVE_STATS_HYPERLOGLOG_CONTRIBUTORS
 	)
 
 
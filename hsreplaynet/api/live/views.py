@@ -1,4 +1,3 @@
-from collections import defaultdict
 from datetime import datetime, timedelta
 
 from allauth.socialaccount.models import SocialAccount
@@ -8,18 +7,23 @@ from hearthstone.enums import BnetGameType
 from rest_framework.response import Response
 from rest_framework.views import APIView
 
+from hsreplaynet.utils.cache import SharedCache
+
 from .distributions import (
-	get_daily_contributor_set, get_daily_game_counter,
-	get_live_stats_redis, get_played_cards_distribution,
+	get_active_twitch_stream_keys, get_daily_contributor_set,
+	get_daily_game_counter, get_live_stats_redis, get_played_cards_distribution,
 	get_player_class_distribution, get_replay_feed, get_twitch_proxy
 )
 
 
-_PLAYER_CLASS_CACHE = defaultdict(dict)
-_REPLAY_FEED_CACHE = defaultdict()
-_WEEKLY_GAMES_COUNT = defaultdict()
-_PLAYED_CARDS_CACHE = defaultdict(dict)
-_TWITCH_STREAM_CACHE = defaultdict(defaultdict)
+_REPLAY_FEED_CACHE = SharedCache("LIVE_REPLAY_FEED", get_live_stats_redis, ttl=5)
+_WEEKLY_GAMES_COUNT = SharedCache("LIVE_WEEKLY_GAMES_COUNT", get_live_stats_redis, ttl=5)
+_PLAYER_CLASS_CACHE = SharedCache("LIVE_PLAYER_CLASS", get_live_stats_redis, ttl=5)
+_PLAYED_CARDS_CACHE = SharedCache("LIVE_PLAYED_CARDS", get_live_stats_redis, ttl=5)
+_TWITCH_STREAM_CACHE = SharedCache("LIVE_TWITCH_STREAMS", get_live_stats_redis, ttl=10)
+
+# Streams without a heartbeat for this many seconds are no longer considered live
+STREAM_HEARTBEAT_MAX_AGE = 120
 
 
 def _get_most_recent_tick_ts(tick=5):
@@ -42,38 +46,49 @@ def _validate_game_type(game_type_name: str):
 
 class LiveReplayFeedView(APIView):
 	def get(self, request):
-		current_ts = datetime.utcnow().timestamp()
+		payload = _REPLAY_FEED_CACHE.get("feed", lambda: get_replay_feed().get(200))
 
-		if _REPLAY_FEED_CACHE.get("as_of", 0) + 5 < current_ts:
-			feed = get_replay_feed()
-			_REPLAY_FEED_CACHE["as_of"] = current_ts
-			_REPLAY_FEED_CACHE["payload"] = feed.get(200)
-
-		data = {"data": _REPLAY_FEED_CACHE.get("payload", [])}
+		data = {"data": payload}
 		return Response(data=data)
 
 
 class WeeklyGamesCountView(APIView):
-	def get(self, request):
-		current_ts = datetime.utcnow().timestamp()
-
-		if _WEEKLY_GAMES_COUNT.get("as_of", 0) + 5 < current_ts:
-			counter = get_daily_game_counter()
-			contributors = get_daily_contributor_set()
-			_WEEKLY_GAMES_COUNT["as_of"] = current_ts
-			_WEEKLY_GAMES_COUNT["payload"] = {
-				"games_today": counter.get_count(0, 0),
-				"games_weekly": counter.get_count(1, 7),
-				"contributors_today": contributors.get_count(0, 0),
-				"contributors_weekly": contributors.get_count(1, 7)
-			}
+	def _get_payload(self):
+		counter = get_daily_game_counter()
+		contributors = get_daily_contributor_set()
+		return {
+			"games_today": counter.get_count(0, 0),
+			"games_weekly": counter.get_count(1, 7),
+			"contributors_today": contributors.get_count(0, 0),
+			"contributors_weekly": contributors.get_count(1, 7)
+		}
 
-		data = {"data": _WEEKLY_GAMES_COUNT.get("payload", {})}
+	def get(self, request):
+		data = {"data": _WEEKLY_GAMES_COUNT.get("counts", self._get_payload)}
 
 		return Response(data=data)
 
 
 class PlayerClassDistributionView(APIView):
+	def _get_result(self, game_type_name, most_recent_tick_ts, lookback, window, tick):
+		start_ts = most_recent_tick_ts - timedelta(seconds=lookback)
+		end_ts = start_ts + timedelta(seconds=window)
+
+		window_end_timestamps = []
+		while end_ts <= most_recent_tick_ts:
+			window_end_timestamps.append(end_ts)
+			start_ts = start_ts + timedelta(seconds=tick)
+			end_ts = start_ts + timedelta(seconds=window)
+
+		player_class_popularity = get_player_class_distribution(game_type_name)
+		series = player_class_popularity.distribution_series(
+			window_end_timestamps, window=timedelta(seconds=window)
+		)
+		return [
+			{"ts": int(end_ts.timestamp()), "data": data}
+			for end_ts, data in zip(window_end_timestamps, series)
+		]
+
 	def get(self, request, game_type_name: str) -> Response:
 		_validate_game_type(game_type_name)
 
@@ -84,30 +99,17 @@ class PlayerClassDistributionView(APIView):
 		# How many seconds between data points.
 		tick = int(request.GET.get("tick", 5))
 
-		player_class_popularity = get_player_class_distribution(game_type_name)
-
 		most_recent_tick_ts = _get_most_recent_tick_ts(tick=tick)
-		start_ts = most_recent_tick_ts - timedelta(seconds=lookback)
-		end_ts = start_ts + timedelta(seconds=window)
 
-		if _PLAYER_CLASS_CACHE[game_type_name].get("as_of", None) != most_recent_tick_ts:
-			result = []
-			while end_ts <= most_recent_tick_ts:
-				data = player_class_popularity.distribution(
-					start_ts=start_ts,
-					end_ts=end_ts
-				)
-				result.append({
-					"ts": int(end_ts.timestamp()),
-					"data": data
-				})
-				start_ts = start_ts + timedelta(seconds=tick)
-				end_ts = start_ts + timedelta(seconds=window)
-
-			_PLAYER_CLASS_CACHE[game_type_name]["as_of"] = most_recent_tick_ts
-			_PLAYER_CLASS_CACHE[game_type_name]["payload"] = result
+		# The series only changes once per tick
+		cache_key = "%s:%i:%i:%i:%i" % (
+			game_type_name, lookback, window, tick, most_recent_tick_ts.timestamp()
+		)
+		result = _PLAYER_CLASS_CACHE.get(cache_key, lambda: self._get_result(
+			game_type_name, most_recent_tick_ts, lookback, window, tick
+		))
 
-		data = {"data": _PLAYER_CLASS_CACHE[game_type_name].get("payload", [])}
+		data = {"data": result}
 		return Response(data=data)
 
 
@@ -144,24 +146,24 @@ class PlayedCardsDistributionView(APIView):
 	def _get_data_for_gametype(self, limit: int, game_type_name: str, base_ts) -> dict:
 		_validate_game_type(game_type_name)
 
-		result = self._get_result(game_type_name, base_ts, limit)
-		_PLAYED_CARDS_CACHE[game_type_name]["as_of"] = base_ts
-		_PLAYED_CARDS_CACHE[game_type_name]["payload"] = result
+		cache_key = "%s:%i:%i" % (game_type_name, limit, base_ts.timestamp())
+		result = _PLAYED_CARDS_CACHE.get(
+			cache_key, lambda: self._get_result(game_type_name, base_ts, limit)
+		)
 
-		return {"data": _PLAYED_CARDS_CACHE[game_type_name].get("payload", [])}
+		return {"data": result}
 
 	def _get_data_for_all(self, limit: int, base_ts) -> dict:
-		if _PLAYED_CARDS_CACHE["ALL"].get("as_of") != base_ts:
+		def get_payload():
 			payload = {}
 			for game_type in self.eligible_game_types:
 				payload[game_type.name] = self._get_result(
 					game_type.name, base_ts, limit
 				)
+			return payload
 
-			_PLAYED_CARDS_CACHE["ALL"]["as_of"] = base_ts
-			_PLAYED_CARDS_CACHE["ALL"]["payload"] = payload
-
-		return _PLAYED_CARDS_CACHE["ALL"].get("payload", {})
+		cache_key = "ALL:%i:%i" % (limit, base_ts.timestamp())
+		return _PLAYED_CARDS_CACHE.get(cache_key, get_payload)
 
 	def _get_data(self, game_type_name: str) -> dict:
 		# base_ts ensures we generate the result at most once per bucket_size seconds
@@ -192,21 +194,30 @@ class StreamingNowView(APIView):
 		if cached:
 			return cached
 
-		# Need direct client access for keys list
-		client = cache.client.get_client()
-		ret = []
-
-		for k in client.keys(":*:twitch_*"):
-			details = cache.get(k.decode()[3:])
+		stream_keys = get_active_twitch_stream_keys(max_age=STREAM_HEARTBEAT_MAX_AGE)
+		cached_details = cache.get_many(stream_keys)
+		streams = []
+		for k in stream_keys:
+			details = cached_details.get(k)
 
 			if not details or not details.get("deck") or not details.get("hero"):
 				# Skip the obvious garbage
 				continue
 
+			streams.append(details)
+
+		socialaccounts = {
+			socialaccount.uid: socialaccount for socialaccount in SocialAccount.objects.filter(
+				provider="twitch",
+				uid__in=[str(details["twitch_user_id"]) for details in streams]
+			).select_related("user")
+		}
+
+		ret = []
+		for details in streams:
 			twitch_user_id = details.pop("twitch_user_id")
-			try:
-				socialaccount = SocialAccount.objects.get(uid=twitch_user_id, provider="twitch")
-			except SocialAccount.DoesNotExist:
+			socialaccount = socialaccounts.get(str(twitch_user_id))
+			if not socialaccount:
 				# Maybe it was deleted since or something
 				continue
 
@@ -233,15 +244,9 @@ class StreamingNowView(APIView):
 
 class TwitchStreamsView(APIView):
 	def get(self, request):
-		current_ts = datetime.utcnow().timestamp()
 		user_logins = request.GET.getlist("user_login")
 		cache_key = ":".join(user_logins)
-		cache = _TWITCH_STREAM_CACHE.get(cache_key)
-		if not cache or cache.get("as_of", 0) + 10 < current_ts:
-			twitch = get_twitch_proxy()
-			streams = twitch.get(user_logins)
-			cache = {
-				"as_of": datetime.utcnow().timestamp(),
-				"payload": streams
-			}
-		return Response(data=cache.get("payload", []))
+		payload = _TWITCH_STREAM_CACHE.get(
+			cache_key, lambda: get_twitch_proxy().get(user_logins)
+		)
+		return Response(data=payload or [])
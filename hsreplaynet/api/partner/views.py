@@ -5,13 +5,13 @@ from rest_framework import status, views
 from rest_framework.generics import ListAPIView
 from rest_framework.response import Response
 
-from hsreplaynet.analytics.utils import trigger_if_stale
+from hsreplaynet.analytics.utils import fetch_query_results_in_bulk
 from hsreplaynet.api.partner.serializers import (
 	ArchetypeSerializer, CardSerializer, ClassSerializer
 )
 from hsreplaynet.api.partner.utils import QueryDataNotAvailableException
 from hsreplaynet.decks.api import Archetype
-from hsreplaynet.utils import get_logger, influx
+from hsreplaynet.utils import influx
 from hsreplaynet.utils.aws.redshift import get_redshift_query
 
 from .permissions import PartnerStatsPermission
@@ -29,22 +29,36 @@ class PartnerStatsListView(ListAPIView):
 	required_scopes = ["stats.partner:read"]
 	pagination_class = None
 
+	def __init__(self, **kwargs):
+		super().__init__(**kwargs)
+
+		self._query_results = dict()
+
+	def get_required_queries(self):
+		"""
+		Return the (query name, game type) pairs the view reads, so that they can all be
+		looked up at once the first time any of them is needed.
+		"""
+		return []
+
+	def _fetch_query_results(self, keys):
+		keys = [key for key in keys if key not in self._query_results]
+		parameterized_queries = [
+			get_redshift_query(query_name).build_full_params(dict(GameType=game_type))
+			for query_name, game_type in keys
+		]
+		results = fetch_query_results_in_bulk(parameterized_queries)
+		self._query_results.update(zip(keys, results))
+
 	def _get_query_data(self, query_name, game_type):
-		query = get_redshift_query(query_name)
-		parameterized_query = query.build_full_params(dict(
-			GameType=game_type
-		))
-		try:
-			trigger_if_stale(parameterized_query)
-		except OSError as err:
-			get_logger().warning(
-				"Failed to trigger stale query refresh: " + str(err)
-			)
+		key = (query_name, game_type)
+		if key not in self._query_results:
+			self._fetch_query_results([key] + self.get_required_queries())
 
-		if not parameterized_query.result_available:
+		result = self._query_results[key]
+		if not result.available:
 			raise QueryDataNotAvailableException()
-		response = parameterized_query.response_payload
-		return response["series"]["data"]
+		return result.payload["series"]["data"]
 
 
 class CardsView(PartnerStatsListView):
@@ -53,11 +67,6 @@ class CardsView(PartnerStatsListView):
 	supported_game_types = ["ARENA", "RANKED_STANDARD", "RANKED_WILD"]
 	constructed_game_types = ["RANKED_STANDARD", "RANKED_WILD"]
 
-	def __init__(self):
-		super().__init__()
-
-		self._query_data = dict()
-
 	def list(self, request, *args, **kwargs):
 		error = None
 		try:
@@ -79,6 +88,14 @@ class CardsView(PartnerStatsListView):
 				error=error
 			)
 
+	def get_required_queries(self):
+		return [
+			("card_included_popularity_report", game_type)
+			for game_type in self.supported_game_types
+		] + [
+			("list_decks_by_win_rate", game_type) for game_type in self.constructed_game_types
+		]
+
 	def get_serializer_context(self):
 		context = super().get_serializer_context()
 		game_type_data = dict(
@@ -106,13 +123,7 @@ class CardsView(PartnerStatsListView):
 		return self._get_query_data("list_decks_by_win_rate", game_type)
 
 	def _get_card_popularity(self, game_type):
-		if game_type not in self._query_data:
-			self._query_data[game_type] = self._get_query_data(
-				"card_included_popularity_report",
-				game_type
-			)
-
-		return self._query_data[game_type]["ALL"]
+		return self._get_query_data("card_included_popularity_report", game_type)["ALL"]
 
 
 class ArchetypesView(PartnerStatsListView):
@@ -141,6 +152,17 @@ class ArchetypesView(PartnerStatsListView):
 				error=error
 			)
 
+	def get_required_queries(self):
+		return [
+			(query_name, game_type)
+			for game_type in self.supported_game_types
+			for query_name in (
+				"list_decks_by_win_rate",
+				"archetype_popularity_distribution_stats",
+				"head_to_head_archetype_matchups",
+			)
+		]
+
 	def get_serializer_context(self):
 		context = super().get_serializer_context()
 		context.update(dict(
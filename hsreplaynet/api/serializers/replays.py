@@ -1,10 +1,9 @@
 from hearthstone import enums
 from hearthstone.deckstrings import parse_deckstring
-from hsarchetypes import classify_deck
 from rest_framework import fields, serializers
 
 from hearthsim.identity.accounts.models import Visibility
-from hsreplaynet.decks.models import ClusterSnapshot
+from hsreplaynet.decks.classification import archetype_classifier
 
 from ..fields import IntEnumField, TimestampField
 
@@ -73,11 +72,8 @@ class GameReplaySerializer(serializers.Serializer):
 		cards, _, _ = parse_deckstring(deckstring)
 		if (sum([c[1] for c in cards])) != 30:
 			return None
-		signature_weights = ClusterSnapshot.objects.get_signature_weights(
-			format_type, player_class
-		)
 		dbf_map = {card[0]: card[1] for card in cards}
-		return classify_deck(dbf_map, signature_weights)
+		return archetype_classifier(format_type, player_class).classify(dbf_map)
 
 	def get_friendly_player_account_hi(self, instance):
 		return instance.friendly_player_account_hilo.split("_")[0]
@@ -107,13 +107,16 @@ class AnalyticsQueryView(APIView):
 
 		is_cache_hit = parameterized_query.result_available
 		if is_cache_hit:
-			trigger_if_stale(parameterized_query)
 			# Try to return a minimal response
 			response = get_conditional_response(request, last_modified=last_modified)
+			if response:
+				trigger_if_stale(parameterized_query)
 
 		if not response:
-			# Resort to a full response
-			response = _fetch_query_results(parameterized_query, user=request.user)
+			# Resort to a full response (which triggers stale queries itself)
+			response = _fetch_query_results(
+				parameterized_query, user=request.user, is_cache_hit=is_cache_hit
+			)
 
 		response["last-modified"] = http_date(last_modified)
 
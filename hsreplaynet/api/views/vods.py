@@ -1,7 +1,7 @@
 from collections import defaultdict
-from datetime import datetime
 
 from django.contrib.auth import get_user_model
+from django.core.cache import caches
 from hearthstone.deckstrings import parse_deckstring
 from hearthstone.enums import CardClass, FormatType
 from hsarchetypes import classify_deck
@@ -12,11 +12,16 @@ from rest_framework.views import APIView
 from hsreplaynet.api.fields import TimestampField
 from hsreplaynet.api.permissions import UserHasFeature
 from hsreplaynet.decks.models import Archetype, ClusterSnapshot, Deck
+from hsreplaynet.utils.cache import SharedCache
 from hsreplaynet.vods.models import TwitchVod
 
 
-ARCHETYPE_VOD_LIST_CACHE = {}
-ARCHETYPE_VOD_INDEX_CACHE = {}
+def _get_redis():
+	return caches["default"].client.get_client()
+
+
+ARCHETYPE_VOD_LIST_CACHE = SharedCache("ARCHETYPE_VOD_LIST", _get_redis, ttl=300)
+ARCHETYPE_VOD_INDEX_CACHE = SharedCache("ARCHETYPE_VOD_INDEX", _get_redis, ttl=300)
 
 
 class VodRequestSerializer(serializers.Serializer):
@@ -122,6 +127,21 @@ class VodListView(APIView):
 	serializer_class = VodRequestSerializer
 	permission_classes = (UserHasFeature("twitch-vods"), )
 
+	def _get_archetype_vods(self, archetype_id):
+		archetype = Archetype.objects.get(id=archetype_id)
+
+		signature_weights = ClusterSnapshot.objects.get_signature_weights(
+			FormatType.FT_STANDARD, archetype.player_class
+		)
+
+		vods = []
+		for vod in TwitchVod.archetype_index.query(archetype.id):
+			if not verify_archetype_classification(archetype.id, vod, signature_weights):
+				continue
+			serializer = VodSerializer(instance=vod)
+			vods.append(serializer.data)
+		return vods
+
 	def get(self, request, **kwargs):
 		input = self.serializer_class(data=request.GET)
 		input.is_valid(raise_exception=True)
@@ -146,28 +166,10 @@ class VodListView(APIView):
 				serializer = VodSerializer(instance=vod)
 				vods.append(serializer.data)
 		elif "archetype_id" in input.validated_data:
-			validated_id = input.validated_data["archetype_id"]
-
-			cached = ARCHETYPE_VOD_LIST_CACHE.get(validated_id, {})
-			current_ts = datetime.utcnow().timestamp()
-
-			if not cached or cached.get("as_of", 0) + 300 < current_ts:
-				archetype = Archetype.objects.get(id=validated_id)
-
-				signature_weights = ClusterSnapshot.objects.get_signature_weights(
-					FormatType.FT_STANDARD, archetype.player_class
-				)
-
-				for vod in TwitchVod.archetype_index.query(archetype.id):
-					if not verify_archetype_classification(archetype.id, vod, signature_weights):
-						continue
-					serializer = VodSerializer(instance=vod)
-					vods.append(serializer.data)
-				cached["as_of"] = current_ts
-				cached["payload"] = vods
-				ARCHETYPE_VOD_LIST_CACHE[archetype.id] = cached
-			else:
-				vods = cached["payload"]
+			archetype_id = input.validated_data["archetype_id"]
+			vods = ARCHETYPE_VOD_LIST_CACHE.get(
+				archetype_id, lambda: self._get_archetype_vods(archetype_id)
+			)
 
 		return Response(vods)
 
@@ -176,39 +178,27 @@ class VodIndexView(APIView):
 	"""Query for archetype matchups with available Twitch VODs."""
 	permission_classes = (UserHasFeature("twitch-vods"), )
 
-	_signature_weights = {}
-
 	def get_signature_weights(self, player_class):
-		signature_weights = self._signature_weights.get(player_class, None)
-		if not signature_weights:
-			signature_weights = ClusterSnapshot.objects.get_signature_weights(
-				FormatType.FT_STANDARD, player_class
-			)
-			self._signature_weights[player_class] = signature_weights
-		return signature_weights
+		return ClusterSnapshot.objects.get_signature_weights(
+			FormatType.FT_STANDARD, player_class
+		)
+
+	def _get_archetype_map(self):
+		archetype_map = defaultdict(list)
+		for archetype in Archetype.objects.live().all():
+			if archetype.player_class is CardClass.INVALID:
+				continue
+			signature_weights = self.get_signature_weights(archetype.player_class)
+			vods = TwitchVod.archetype_index.query(archetype.id)
+			for vod in vods:
+				opponent_archetype = vod.opposing_player_archetype_id
+				if not opponent_archetype:
+					continue
+				if not verify_archetype_classification(archetype.id, vod, signature_weights):
+					continue
+				if opponent_archetype not in archetype_map[archetype.id]:
+					archetype_map[archetype.id].append(opponent_archetype)
+		return archetype_map
 
 	def get(self, request, **kwargs):
-		current_ts = datetime.utcnow().timestamp()
-
-		if (
-			not ARCHETYPE_VOD_INDEX_CACHE or
-			ARCHETYPE_VOD_INDEX_CACHE.get("as_of", 0) + 300 < current_ts
-		):
-			archetype_map = defaultdict(list)
-			for archetype in Archetype.objects.live().all():
-				if archetype.player_class is CardClass.INVALID:
-					continue
-				signature_weights = self.get_signature_weights(archetype.player_class)
-				vods = TwitchVod.archetype_index.query(archetype.id)
-				for vod in vods:
-					opponent_archetype = vod.opposing_player_archetype_id
-					if not opponent_archetype:
-						continue
-					if not verify_archetype_classification(archetype.id, vod, signature_weights):
-						continue
-					if opponent_archetype not in archetype_map[archetype.id]:
-						archetype_map[archetype.id].append(opponent_archetype)
-			ARCHETYPE_VOD_INDEX_CACHE["as_of"] = current_ts
-			ARCHETYPE_VOD_INDEX_CACHE["payload"] = archetype_map
-
-		return Response(ARCHETYPE_VOD_INDEX_CACHE["payload"])
+		return Response(ARCHETYPE_VOD_INDEX_CACHE.get("index", self._get_archetype_map))
@@ -0,0 +1,155 @@
+"""
+Batch archetype classification against the live cluster signatures.
+
+hsarchetypes.classify_deck() scores a single deck against every cluster of a class in
+pure Python, which is fine for the odd deck but not for reclassifying every deck played
+in a week. An ArchetypeClassifier loads the signatures of one (format, player class)
+once, as a dense card x archetype weight matrix, and scores a whole batch of decks with
+a single matrix product.
+"""
+import threading
+
+from hsarchetypes import classify_deck
+
+from .models import ClusterSnapshot
+from .signatures import live_signature_weights
+
+
+class ArchetypeClassifier:
+	"""
+	Classifies decks into the archetypes of a set of signature weights, as returned by
+	ClusterSnapshot.objects.get_signature_weights().
+
+	A deck scores the sum of the signature weights of the cards it contains in each
+	archetype; it is classified into the highest scoring archetype whose required cards
+	it contains, if that score is positive. Archetype rules are left to hsarchetypes:
+	they are only checked (by classifying the deck against that single archetype) for
+	the decks whose best candidate has any.
+	"""
+
+	def __init__(self, signature_weights, version=None, batch_size=5000):
+		import numpy as np
+
+		self.version = version
+		self.batch_size = batch_size
+		self.signature_weights = signature_weights
+		self.archetype_ids = list(signature_weights.keys())
+
+		dbf_ids = set()
+		for cluster in signature_weights.values():
+			dbf_ids.update(cluster["signature_weights"].keys())
+			dbf_ids.update(cluster["required_cards"])
+		self._columns = {dbf_id: i for i, dbf_id in enumerate(sorted(dbf_ids))}
+
+		shape = (len(self._columns), len(self.archetype_ids))
+		self.weights = np.zeros(shape)
+		self.required_cards = np.zeros(shape)
+		for j, archetype_id in enumerate(self.archetype_ids):
+			cluster = signature_weights[archetype_id]
+			for dbf_id, weight in cluster["signature_weights"].items():
+				self.weights[self._columns[dbf_id], j] = weight
+			for dbf_id in set(cluster["required_cards"]):
+				self.required_cards[self._columns[dbf_id], j] = 1
+		self.num_required_cards = self.required_cards.sum(axis=0)
+		self.has_rules = np.array(
+			[bool(signature_weights[id]["rules"]) for id in self.archetype_ids], dtype=bool
+		)
+
+	def __len__(self):
+		return len(self.archetype_ids)
+
+	def _to_matrix(self, dbf_maps):
+		import numpy as np
+
+		decks = np.zeros((len(dbf_maps), len(self._columns)))
+		for i, dbf_map in enumerate(dbf_maps):
+			for dbf_id, count in dbf_map.items():
+				column = self._columns.get(int(dbf_id))
+				if column is not None and count > 0:
+					decks[i, column] = 1
+		return decks
+
+	def _passes_rules(self, dbf_map, j):
+		archetype_id = self.archetype_ids[j]
+		cluster = {archetype_id: self.signature_weights[archetype_id]}
+		return classify_deck(dbf_map, cluster) == archetype_id
+
+	def score(self, dbf_maps):
+		"""
+		Return a (decks x archetypes) matrix of scores for a list of dbf_id -> count
+		maps. Archetypes whose required cards a deck is missing score -inf.
+		"""
+		import numpy as np
+
+		decks = self._to_matrix(dbf_maps)
+		scores = decks @ self.weights
+		eligible = decks @ self.required_cards >= self.num_required_cards
+		return np.where(eligible, scores, -np.inf)
+
+	def classify(self, dbf_map):
+		return self.classify_many([dbf_map])[0]
+
+	def classify_many(self, dbf_maps):
+		"""
+		Classify a list of dbf_id -> count maps, returning a list of archetype ids (or
+		None for the decks that match no archetype).
+		"""
+		import numpy as np
+
+		if not self.archetype_ids:
+			return [None] * len(dbf_maps)
+
+		ret = []
+		for offset in range(0, len(dbf_maps), self.batch_size):
+			batch = dbf_maps[offset:offset + self.batch_size]
+			scores = self.score(batch)
+			best = scores.argmax(axis=1)
+			best_scores = scores[np.arange(len(batch)), best]
+
+			for i, j in enumerate(best):
+				if not best_scores[i] > 0:
+					ret.append(None)
+				elif not self.has_rules[j]:
+					ret.append(self.archetype_ids[j])
+				else:
+					ret.append(self._classify_with_rules(batch[i], scores[i]))
+
+		return ret
+
+	def _classify_with_rules(self, dbf_map, scores):
+		import numpy as np
+
+		for j in np.argsort(-scores, kind="stable"):
+			if not scores[j] > 0:
+				break
+			if not self.has_rules[j] or self._passes_rules(dbf_map, j):
+				return self.archetype_ids[j]
+		return None
+
+	@classmethod
+	def for_live_signatures(cls, game_format, player_class):
+		return cls(
+			ClusterSnapshot.objects.get_signature_weights(game_format, player_class),
+			version=live_signature_weights.get_version(game_format)
+		)
+
+
+_CLASSIFIER_CACHE = {}
+_classifier_lock = threading.Lock()
+
+
+def archetype_classifier(game_format, player_class):
+	"""
+	Return the process-wide ArchetypeClassifier for a format and player class, building
+	it on first use and rebuilding it whenever the live signature weights change.
+	"""
+	key = (int(game_format), int(player_class))
+	version = live_signature_weights.get_version(game_format)
+
+	with _classifier_lock:
+		classifier = _CLASSIFIER_CACHE.get(key)
+		if classifier is None or classifier.version != version:
+			classifier = ArchetypeClassifier.for_live_signatures(game_format, player_class)
+			_CLASSIFIER_CACHE[key] = classifier
+
+	return classifier
@@ -0,0 +1,39 @@
+from django.db import migrations
+
+
+CREATE_GET_OR_CREATE_DECKS_FUNC = """
+CREATE OR REPLACE FUNCTION get_or_create_decks(jsonb)
+	RETURNS TABLE (idx int, deck_id int, deck_creation_ts timestamp, digest text, created boolean, deck_size int) AS $$
+	DECLARE
+		card_ids jsonb;
+		i int := 0;
+	BEGIN
+		-- Takes a JSON array of card id arrays, so that decks of different sizes
+		-- can be resolved in a single call. Rows are returned in the same order.
+		FOR card_ids IN SELECT * FROM jsonb_array_elements($1) LOOP
+			RETURN QUERY SELECT i, d.*
+			FROM get_or_create_deck(ARRAY(SELECT jsonb_array_elements_text(card_ids))) d;
+			i = i + 1;
+		END LOOP;
+		RETURN;
+	END;
+	$$ LANGUAGE plpgsql;
+"""
+
+DROP_GET_OR_CREATE_DECKS_FUNC = """
+	DROP FUNCTION get_or_create_decks(jsonb);
+"""
+
+
+class Migration(migrations.Migration):
+
+	dependencies = [
+		("decks", "0021_archetype_blank_required_fields"),
+	]
+
+	operations = [
+		migrations.RunSQL(
+			CREATE_GET_OR_CREATE_DECKS_FUNC,
+			DROP_GET_OR_CREATE_DECKS_FUNC
+		),
+	]
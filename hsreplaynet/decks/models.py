@@ -2,6 +2,7 @@ import collections
 import hashlib
 import json
 import os
+import random
 import string
 import time
 from typing import Set
@@ -25,14 +26,18 @@ from shortuuid.main import int_to_string, string_to_int
 
 from hsreplaynet.utils import card_db, log
 from hsreplaynet.utils.aws import s3_object_exists
-from hsreplaynet.utils.aws.clients import FIREHOSE, LAMBDA, S3
+from hsreplaynet.utils.aws.clients import LAMBDA, S3
 from hsreplaynet.utils.aws.redshift import get_redshift_query
 from hsreplaynet.utils.aws.streams import (
-	publish_batch_to_firehose, publish_from_iterable_at_fixed_speed, to_data_blobs
+	publish_batch_to_firehose, publish_from_iterable_at_fixed_speed,
+	publish_to_firehose, to_data_blobs, to_firehose_batches
 )
+from hsreplaynet.utils.cards import get_card, get_cards
 from hsreplaynet.utils.db import dictfetchall
 from hsreplaynet.utils.influx import influx_metric, influx_timer
 
+from .signatures import live_signature_weights
+
 
 ALPHABET = string.ascii_letters + string.digits
 
@@ -47,11 +52,44 @@ class DeckManager(models.Manager):
 	):
 		deck, created = self._get_or_create_deck_from_db(id_list)
 
+		archetype_exists = (
+			deck.archetype_id and Archetype.objects.filter(id=deck.archetype_id).exists()
+		)
+		self._prepare_deck(deck, hero_id, game_type, classify_archetype, archetype_exists)
+
+		return deck, created
+
+	def get_or_create_from_id_lists(self, id_lists, game_type=None, classify_archetype=False):
+		"""
+		Batched version of get_or_create_from_id_list().
+
+		Takes a list of (id_list, hero_id) tuples and returns a list of (deck, created)
+		tuples in the same order. The decks are resolved with a single call to the
+		get_or_create_decks DB function, a single query for the Deck objects and a
+		single query to check their archetypes still exist.
+		"""
+		results = self._get_or_create_decks_from_db([id_list for id_list, _ in id_lists])
+
+		archetype_ids = set(deck.archetype_id for deck, _ in results if deck.archetype_id)
+		if archetype_ids:
+			existing_archetype_ids = set(
+				Archetype.objects.filter(id__in=archetype_ids).values_list("id", flat=True)
+			)
+		else:
+			existing_archetype_ids = set()
+
+		for (deck, created), (_, hero_id) in zip(results, id_lists):
+			archetype_exists = deck.archetype_id in existing_archetype_ids
+			self._prepare_deck(deck, hero_id, game_type, classify_archetype, archetype_exists)
+
+		return results
+
+	def _prepare_deck(self, deck, hero_id, game_type, classify_archetype, archetype_exists):
 		if deck.size is None:
 			deck.size = len(deck.card_id_list())
 			deck.save()
 
-		if deck.archetype_id and not Archetype.objects.filter(id=deck.archetype_id).exists():
+		if deck.archetype_id and not archetype_exists:
 			influx_metric(
 				"deleted_archetype_cleanup",
 				{
@@ -87,8 +125,6 @@ class DeckManager(models.Manager):
 			picked_class = self._pick_card_class(player_class, deck.deck_class)
 			deck.classify_into_archetype(picked_class)
 
-		return deck, created
-
 	def _get_or_create_deck_from_db(self, id_list):
 		if not id_list:
 			# Empty list; not supported by our db function
@@ -106,6 +142,30 @@ class DeckManager(models.Manager):
 		d = Deck.objects.get(id=deck_id)
 		return d, created
 
+	def _get_or_create_decks_from_db(self, id_lists):
+		results = [None] * len(id_lists)
+
+		# Empty lists are not supported by our db function
+		non_empty = [i for i, id_list in enumerate(id_lists) if id_list]
+		for i, id_list in enumerate(id_lists):
+			if not id_list:
+				results[i] = self._get_or_create_deck_from_db(id_list)
+
+		if non_empty:
+			cursor = connection.cursor()
+			cursor.callproc("get_or_create_decks", (
+				json.dumps([id_lists[i] for i in non_empty]),
+			))
+			rows = cursor.fetchall()
+			cursor.close()
+
+			decks = Deck.objects.in_bulk([int(row[1]) for row in rows])
+			for row in rows:
+				idx, deck_id, created = int(row[0]), int(row[1]), row[4]
+				results[non_empty[idx]] = (decks[deck_id], created)
+
+		return results
+
 	def _pick_card_class(self, player_class, deck_class):
 		if player_class == deck_class:
 			return player_class
@@ -122,10 +182,11 @@ class DeckManager(models.Manager):
 		return deck_class
 
 	def _convert_hero_id_to_player_class(self, hero_id):
-		if isinstance(hero_id, int):
-			return Card.objects.get(dbf_id=hero_id).card_class
-		elif hero_id:
-			return Card.objects.get(card_id=hero_id).card_class
+		if isinstance(hero_id, int) or hero_id:
+			card = get_card(hero_id)
+			if card is None:
+				raise Card.DoesNotExist("Hero %r not found." % (hero_id))
+			return card.card_class
 		return enums.CardClass.INVALID
 
 	def bulk_update_to_archetype(self, deck_ids, archetype):
@@ -147,16 +208,17 @@ class DeckManager(models.Manager):
 		bulk_records = to_data_blobs(records)
 		if len(bulk_records):
 			publish_from_iterable_at_fixed_speed(
-				iter(bulk_records),
+				to_firehose_batches(bulk_records),
 				self._publish_archetypes_to_firehose,
-				max_records_per_second=5000,
-				publish_batch_size=500
+				# Batches are up to 4 MiB; a delivery stream accepts up to 5 MiB per second
+				max_records_per_second=1,
 			)
 
 		Deck.objects.filter(id__in=deck_ids).update(archetype_id=archetype_id)
 
-	def _publish_archetypes_to_firehose(self, batch):
-		publish_batch_to_firehose(settings.ARCHETYPE_FIREHOSE_STREAM_NAME, batch)
+	def _publish_archetypes_to_firehose(self, batches):
+		for batch in batches:
+			publish_batch_to_firehose(settings.ARCHETYPE_FIREHOSE_STREAM_NAME, batch)
 
 	def get_digest_from_shortid(self, shortid):
 		try:
@@ -379,40 +441,40 @@ class Deck(models.Model):
 			as_of=timestamp.isoformat(sep=" "),
 		)
 
-		result = FIREHOSE.put_record(
-			DeliveryStreamName=settings.ARCHETYPE_FIREHOSE_STREAM_NAME,
-			Record={
-				"Data": record.encode("utf-8"),
-			}
-		)
+		return publish_to_firehose(settings.ARCHETYPE_FIREHOSE_STREAM_NAME, [record])
 
-		return result
+	def _indexed_includes(self):
+		"""
+		Return the (CardInfo, count) pairs of the deck's includes, sorted by card cost and
+		name, without joining through the card table.
+
+		Every list of the deck is built from these, so they all contain the same cards.
+		"""
+		includes = self.includes.values_list("card_id", "count")
+		cards = get_cards([card_id for card_id, count in includes])
+		return sorted(
+			((cards[card_id], count) for card_id, count in includes if card_id in cards),
+			key=lambda t: (t[0].cost or 0, t[0].name or "")
+		)
 
 	def card_dbf_id_list(self):
 		result = []
 
-		includes = self.includes \
-			.values_list("card__dbf_id", "count") \
-			.order_by("card__cost", "card__name")
-		for id, count in includes:
+		for card, count in self._indexed_includes():
 			for i in range(count):
-				result.append(id)
+				result.append(card.dbf_id)
 
 		return result
 
 	def dbf_map(self, transformer=int):
-		includes = self.includes.values_list("card__dbf_id", "count")
-		return {transformer(id): count for id, count in includes}
+		return {transformer(card.dbf_id): count for card, count in self._indexed_includes()}
 
 	def card_id_list(self):
 		result = []
 
-		includes = self.includes \
-			.values_list("card__card_id", "count") \
-			.order_by("card__cost", "card__name")
-		for id, count in includes:
+		for card, count in self._indexed_includes():
 			for i in range(count):
-				result.append(id)
+				result.append(card.card_id)
 
 		return result
 
@@ -427,8 +489,8 @@ class Deck(models.Model):
 	def as_dbf_json(self, serialized=True):
 		"""Serialize the deck list for storage in Redshift"""
 		result = []
-		for include in self.includes.all():
-			result.append([include.card.dbf_id, include.count])
+		for card, count in self._indexed_includes():
+			result.append([card.dbf_id, count])
 
 		if serialized:
 			# separators=(",", ":") creates compact JSON encoding
@@ -437,11 +499,10 @@ class Deck(models.Model):
 			return result
 
 	def classify_into_archetype(self, player_class, save: bool = True) -> int:
-		game_format = self.format
+		from .classification import archetype_classifier
 
-		signature_weights = ClusterSnapshot.objects.get_signature_weights(
-			game_format, player_class
-		)
+		game_format = self.format
+		classifier = archetype_classifier(game_format, player_class)
 
 		blocked_classifications = {}
 
@@ -457,18 +518,27 @@ class Deck(models.Model):
 				else:
 					blocked_classifications[reason] = 1
 
-		sig_archetype_id = classify_deck(
-			self.dbf_map(),
-			signature_weights,
-			failure_callback=record_classification_failure
-		)
+		dbf_map = self.dbf_map()
+		sig_archetype_id = classifier.classify(dbf_map)
+
+		# The classifier doesn't tell why a deck matched no archetype, and asking
+		# hsarchetypes (against the same cached signature weights) is as slow as the
+		# classification used to be, so only a sample of the failures is instrumented.
+		sample_rate = getattr(settings, "ARCHETYPE_CLASSIFICATION_FAILURE_SAMPLE_RATE", 0.01)
+		if sig_archetype_id is None and random.random() < sample_rate:
+			classify_deck(
+				dbf_map,
+				classifier.signature_weights,
+				failure_callback=record_classification_failure
+			)
 
 		# Instrument any failures that occurred during the classification attempt.
 
 		for block_reason, count in blocked_classifications.items():
 			influx_metric(
 				"archetype_classification_blocked", {
-					"count": count
+					"count": count,
+					"sample_rate": sample_rate,
 				},
 				reason=block_reason
 			)
@@ -1013,6 +1083,14 @@ class ClusterManager(models.Manager):
 	"""
 
 	def get_signature_weights(self, game_format, player_class):
+		"""
+		Return the live signature weights for a format and player class, as expected by
+		hsarchetypes.classify_deck(). The result is cached (see decks.signatures) and
+		must not be modified.
+		"""
+		return live_signature_weights.get(game_format, player_class)
+
+	def get_signature_weights_from_db(self, game_format, player_class):
 		with connection.cursor() as cursor:
 			cursor.execute(
 				self.LIVE_SIGNATURES_QUERY % (int(game_format), int(player_class))
@@ -1351,6 +1429,17 @@ class ClusterSetSnapshot(models.Model, ClusterSet):
 				)
 
 
+@receiver(models.signals.post_save, sender=ClusterSetSnapshot)
+@receiver(models.signals.post_delete, sender=ClusterSetSnapshot)
+@receiver(models.signals.post_save, sender=ClassClusterSnapshot)
+@receiver(models.signals.post_delete, sender=ClassClusterSnapshot)
+@receiver(models.signals.post_save, sender=ClusterSnapshot)
+@receiver(models.signals.post_delete, sender=ClusterSnapshot)
+def invalidate_signature_weights(sender, instance, **kwargs):
+	# Once committed, so that no other process caches the old weights again meanwhile
+	transaction.on_commit(live_signature_weights.invalidate)
+
+
 class ArchetypeSuggestion(models.Model):
 	id = models.BigAutoField(primary_key=True)
 	suggested_name = models.ForeignKey(
@@ -0,0 +1,168 @@
+"""
+A versioned cache of the live archetype signature weights.
+
+The signature weights only change when a cluster set goes live (or its clusters are
+edited), but they are needed for every deck classified during replay processing. They
+are cached in process and in Redis under the id of the live ClusterSetSnapshot and a
+generation number, which is bumped whenever a cluster set, class cluster or cluster is
+saved (see the signal handlers in decks.models).
+"""
+import pickle
+import threading
+import time
+
+from django.conf import settings
+from django.db import connections
+from hearthstone.enums import CardClass, FormatType
+
+from hsreplaynet.utils import log
+
+
+GENERATION_KEY = "SIGNATURE_WEIGHTS:GENERATION"
+LIVE_CLUSTER_SET_KEY = "SIGNATURE_WEIGHTS:%i:LIVE:%i"
+WEIGHTS_KEY = "SIGNATURE_WEIGHTS:%i:%i:%i:%i"
+
+
+def get_signature_weights_redis():
+	from django.core.cache import caches
+	return caches["default"].client.get_client()
+
+
+def _get_live_cluster_set_id(game_format):
+	from .models import ClusterSetSnapshot
+
+	return ClusterSetSnapshot.objects.filter(
+		live_in_production=True, game_format=game_format
+	).values_list("id", flat=True).first() or 0
+
+
+def _get_signature_weights(game_format, player_class):
+	from .models import ClusterSnapshot
+
+	return ClusterSnapshot.objects.get_signature_weights_from_db(game_format, player_class)
+
+
+class SignatureWeightsCache:
+	def __init__(self, get_redis, generation_check_interval=30, ttl=86400):
+		"""
+		:param get_redis: a callable returning the Redis client to use
+		:param generation_check_interval: how often (in seconds) to check whether the
+			cache was invalidated by another process
+		:param ttl: how long (in seconds) values are kept in Redis
+		"""
+		self.get_redis = get_redis
+		self.generation_check_interval = generation_check_interval
+		self.ttl = ttl
+		self._lock = threading.Lock()
+		self._generation = None
+		self._generation_checked_at = 0
+		self._live_cluster_sets = {}
+		self._weights = {}
+
+	def _check_generation(self, redis):
+		if time.time() - self._generation_checked_at < self.generation_check_interval:
+			return
+
+		generation = int(redis.get(GENERATION_KEY) or 0)
+		if generation != self._generation:
+			self._generation = generation
+			self._live_cluster_sets = {}
+			self._weights = {}
+		self._generation_checked_at = time.time()
+
+	def _get_or_load(self, redis, key, load):
+		raw = redis.get(key)
+		if raw is not None:
+			return pickle.loads(raw)
+
+		value = load()
+		redis.set(key, pickle.dumps(value, pickle.HIGHEST_PROTOCOL), ex=self.ttl)
+		return value
+
+	def get_version(self, game_format):
+		"""
+		Return a (generation, live cluster set id) tuple identifying the signature weights
+		of a format. It changes whenever those weights may have changed.
+		"""
+		game_format = int(game_format)
+		with self._lock:
+			redis = self.get_redis()
+			self._check_generation(redis)
+			live_cluster_set_id = self._live_cluster_sets.get(game_format)
+			if live_cluster_set_id is None:
+				live_cluster_set_id = self._get_or_load(
+					redis,
+					LIVE_CLUSTER_SET_KEY % (self._generation, game_format),
+					lambda: _get_live_cluster_set_id(game_format)
+				)
+				self._live_cluster_sets[game_format] = live_cluster_set_id
+			return self._generation, live_cluster_set_id
+
+	def get(self, game_format, player_class):
+		"""Return the live signature weights for a format and player class."""
+		game_format, player_class = int(game_format), int(player_class)
+		generation, live_cluster_set_id = self.get_version(game_format)
+		key = (live_cluster_set_id, game_format, player_class)
+
+		with self._lock:
+			weights = self._weights.get(key)
+			if weights is None:
+				weights = self._get_or_load(
+					self.get_redis(),
+					WEIGHTS_KEY % ((generation, ) + key),
+					lambda: _get_signature_weights(game_format, player_class)
+				)
+				self._weights[key] = weights
+			return weights
+
+	def invalidate(self):
+		"""Invalidate the cached weights, in this process and in Redis."""
+		with self._lock:
+			self.get_redis().incr(GENERATION_KEY)
+			self._generation_checked_at = 0
+
+	def warm(self, game_formats=(FormatType.FT_STANDARD, FormatType.FT_WILD)):
+		"""Load the weights of every player class of the given formats."""
+		for game_format in game_formats:
+			for player_class in CardClass:
+				if player_class.is_playable:
+					self.get(game_format, player_class)
+
+
+live_signature_weights = SignatureWeightsCache(
+	get_signature_weights_redis,
+	generation_check_interval=getattr(
+		settings, "SIGNATURE_WEIGHTS_GENERATION_CHECK_SECONDS", 30
+	),
+)
+
+
+_signature_weights_warmed = False
+_warm_lock = threading.Lock()
+
+
+def warm_signature_weights():
+	"""
+	Load the live signature weights into the process-wide cache, once per process: at
+	web worker startup, or on the first batch a Lambda container processes.
+
+	This is best effort: a worker that fails to warm the cache loads the weights on
+	first use instead.
+	"""
+	global _signature_weights_warmed
+
+	if not getattr(settings, "SIGNATURE_WEIGHTS_WARM_ON_STARTUP", False):
+		return
+
+	with _warm_lock:
+		if _signature_weights_warmed:
+			return
+		_signature_weights_warmed = True
+
+		try:
+			live_signature_weights.warm()
+		except Exception:
+			log.exception("Could not warm the signature weights cache")
+		finally:
+			# Don't hand a database connection over to forked workers
+			connections.close_all()
@@ -16,6 +16,14 @@ def _generate_upload_path(shortid):
 	return "replays/%s.hsreplay.xml" % (shortid)
 
 
+def _generate_source_path(shortid):
+	return "replays/%s.hsreplay.json" % (shortid)
+
+
+def _generate_source_log_path(shortid):
+	return "replays/%s.power.log" % (shortid)
+
+
 def generate_upload_path(instance, filename):
 	return _generate_upload_path(instance.shortid)
 
@@ -403,6 +411,16 @@ class GameReplay(models.Model):
 	def pretty_name_spoilerfree(self):
 		return self.build_pretty_name(spoilers=False)
 
+	@property
+	def replay_xml_url(self):
+		"""
+		The URL of the replay's hsreplay.xml. If the document was not generated during
+		processing (see REPLAY_XML_LAZY_GENERATION), it is rendered on first request.
+		"""
+		if not self.hsreplay_version:
+			return reverse("games_replay_xml", kwargs={"shortid": self.shortid})
+		return self.replay_xml.url
+
 	@property
 	def upload_event_admin_url(self):
 		from hsreplaynet.uploads.models import UploadEvent
@@ -509,3 +527,6 @@ def cleanup_hsreplay_file(sender, instance, **kwargs):
 	file = instance.replay_xml
 	if file.name:
 		delete_file(file.name)
+	if not instance.hsreplay_version:
+		delete_file(_generate_source_path(instance.shortid))
+		delete_file(_generate_source_log_path(instance.shortid))
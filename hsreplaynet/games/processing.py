@@ -1,17 +1,21 @@
 import json
 import re
+import threading
+import time
 from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor, TimeoutError
 from functools import reduce
-from io import StringIO
+from io import TextIOWrapper
 
 from dateutil.parser import parse as dateutil_parse
 from django.conf import settings
 from django.core.exceptions import ValidationError
 from django.core.files.base import ContentFile
 from django.core.files.storage import default_storage
+from django.db import connections, transaction
+from django.db.models import Prefetch
 from django.db.utils import IntegrityError
 from django.utils import timezone
-from django_hearthstone.cards.models import Card
 from hearthstone.enums import (
 	BnetGameType, BnetRegion, CardClass, CardType, FormatType, GameTag, PlayState
 )
@@ -33,16 +37,20 @@ from hsreplaynet.api.live.distributions import (
 )
 from hsreplaynet.decks.models import Deck
 from hsreplaynet.games.exporters import GameDigestExporter
-from hsreplaynet.uploads.models import UploadEventStatus
+from hsreplaynet.uploads.models import UploadEvent, UploadEventStatus
 from hsreplaynet.uploads.utils import user_agent_product
 from hsreplaynet.utils import guess_ladder_season, log
+from hsreplaynet.utils.cards import get_card
+from hsreplaynet.utils.db import bulk_get_or_create
 from hsreplaynet.utils.influx import influx_metric, influx_timer
 from hsreplaynet.utils.instrumentation import error_handler
 from hsreplaynet.utils.prediction import deck_prediction_tree, inverse_lookup_table
+from hsreplaynet.utils.redis import RedisPopularityDistribution
 from hsreplaynet.vods.models import TwitchVod
 
 from .models import (
-	GameReplay, GlobalGame, GlobalGamePlayer, ReplayAlias, _generate_upload_path
+	GameReplay, GlobalGame, GlobalGamePlayer, ReplayAlias,
+	_generate_source_log_path, _generate_source_path, _generate_upload_path
 )
 
 
@@ -148,6 +156,147 @@ def save_hsreplay_document(hsreplay_doc, shortid, existing_replay):
 	return ContentFile(xml_str)
 
 
+# Namespaces the advisory locks taken while rendering an hsreplay.xml on demand
+REPLAY_XML_LOCK_NAMESPACE = 1
+
+# The metadata create_hsreplay_document() needs besides the log itself
+HSREPLAY_SOURCE_META_KEYS = (
+	"build", "hs_game_type", "format", "scenario_id", "reconnecting", "player1", "player2"
+)
+
+
+def save_hsreplay_source(shortid, upload_event, meta):
+	"""
+	Save what is needed to generate the replay's hsreplay.xml later on: a copy of the
+	uploaded log and the handful of metadata fields that end up in the document.
+	"""
+	source = {k: meta[k] for k in HSREPLAY_SOURCE_META_KEYS if k in meta}
+	# Uploaded logs are reaped after a few days, but the hsreplay.xml may be requested
+	# at any time: keep a copy of the log for as long as the replay needs it.
+	source["log"] = copy_upload_log(upload_event, _generate_source_log_path(shortid))
+	source["match_start"] = meta["match_start"]
+	source["upload_created"] = upload_event.created.isoformat()
+
+	path = _generate_source_path(shortid)
+	if default_storage.exists(path):
+		default_storage.delete(path)
+	default_storage.save(path, ContentFile(json.dumps(source)))
+	return path
+
+
+def copy_upload_log(upload_event, path):
+	"""
+	Copy the uploaded log of an UploadEvent to `path` in the default storage (server
+	side, on S3) and return the path.
+	"""
+	if settings.AWS_STORAGE_BUCKET_NAME:
+		from hsreplaynet.utils.aws.clients import S3
+
+		bucket = settings.AWS_STORAGE_BUCKET_NAME
+		copy_source = "%s/%s" % (bucket, upload_event.file.name)
+		S3.copy_object(Bucket=bucket, Key=path, CopySource=copy_source)
+	else:
+		if default_storage.exists(path):
+			default_storage.delete(path)
+		with default_storage.open(upload_event.file.name, mode="rb") as log_file:
+			default_storage.save(path, log_file)
+
+	return path
+
+
+def render_replay_xml(replay):
+	"""
+	Generate and save the hsreplay.xml of a replay which was processed without one
+	(see REPLAY_XML_LAZY_GENERATION), by parsing its uploaded log again.
+	"""
+	source_path = _generate_source_path(replay.shortid)
+	if not default_storage.exists(source_path):
+		log.warning("No hsreplay.xml source for replay %r", replay.shortid)
+		return False
+
+	with default_storage.open(source_path, mode="rb") as source_file:
+		source = json.loads(source_file.read().decode("utf-8"))
+
+	upload_event = UploadEvent(file=source["log"])
+	match_start = get_valid_match_start(
+		dateutil_parse(source["match_start"]), dateutil_parse(source["upload_created"])
+	)
+	with influx_timer("replay_xml_render_duration"):
+		with upload_event.open_log_stream() as log_file:
+			parser = _parse_log(log_file, match_start)
+		entity_tree = EntityTreeExporter(parser.games[0]).export().game
+		hsreplay_doc = create_hsreplay_document(parser, entity_tree, source, replay.global_game)
+		xml_file = save_hsreplay_document(hsreplay_doc, replay.shortid, replay)
+
+	influx_metric("replay_xml_num_bytes", {"size": xml_file.size})
+	replay.replay_xml.save("hsreplay.xml", xml_file, save=False)
+	replay.hsreplay_version = hsreplay_version
+	replay.save(update_fields=["replay_xml", "hsreplay_version"])
+	default_storage.delete(source_path)
+	if source["log"] == _generate_source_log_path(replay.shortid):
+		default_storage.delete(source["log"])
+	return True
+
+
+def ensure_replay_xml(replay):
+	"""
+	Make sure the replay's hsreplay.xml exists, rendering it if needed.
+
+	Return True once it exists and False if it cannot be rendered. Concurrent calls for
+	the same replay don't wait for each other: the ones that find it being rendered
+	elsewhere return None.
+	"""
+	from hsreplaynet.utils.synchronization import advisory_lock
+
+	if replay.hsreplay_version:
+		return True
+
+	with advisory_lock([REPLAY_XML_LOCK_NAMESPACE, replay.id]) as acquired:
+		if not acquired:
+			return None
+		replay.refresh_from_db(fields=["replay_xml", "hsreplay_version"])
+		if replay.hsreplay_version:
+			return True
+		return render_replay_xml(replay)
+
+
+def schedule_replay_xml_render(replay):
+	"""
+	Render the replay's hsreplay.xml in the background, with the RenderReplayXML Lambda.
+
+	A render is scheduled at most once every REPLAY_XML_RENDER_SCHEDULE_SECONDS per
+	replay, however many times it is requested in the meantime.
+	"""
+	from django.core.cache import caches
+	from hsreplaynet.utils.aws.clients import LAMBDA
+
+	key = "REPLAY_XML_RENDER:%s" % (replay.shortid)
+	if caches["default"].add(key, 1, timeout=settings.REPLAY_XML_RENDER_SCHEDULE_SECONDS):
+		LAMBDA.invoke(
+			FunctionName="RenderReplayXML",
+			InvocationType="Event",
+			Payload=json.dumps({"shortid": replay.shortid}),
+		)
+
+
+def request_replay_xml(replay):
+	"""
+	Request the replay's hsreplay.xml for a web request, which must not be held up
+	rendering it.
+
+	Return True if it exists, False if it cannot be rendered and None if it is being
+	rendered (in which case it should be requested again shortly).
+	"""
+	if replay.hsreplay_version:
+		return True
+
+	if settings.REPLAY_XML_RENDER_USE_LAMBDA:
+		schedule_replay_xml_render(replay)
+		return None
+
+	return ensure_replay_xml(replay)
+
+
 def generate_globalgame_digest(packet_tree):
 	digest_exporter = GameDigestExporter(packet_tree)
 	digest_exporter.export()
@@ -231,7 +380,6 @@ def find_or_create_replay(parser, entity_tree, meta, upload_event, global_game,
 		friendly_player.player_id,
 		global_game.game_type
 	)
-	hsreplay_doc = create_hsreplay_document(parser, entity_tree, meta, global_game)
 
 	common = {
 		"global_game": global_game,
@@ -255,10 +403,18 @@ def find_or_create_replay(parser, entity_tree, meta, upload_event, global_game,
 		"opponent_revealed_deck": opponent_revealed_deck,
 	}
 
-	# Create and save hsreplay.xml file
-	# Noop in the database, as it should already be set before the initial save()
-	xml_file = save_hsreplay_document(hsreplay_doc, shortid, existing_replay)
-	influx_metric("replay_xml_num_bytes", {"size": xml_file.size})
+	if settings.REPLAY_XML_LAZY_GENERATION:
+		# Only keep a pointer to the log around; the hsreplay.xml is rendered from it the
+		# first time it is requested (see ensure_replay_xml()).
+		save_hsreplay_source(shortid, upload_event, meta)
+		defaults["hsreplay_version"] = ""
+		xml_file = None
+	else:
+		# Create and save hsreplay.xml file
+		# Noop in the database, as it should already be set before the initial save()
+		hsreplay_doc = create_hsreplay_document(parser, entity_tree, meta, global_game)
+		xml_file = save_hsreplay_document(hsreplay_doc, shortid, existing_replay)
+		influx_metric("replay_xml_num_bytes", {"size": xml_file.size})
 
 	if existing_replay:
 		log.debug("Found existing replay %r", existing_replay.shortid)
@@ -275,7 +431,8 @@ def find_or_create_replay(parser, entity_tree, meta, upload_event, global_game,
 			setattr(existing_replay, k, v)
 
 		# Save the replay file
-		existing_replay.replay_xml.save("hsreplay.xml", xml_file, save=False)
+		if xml_file is not None:
+			existing_replay.replay_xml.save("hsreplay.xml", xml_file, save=False)
 
 		# Finally, save to the db and exit early with created=False
 		existing_replay.save()
@@ -308,7 +465,8 @@ def find_or_create_replay(parser, entity_tree, meta, upload_event, global_game,
 		raise ReplayAlreadyExists(msg, replay)
 
 	# Save the replay file
-	replay.replay_xml.save("hsreplay.xml", xml_file, save=False)
+	if xml_file is not None:
+		replay.replay_xml.save("hsreplay.xml", xml_file, save=False)
 
 	if replay.shortid != upload_event.shortid:
 		# We must ensure an alias for this upload_event.shortid is recorded
@@ -360,7 +518,7 @@ def process_upload_event(upload_event):
 		upload_event.save()
 
 	try:
-		replay, do_flush_exporter = do_process_upload_event(upload_event)
+		replay, do_flush_exporter, side_effects = do_process_upload_event(upload_event)
 	except Exception as e:
 		from traceback import format_exc
 		upload_event.error = str(e)
@@ -398,10 +556,12 @@ def process_upload_event(upload_event):
 			}
 		)
 
+	side_effects.wait()
+
 	return replay
 
 
-def parse_upload_event(upload_event, meta):
+def get_upload_match_start(upload_event, meta):
 	orig_match_start = dateutil_parse(meta["match_start"])
 	match_start = get_valid_match_start(orig_match_start, upload_event.created)
 	if match_start != orig_match_start:
@@ -409,22 +569,48 @@ def parse_upload_event(upload_event, meta):
 		upload_event.save()
 		difference = (orig_match_start - match_start).seconds
 		influx_metric("tainted_replay", {"count": 1, "difference": difference})
+	return match_start
 
-	log_bytes = upload_event.log_bytes()
-	if not log_bytes:
-		raise ValidationError("The uploaded log file is empty.")
 
-	powerlog = StringIO(log_bytes.decode("utf-8"))
-	upload_event.file.close()
+def parse_upload_event(upload_event, meta):
+	match_start = get_upload_match_start(upload_event, meta)
+
+	# The log is streamed from storage straight into the parser, one line at a time
+	with upload_event.open_log_stream() as log_file:
+		return _parse_log(log_file, match_start)
 
+
+def _parse_log(log_file, match_start):
 	parser = LogParser()
 	parser._game_state_processor = "GameState"
 	parser._current_date = match_start
-	parser.read(powerlog)
+
+	powerlog = TextIOWrapper(log_file, encoding="utf-8", newline="\n")
+	num_lines = 0
+	for line in _iter_log_lines(powerlog):
+		parser.read_line(line)
+		num_lines += 1
+
+	if not num_lines:
+		raise ValidationError("The uploaded log file is empty.")
 
 	return parser
 
 
+def _iter_log_lines(powerlog):
+	"""
+	Yield the lines of the log, raising ValidationError if the underlying stream
+	cannot be read (eg. because of corrupt compression).
+	"""
+	from botocore.vendored.requests.packages.urllib3.exceptions import ReadTimeoutError
+
+	try:
+		for line in powerlog:
+			yield line
+	except (OSError, EOFError, ReadTimeoutError) as e:
+		raise ValidationError("Could not read uploaded log: {0}".format(e))
+
+
 def fetch_active_stream_prefix():
 	from hsreplaynet.uploads.models import RedshiftStagingTrack
 	prefix = RedshiftStagingTrack.objects.get_active_track_prefix()
@@ -482,9 +668,8 @@ def validate_parser(parser, meta):
 		if not player._hero:
 			raise UnsupportedReplay("No hero found for player %r" % (player.name))
 
-		try:
-			db_hero = Card.objects.get(card_id=player._hero.card_id)
-		except Card.DoesNotExist:
+		db_hero = get_card(player._hero.card_id)
+		if db_hero is None:
 			raise UnsupportedReplay("Hero %r not found." % (player._hero))
 		if db_hero.type != CardType.HERO:
 			raise ValidationError("%r is not a valid hero." % (player._hero))
@@ -550,36 +735,40 @@ def _pick_decklist(meta, decklist_from_meta, replay_decklist, is_friendly_player
 		return decklist_from_meta
 
 
-def update_global_players(global_game, entity_tree, meta, upload_event, exporter):
-	# Fill the player metadata and objects
-	players = {}
-	played_cards = exporter.export_played_cards()
-
-	is_spectated_replay = meta.get("spectator_mode", False)
-
-	for player in entity_tree.players:
-		is_friendly_player = player.player_id == meta["friendly_player"]
-		player_meta = meta.get("player%i" % (player.player_id), {})
+def _get_or_create_player_decks(global_game, meta, upload_event, player_decklists):
+	"""
+	Resolve the decks for a list of (player, decklist) tuples in a single round trip.
 
-		decklist_from_meta = player_meta.get("deck")
-		replay_decklist = [
-			get_original_card_id(c.initial_card_id)
-			for c in player.initial_deck if c.initial_card_id
-		]
-		decklist = _pick_decklist(
-			meta, decklist_from_meta, replay_decklist, is_friendly_player=is_friendly_player
-		)
+	If the batched call fails (eg. because some cards are not in the DB yet), fall back
+	to resolving the decks one by one so that only the bad decks are replaced.
+	"""
+	id_lists = [(decklist, player._hero.card_id) for player, decklist in player_decklists]
+	try:
+		with transaction.atomic():
+			results = Deck.objects.get_or_create_from_id_lists(
+				id_lists,
+				game_type=global_game.game_type,
+				classify_archetype=True
+			)
+	except IntegrityError:
+		results = None
 
-		player_hero_id = player._hero.card_id
+	decks = []
+	for i, (player, decklist) in enumerate(player_decklists):
+		if results:
+			deck, created = results[i]
+			log.debug("Prepared deck %i (created=%r)", deck.id, created)
+			decks.append(deck)
+			continue
 
 		try:
-			deck, _ = Deck.objects.get_or_create_from_id_list(
+			deck, created = Deck.objects.get_or_create_from_id_list(
 				decklist,
-				hero_id=player_hero_id,
+				hero_id=player._hero.card_id,
 				game_type=global_game.game_type,
 				classify_archetype=True
 			)
-			log.debug("Prepared deck %i (created=%r)", deck.id, _)
+			log.debug("Prepared deck %i (created=%r)", deck.id, created)
 		except IntegrityError as e:
 			# This will happen if cards in the deck are not in the DB
 			# For example, during a patch release
@@ -595,6 +784,39 @@ def update_global_players(global_game, entity_tree, meta, upload_event, exporter
 			global_game.tainted_decks = True
 			# Replace with an empty deck
 			deck, _ = Deck.objects.get_or_create_from_id_list([])
+		decks.append(deck)
+
+	return decks
+
+
+def update_global_players(global_game, entity_tree, meta, upload_event, exporter):
+	# Fill the player metadata and objects
+	players = {}
+	played_cards = exporter.export_played_cards()
+
+	is_spectated_replay = meta.get("spectator_mode", False)
+
+	# The decks, BlizzardAccounts and GlobalGamePlayers of all the players are each
+	# resolved in bulk, to keep the number of round trips to the DB constant.
+	player_decklists = []
+	for player in entity_tree.players:
+		is_friendly_player = player.player_id == meta["friendly_player"]
+		player_meta = meta.get("player%i" % (player.player_id), {})
+
+		decklist_from_meta = player_meta.get("deck")
+		replay_decklist = [
+			get_original_card_id(c.initial_card_id)
+			for c in player.initial_deck if c.initial_card_id
+		]
+		decklist = _pick_decklist(
+			meta, decklist_from_meta, replay_decklist, is_friendly_player=is_friendly_player
+		)
+		player_decklists.append((player, decklist))
+
+	decks = _get_or_create_player_decks(global_game, meta, upload_event, player_decklists)
+
+	for (player, decklist), deck in zip(player_decklists, decks):
+		is_friendly_player = player.player_id == meta["friendly_player"]
 
 		capture_played_card_stats(
 			global_game,
@@ -602,6 +824,7 @@ def update_global_players(global_game, entity_tree, meta, upload_event, exporter
 			is_friendly_player
 		)
 
+		player_hero_id = player._hero.card_id
 		player_class = Deck.objects._convert_hero_id_to_player_class(player_hero_id)
 
 		# tree-based deck prediction
@@ -679,11 +902,14 @@ def update_global_players(global_game, entity_tree, meta, upload_event, exporter
 				),
 			)
 
+	# Create the BlizzardAccounts first
+	upload_user = None
+	claiming_users = {}
+	blizzard_accounts = []
+	for player, _ in player_decklists:
+		is_friendly_player = player.player_id == meta["friendly_player"]
 		name, _ = player.names
-		if not name:
-			pass
 
-		# Create the BlizzardAccount first
 		defaults = {
 			"region": BnetRegion.from_account_hi(player.account_hi),
 			"battletag": name,
@@ -691,23 +917,37 @@ def update_global_players(global_game, entity_tree, meta, upload_event, exporter
 
 		if not is_spectated_replay and not player.is_ai and is_friendly_player:
 			if upload_event.token_uuid:
-				auth_token = AuthToken.objects.get(key=upload_event.token_uuid)
-				user = auth_token.user
+				if upload_user is None:
+					auth_token = AuthToken.objects.select_related("user").get(
+						key=upload_event.token_uuid
+					)
+					upload_user = auth_token.user
+				user = upload_user
 				if user and not user.is_fake:
 					# and user.battletag and user.battletag.startswith(player.name):
 					defaults["user"] = user
+					claiming_users[player.player_id] = user
 
-		blizzard_account, created = BlizzardAccount.objects.get_or_create(
+		blizzard_accounts.append(BlizzardAccount(
 			account_hi=player.account_hi,
 			account_lo=player.account_lo,
-			defaults=defaults
-		)
+			**defaults
+		))
+
+	blizzard_accounts = bulk_get_or_create(
+		BlizzardAccount, blizzard_accounts, ("account_hi", "account_lo")
+	)
+
+	names = {}
+	for (player, _), (blizzard_account, created) in zip(player_decklists, blizzard_accounts):
+		name, _ = player.names
 		if not created:
 			if not name:
 				# Maybe we have an UNKNOWN HUMAN PLAYER for example
 				# Use the BlizzardAccount's name in that case
 				name = blizzard_account.battletag
-			if _can_claim(blizzard_account) and "user" in defaults:
+			user = claiming_users.get(player.player_id)
+			if _can_claim(blizzard_account) and user:
 				# Set BlizzardAccount.user if it's an available claim for the user
 				influx_metric("pegasus_account_claimed", {
 					"count": 1,
@@ -716,15 +956,22 @@ def update_global_players(global_game, entity_tree, meta, upload_event, exporter
 					"account_lo": str(blizzard_account.account_lo),
 					"game": str(global_game.id)
 				})
-				blizzard_account.user = defaults["user"]
+				blizzard_account.user = user
 				blizzard_account.save()
 			elif "#" in name and name != blizzard_account.battletag and not player.is_ai:
 				blizzard_account.battletag = name
 				blizzard_account.save()
 
 		log.debug("Prepared BlizzardAccount %r", blizzard_account)
+		names[player.player_id] = name
+
+	# Now create the GlobalGamePlayer objects
+	game_players, updates = [], []
+	for (player, _), deck, (blizzard_account, _) in zip(
+		player_decklists, decks, blizzard_accounts
+	):
+		player_meta = meta.get("player%i" % (player.player_id), {})
 
-		# Now create the GlobalGamePlayer object
 		common = {
 			"game": global_game,
 			"player_id": player.player_id,
@@ -732,7 +979,7 @@ def update_global_players(global_game, entity_tree, meta, upload_event, exporter
 		defaults = {
 			"is_first": player.tags.get(GameTag.FIRST_PLAYER, False),
 			"is_ai": player.is_ai,
-			"hero_id": player_hero_id,
+			"hero_id": player._hero.card_id,
 			"hero_premium": player._hero.tags.get(GameTag.PREMIUM, False),
 			"final_state": player.tags.get(GameTag.PLAYSTATE, 0),
 			"extra_turns": player.tags.get(GameTag.EXTRA_TURNS_TAKEN_THIS_GAME, 0),
@@ -740,7 +987,7 @@ def update_global_players(global_game, entity_tree, meta, upload_event, exporter
 		}
 
 		update = {
-			"name": name,
+			"name": names[player.player_id],
 			"pegasus_account": blizzard_account,
 			"rank": player_meta.get("rank"),
 			"legend_rank": player_meta.get("legend_rank"),
@@ -752,7 +999,14 @@ def update_global_players(global_game, entity_tree, meta, upload_event, exporter
 		}
 
 		defaults.update(update)
-		game_player, created = GlobalGamePlayer.objects.get_or_create(defaults=defaults, **common)
+		game_players.append(GlobalGamePlayer(**common, **defaults))
+		updates.append(update)
+
+	game_players = bulk_get_or_create(GlobalGamePlayer, game_players, ("game_id", "player_id"))
+
+	for (player, decklist), deck, update, (game_player, created) in zip(
+		player_decklists, decks, updates, game_players
+	):
 		log.debug("Prepared player %r (%i) (created=%r)", game_player, game_player.id, created)
 
 		if not created:
@@ -1002,6 +1256,7 @@ def predict_deck(
 		"match_attempts": res.match_attempts,
 		"tie": res.tie
 	}
+	fields.update({"%s_ms" % (phase): ms for phase, ms in res.timings.items()})
 
 	if res.node:
 		fields["depth"] = res.node.depth
@@ -1228,13 +1483,127 @@ def update_player_class_distribution(replay):
 	try:
 		game_type_name = BnetGameType(replay.global_game.game_type).name
 		distribution = get_player_class_distribution(game_type_name, use_lua=False)
-		opponent = replay.opposing_player
+		opponent = replay.player(get_opponent_player_id(replay))
 		player_class = opponent.hero_class_name
 		distribution.increment(player_class, win=opponent.won)
 	except Exception as e:
 		error_handler(e)
 
 
+def get_opponent_player_id(replay):
+	return 2 if replay.friendly_player_id == 1 else 1
+
+
+def get_side_effect_replay(replay, meta):
+	"""
+	Reload a replay along with everything its side effects read from it.
+
+	The global game, the user and the players (with their heroes, accounts and decks)
+	are fetched up front, so the side effect sinks can run off the processing thread
+	without issuing any queries of their own.
+	"""
+	players = GlobalGamePlayer.objects.select_related(
+		"hero", "pegasus_account", "deck_list__archetype",
+		"deck_list__guessed_full_deck__archetype"
+	)
+	snapshot = GameReplay.objects.select_related("global_game", "user").prefetch_related(
+		Prefetch("global_game__players", queryset=players)
+	).get(pk=replay.pk)
+
+	if has_twitch_vod_url(meta):
+		# Computing the deckstring takes a few queries; it is cached on the deck.
+		snapshot.player(snapshot.friendly_player_id).deck_list.deckstring
+
+	return snapshot
+
+
+def run_replay_side_effects(replay, meta):
+	"""
+	Start the side effects of processing a replay, returning their ReplaySideEffects.
+
+	The side effects are best effort: if the replay can't be reloaded for them, the
+	error is reported and they are skipped, rather than failing the upload.
+	"""
+	try:
+		side_effect_replay = get_side_effect_replay(replay, meta)
+	except Exception as e:
+		error_handler(e)
+		influx_metric("replay_side_effect_prefetch_error", {"count": 1})
+		return ReplaySideEffects(replay)
+
+	side_effects = ReplaySideEffects(side_effect_replay)
+	side_effects.run(
+		"player_class_distribution", update_player_class_distribution, side_effect_replay
+	)
+	side_effects.run("replay_feed", update_replay_feed, side_effect_replay)
+	side_effects.run("game_counter", update_game_counter, side_effect_replay)
+
+	# Persist Twitch VOD metadata to DynamoDB if present
+	if has_twitch_vod_url(meta):
+		side_effects.run("twitch_vod", record_twitch_vod, side_effect_replay, meta)
+
+	return side_effects
+
+
+_side_effect_executor = None
+_side_effect_executor_lock = threading.Lock()
+
+
+def get_side_effect_executor():
+	global _side_effect_executor
+
+	with _side_effect_executor_lock:
+		if _side_effect_executor is None:
+			_side_effect_executor = ThreadPoolExecutor(
+				max_workers=settings.REPLAY_SIDE_EFFECT_WORKERS,
+				thread_name_prefix="replay-side-effects"
+			)
+
+	return _side_effect_executor
+
+
+class ReplaySideEffects:
+	"""
+	Runs the independent Redis and DynamoDB writes that follow replay persistence.
+
+	Each sink is submitted to a shared thread pool by run(), and wait() collects them,
+	giving each one until its own deadline. A sink that raises is reported and does not
+	affect the others; a sink that times out is left running and counted in influx.
+	"""
+
+	def __init__(self, replay):
+		self.replay = replay
+		self._pending = []
+
+	def run(self, name, sink, *args, timeout=None):
+		if timeout is None:
+			timeout = settings.REPLAY_SIDE_EFFECT_TIMEOUT
+
+		future = get_side_effect_executor().submit(self._run_sink, name, sink, *args)
+		self._pending.append((name, future, time.monotonic() + timeout))
+
+	@staticmethod
+	def _run_sink(name, sink, *args):
+		try:
+			with influx_timer("replay_side_effect_duration", sink=name):
+				sink(*args)
+		except Exception as e:
+			error_handler(e)
+		finally:
+			# Django connections are thread local; close any this sink opened
+			connections.close_all()
+
+	def wait(self):
+		for name, future, deadline in self._pending:
+			try:
+				future.result(timeout=max(0, deadline - time.monotonic()))
+			except TimeoutError:
+				log.warning("Replay side effect %r timed out", name)
+				influx_metric("replay_side_effect_timeout", {"count": 1}, sink=name)
+
+		self._pending = []
+
+
 def elapsed_seconds_from_match_end(global_game):
 	current_ts = timezone.now()
 	match_end = global_game.match_end
@@ -1249,8 +1618,9 @@ def capture_played_card_stats(global_game, played_cards, is_friendly_player):
 			game_type_name = BnetGameType(global_game.game_type).name
 			redis = get_live_stats_redis()
 			dist = get_played_cards_distribution(game_type_name, redis_client=redis)
-			for dbf_id in played_cards:
-				dist.increment(dbf_id)
+			RedisPopularityDistribution.increment_many(
+				(dist, dbf_id) for dbf_id in played_cards
+			)
 	except Exception as e:
 		error_handler(e)
 
@@ -1308,7 +1678,7 @@ def record_twitch_vod(replay, meta):
 	game = replay.global_game
 	game_length = game.match_end.timestamp() - game.match_start.timestamp()
 
-	friendly_player = replay.friendly_player
+	friendly_player = replay.player(replay.friendly_player_id)
 	friendly_deck = friendly_player.deck_list
 
 	vod_meta = meta["twitch_vod"]
@@ -1342,7 +1712,7 @@ def record_twitch_vod(replay, meta):
 		else:
 			twitch_vod.combined_rank = "R%s" % friendly_player.rank
 
-		opposing_player = replay.opposing_player
+		opposing_player = replay.player(get_opponent_player_id(replay))
 
 		twitch_vod.opposing_player_class = opposing_player.hero_class_name
 
@@ -1414,14 +1784,9 @@ def do_process_upload_event(upload_event):
 
 	update_last_replay_upload(upload_event)
 
-	update_player_class_distribution(replay)
-	update_replay_feed(replay)
-	update_game_counter(replay)
-
-	# Persist Twitch VOD metadata to DynamoDB if present
-
-	if has_twitch_vod_url(meta):
-		record_twitch_vod(replay, meta)
+	# The remaining side effects are independent writes to Redis and DynamoDB; run them
+	# concurrently and let process_upload_event() wait for them after saving the event.
+	side_effects = run_replay_side_effects(replay, meta)
 
 	# Defer flushing the exporter until after the UploadEvent is set to SUCCESS
 	# So that the player can start watching their replay sooner
@@ -1479,7 +1844,7 @@ def do_process_upload_event(upload_event):
 		else:
 			log.debug("Did not acquire redshift lock. Will not flush to redshift")
 
-	return replay, do_flush_exporter
+	return replay, do_flush_exporter, side_effects
 
 
 def get_records_to_flush():
@@ -143,6 +143,8 @@ class GameReplaySerializer(serializers.ModelSerializer):
 	opposing_player = GlobalGamePlayerSerializer(read_only=True)
 	opposing_deck = DeckSerializer(read_only=True)
 
+	replay_xml = serializers.SerializerMethodField()
+
 	class Meta:
 		model = GameReplay
 		fields = (
@@ -153,6 +155,13 @@ class GameReplaySerializer(serializers.ModelSerializer):
 		read_only_fields = ("user", "global_game", "replay_xml")
 		lookup_field = "shortid"
 
+	def get_replay_xml(self, instance):
+		url = instance.replay_xml_url
+		request = self.context.get("request")
+		if request is not None:
+			return request.build_absolute_uri(url)
+		return url
+
 
 # Shorter serializer for list queries
 
@@ -1,34 +1,51 @@
 import json
 import logging
-import time
+from base64 import b64decode
 from datetime import datetime
 from io import BytesIO
+from queue import Empty, Queue
 from threading import Thread
 from zlib import decompress
 
 from django.conf import settings
 from django.core.exceptions import ValidationError
+from django.utils.timezone import now
 from hsreplay.document import HSReplayDocument
 
 from hearthsim.identity.accounts.models import AuthToken
 from hearthsim.identity.api.models import APIKey as LegacyAPIKey
 from hsredshift.etl.exporters import RedshiftPublishingExporter
 from hsredshift.etl.firehose import flush_exporter_to_firehose
+from hsreplaynet.decks.signatures import warm_signature_weights
 from hsreplaynet.uploads.models import (
 	RawUpload, UploadEvent, UploadEventStatus, _generate_upload_key
 )
 from hsreplaynet.utils import instrumentation
-from hsreplaynet.utils.aws.clients import LAMBDA, S3
-from hsreplaynet.utils.influx import influx_metric
+from hsreplaynet.utils.aws.clients import KINESIS, LAMBDA, S3
+from hsreplaynet.utils.aws.streams import buffered_firehose_publishing
+from hsreplaynet.utils.influx import influx_metric, influx_timer
 from hsreplaynet.utils.synchronization import CountDownLatch
 
 
+if getattr(settings, "LAMBDA_STREAM_BATCH_PROCESSING_ENABLED", False):
+	# The records are processed by the stream handler itself, so size it for its batch
+	STREAM_HANDLER_CONFIGURATION = {
+		"cpu_seconds": settings.LAMBDA_STREAM_BATCH_PROCESSING_CPU_SECONDS,
+		"memory": settings.LAMBDA_STREAM_BATCH_PROCESSING_MEMORY_MB,
+		"stream_batch_size": settings.LAMBDA_STREAM_BATCH_PROCESSING_BATCH_SIZE,
+	}
+else:
+	STREAM_HANDLER_CONFIGURATION = {
+		"cpu_seconds": 180,
+		"memory": settings.LAMBDA_PROCESSING_MEMORY_MB,
+		"stream_batch_size": getattr(settings, "LAMBDA_STREAM_BATCH_SIZE", 50),
+	}
+
+
 @instrumentation.lambda_handler(
-	cpu_seconds=180,
 	requires_vpc_access=True,
-	memory=settings.LAMBDA_PROCESSING_MEMORY_MB,
 	stream_name=settings.KINESIS_UPLOAD_PROCESSING_STREAM_NAME,
-	stream_batch_size=getattr(settings, "LAMBDA_STREAM_BATCH_SIZE", 50),
+	**STREAM_HANDLER_CONFIGURATION
 )
 def process_replay_upload_stream_handler(event, context):
 	"""
@@ -53,12 +70,26 @@ def process_replay_upload_stream_handler(event, context):
 	When using this lambda, the number of shards should be set to be the fewest number
 	required to achieve the required write throughput. Then the batch size of this lambda
 	should be tuned to achieve the final desired concurrency level.
+
+	If LAMBDA_STREAM_BATCH_PROCESSING_ENABLED is set, the records are instead processed
+	in this invocation by process_kinesis_records_in_batch(), and the handler is deployed
+	with a timeout and memory sized for its batch.
 	"""
 	logger = logging.getLogger("hsreplaynet.lambdas.process_replay_upload_stream_handler")
 	records = event["Records"]
 	num_records = len(records)
 	logger.debug("Kinesis batch handler invoked with %s records", num_records)
 
+	if getattr(settings, "LAMBDA_STREAM_BATCH_PROCESSING_ENABLED", False):
+		# Process the records in this invocation instead of fanning them out
+		process_kinesis_records_in_batch(
+			records,
+			log_group_name=context.log_group_name,
+			log_stream_name=context.log_stream_name,
+			get_remaining_time_in_millis=context.get_remaining_time_in_millis,
+		)
+		return
+
 	countdown_latch = CountDownLatch(num_records)
 
 	def lambda_invoker(payload, shortid):
@@ -113,6 +144,123 @@ def process_single_replay_upload_stream_handler(event, context):
 	process_raw_upload(raw_upload, reprocessing, log_group_name, log_stream_name)
 
 
+def requeue_kinesis_records(records, stream=settings.KINESIS_UPLOAD_PROCESSING_STREAM_NAME):
+	"""Put Kinesis records received by a handler back onto their stream."""
+	return KINESIS.put_records(StreamName=stream, Records=[{
+		"Data": b64decode(record["kinesis"]["data"]),
+		"PartitionKey": record["kinesis"]["partitionKey"],
+	} for record in records])
+
+
+def process_kinesis_records_in_batch(
+	records, log_group_name="", log_stream_name="", num_workers=None,
+	get_remaining_time_in_millis=None
+):
+	"""
+	Process a batch of Kinesis records in the current process.
+
+	This is the counterpart to fanning out one process_single_replay_upload_stream_handler
+	invocation per record: a bounded pool of worker threads pulls records off a shared
+	queue and runs each one through process_raw_upload(). Module-level state such as the
+	card DB, the Redis clients backing the deck prediction trees and each worker's
+	Postgres connection is reused across all the records that worker handles. The records
+	a replay publishes to Firehose are buffered and published together once it has been
+	processed.
+
+	An exception raised while processing one record is reported and does not affect the
+	other records in the batch. Each record reports the same duration metric the single
+	record lambda reports.
+
+	If get_remaining_time_in_millis is given (see the Lambda context), the workers stop
+	starting records LAMBDA_STREAM_BATCH_PROCESSING_DEADLINE_MARGIN_SECONDS before the
+	invocation times out, and the records left over are put back onto the stream. A
+	timeout would otherwise have the whole batch retried, with the records that were
+	being processed at the time skipped as duplicates.
+	"""
+	logger = logging.getLogger("hsreplaynet.lambdas.process_kinesis_records_in_batch")
+
+	if num_workers is None:
+		num_workers = getattr(settings, "LAMBDA_STREAM_BATCH_PROCESSING_WORKERS", 4)
+	num_workers = max(1, min(num_workers, len(records)))
+
+	# Load the archetype signatures once per container, rather than in every worker thread
+	warm_signature_weights()
+
+	queue = Queue()
+	for record in records:
+		queue.put(record)
+
+	measurement = "%s_duration_ms" % (process_single_replay_upload_stream_handler.__name__)
+	margin_millis = 1000 * getattr(
+		settings, "LAMBDA_STREAM_BATCH_PROCESSING_DEADLINE_MARGIN_SECONDS", 200
+	)
+
+	def out_of_time():
+		if get_remaining_time_in_millis is None:
+			return False
+		return get_remaining_time_in_millis() < margin_millis
+
+	def process_record(record):
+		kinesis_event = record["kinesis"]
+		shortid = kinesis_event["partitionKey"]
+		instrumentation.sentry.extra_context({"shortid": shortid})
+
+		try:
+			with influx_timer(measurement, timestamp=now(), batch_mode=True):
+				raw_upload = RawUpload.from_kinesis_event(kinesis_event)
+				reprocessing = raw_upload.attempt_reprocessing
+				logger.info(
+					"Kinesis RawUpload: %r (reprocessing=%r)", raw_upload, reprocessing
+				)
+				# Publish the replay's Firehose records (e.g. archetype updates) together,
+				# before moving on to the next record
+				with buffered_firehose_publishing():
+					process_raw_upload(raw_upload, reprocessing, log_group_name, log_stream_name)
+		except Exception as e:
+			# Errors are isolated to the record that raised them
+			instrumentation.error_handler(e)
+		finally:
+			instrumentation.sentry.context.clear()
+
+	def worker():
+		from django import db
+
+		try:
+			while not out_of_time():
+				try:
+					record = queue.get_nowait()
+				except Empty:
+					break
+				process_record(record)
+		finally:
+			# Django connections are thread local; close the ones this worker opened
+			db.connections.close_all()
+
+	workers = [Thread(target=worker) for _ in range(num_workers)]
+	logger.debug("Processing %s records with %s workers", len(records), num_workers)
+	for thread in workers:
+		thread.start()
+	for thread in workers:
+		thread.join()
+
+	leftover_records = []
+	while not queue.empty():
+		leftover_records.append(queue.get_nowait())
+	if leftover_records:
+		logger.warning(
+			"Out of time, requeueing %s unprocessed records", len(leftover_records)
+		)
+		requeue_kinesis_records(leftover_records)
+
+	influx_metric("kinesis_batch_processing", {
+		"count": 1,
+		"num_records": len(records),
+		"num_workers": num_workers,
+		"num_requeued": len(leftover_records),
+	})
+	logger.debug("All records have been processed")
+
+
 @instrumentation.lambda_handler(
 	cpu_seconds=180,
 	name="ProcessS3CreateObjectV1",
@@ -160,22 +308,16 @@ def _validate_upload_encoding(obj):
 	to a stream of bytes because they're invalid at some lower level of binary
 	encoding - e.g., incorrectly compressed In this case we should mark them invalid
 	immediately.
+
+	Only the first block of the log is read here; the parser raises ValidationError on
+	any corruption found further into the file (see games.processing.parse_upload_event).
 	"""
 
 	from botocore.vendored.requests.packages.urllib3.exceptions import ReadTimeoutError
 
-	def _get_file():
-		try:
-			return obj.file.open(mode="rb")
-		except ReadTimeoutError:
-			time.sleep(1)
-			return obj.file.open(mode="rb")
-
 	try:
-		with _get_file() as log_file:
-			while log_file.read(4096):
-				pass
-	except (OSError, ReadTimeoutError) as e:
+		obj.check_log_stream()
+	except (OSError, EOFError, ReadTimeoutError) as e:
 		raise ValidationError("Could not read uploaded log: {0}".format(e))
 
 
@@ -309,6 +451,29 @@ def process_raw_upload(raw_upload, reprocess=False, log_group_name="", log_strea
 	logger.debug("Done")
 
 
+@instrumentation.lambda_handler(
+	cpu_seconds=60,
+	name="RenderReplayXML",
+	requires_vpc_access=True,
+	memory=settings.LAMBDA_PROCESSING_MEMORY_MB,
+)
+def render_replay_xml_handler(event, context):
+	"""
+	A handler that renders the hsreplay.xml of a replay processed without one.
+	"""
+	from hsreplaynet.games.models import GameReplay
+	from hsreplaynet.games.processing import ensure_replay_xml
+
+	logger = logging.getLogger("hsreplaynet.lambdas.render_replay_xml_handler")
+	replay = GameReplay.objects.find_by_short_id(event["shortid"])
+	if not replay:
+		logger.warning("Replay %r not found", event["shortid"])
+		return
+
+	if ensure_replay_xml(replay) is None:
+		logger.info("Replay %r is already being rendered", replay.shortid)
+
+
 @instrumentation.lambda_handler(
 	cpu_seconds=120,
 	memory=settings.LAMBDA_PROCESSING_MEMORY_MB
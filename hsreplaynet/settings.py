@@ -356,6 +356,11 @@ HSREPLAY_CAMPAIGN = "utm_source=hsreplay.net&utm_medium=referral&utm_campaign=do
 HDT_DOWNLOAD_URL = "https://hsdecktracker.net/download/?%s" % (HSREPLAY_CAMPAIGN)
 HSTRACKER_DOWNLOAD_URL = "https://hsdecktracker.net/hstracker/download/?%s" % (HSREPLAY_CAMPAIGN)
 INFLUX_ENABLED = True
+# Buffer influx points in memory and write them in batches from a background thread
+INFLUX_BUFFER_ENABLED = True
+INFLUX_BUFFER_MAX_SIZE = 10000
+INFLUX_BUFFER_BATCH_SIZE = 500
+INFLUX_BUFFER_FLUSH_INTERVAL = 5
 UPLOAD_USER_AGENT_BLACKLIST = ()
 COLLECTION_UPLOAD_USER_AGENT_BLACKLIST = ()
 
@@ -369,6 +374,9 @@ KINESIS_UPLOAD_PROCESSING_STREAM_NAME = "replay-upload-processing-stream"
 # This value is used to periodically dynamically resize the stream capacity
 KINESIS_STREAM_PROCESSING_THROUGHPUT_SLA_SECONDS = 600
 
+# How many PutRecords batches to have in flight at once when filling the stream
+KINESIS_STREAM_FILL_MAX_IN_FLIGHT_BATCHES = 4
+
 LAMBDA_DEFAULT_EXECUTION_ROLE_NAME = "iam_lambda_execution_role"
 LAMBDA_PRIVATE_EXECUTION_ROLE_NAME = "iam_lambda_private_vpc_execution_role"
 
@@ -376,6 +384,35 @@ LAMBDA_PRIVATE_EXECUTION_ROLE_NAME = "iam_lambda_private_vpc_execution_role"
 # They only need 128MB but higher memory = better CPU (= less processing time)
 LAMBDA_PROCESSING_MEMORY_MB = 1024
 
+# If True, the Kinesis batch handler processes its records in-process with a pool of
+# LAMBDA_STREAM_BATCH_PROCESSING_WORKERS threads instead of invoking one lambda per record
+LAMBDA_STREAM_BATCH_PROCESSING_ENABLED = False
+LAMBDA_STREAM_BATCH_PROCESSING_WORKERS = 4
+# In that mode the handler is deployed with these settings, which are sized for the
+# whole batch (a replay in memory per worker, and several rounds of workers)
+LAMBDA_STREAM_BATCH_PROCESSING_BATCH_SIZE = 16
+LAMBDA_STREAM_BATCH_PROCESSING_CPU_SECONDS = 900
+LAMBDA_STREAM_BATCH_PROCESSING_MEMORY_MB = 3008
+# The records not yet started this many seconds before the handler times out are put
+# back onto the stream, rather than having the whole batch retried after the timeout
+LAMBDA_STREAM_BATCH_PROCESSING_DEADLINE_MARGIN_SECONDS = 200
+
+# The Redis and DynamoDB side effects of a processed replay (live stats, replay feed,
+# Twitch VODs) run concurrently on a shared pool of this many threads. Each one is
+# given REPLAY_SIDE_EFFECT_TIMEOUT seconds to finish once the upload event is saved.
+REPLAY_SIDE_EFFECT_WORKERS = 8
+REPLAY_SIDE_EFFECT_TIMEOUT = 5
+
+# If enabled, replay processing does not generate the hsreplay.xml; it only stores a
+# copy of the uploaded log along with a small JSON source, and the XML is rendered
+# (once) the first time it is requested.
+REPLAY_XML_LAZY_GENERATION = False
+# If enabled, the lazily generated hsreplay.xml are rendered by the RenderReplayXML
+# Lambda rather than by the web request asking for them, which gets a 202 to retry.
+REPLAY_XML_RENDER_USE_LAMBDA = False
+# How long to wait for a scheduled render before scheduling it again
+REPLAY_XML_RENDER_SCHEDULE_SECONDS = 60
+
 SUCCESSFUL_UPLOAD_EVENT_REAPING_DELAY_DAYS = 5
 UNSUCCESSFUL_UPLOAD_EVENT_REAPING_DELAY_DAYS = 30
 
@@ -393,7 +430,19 @@ HSREPLAY_TWITTER_HANDLE = "HSReplayNet"
 # Add `CONNECT_TO_AWS = True` in local_settings.py if you need to use those locally.
 CONNECT_TO_AWS = ENV_AWS
 
+# How often (at most) the in-process card index checks whether the card data changed
+CARD_INDEX_VERSION_CHECK_SECONDS = 300
+# ... and how often (at most) it does so when asked for a card it does not know
+CARD_INDEX_MIN_VERSION_CHECK_SECONDS = 30
+
 ARCHETYPE_CLASSIFICATION_ENABLED = True
+# How often (at most) each process checks whether the live signature weights changed
+SIGNATURE_WEIGHTS_GENERATION_CHECK_SECONDS = 30
+# Whether web and Lambda workers load the live signature weights when they start
+SIGNATURE_WEIGHTS_WARM_ON_STARTUP = True
+# The fraction of unclassified decks classified again (slowly) to instrument why they
+# matched no archetype
+ARCHETYPE_CLASSIFICATION_FAILURE_SAMPLE_RATE = 0.01
 ARCHETYPE_MINIMUM_SIGNATURE_MATCH_CUTOFF_DISTANCE = 5
 ARCHETYPE_CORE_CARD_THRESHOLD = .8
 ARCHETYPE_CORE_CARD_WEIGHT = 1
@@ -426,6 +475,11 @@ REDSHIFT_ETL_UPLOAD_DELAY_LIMIT_HOURS = 36
 # Make sure this is not continuously True since we're limited to 9999 tables in Redshift
 REDSHIFT_ETL_KEEP_STAGING_TABLES = False
 
+# How long each ETL maintenance cycle schedules tasks for, and how often it checks on
+# the statements it launched in the meantime
+REDSHIFT_ETL_MAINTENANCE_TARGET_SECONDS = 55
+REDSHIFT_ETL_MAINTENANCE_POLL_SECONDS = 5
+
 # The percent of unsorted rows that can be in a table after inserts
 # Before a vacuum will be triggered. The Redshift default is 5
 # However we use 0 in order to prefer small vacuums after each track loads
@@ -473,6 +527,17 @@ USE_ARCHETYPE_PREDICTION_LAMBDA = False
 REDSHIFT_TRIGGER_CACHE_REFRESHES_FROM_QUERY_REQUESTS = True
 REDSHIFT_TRIGGER_PERSONALIZED_DATA_REFRESHES_FROM_QUERY_REQUESTS = True
 REDSHIFT_PRESCHEDULE_REFRESHES = True
+# The number of threads used to look up cached query results in bulk
+REDSHIFT_BULK_FETCH_MAX_WORKERS = 16
+
+# Redshift engines keep up to this many idle connections per user (0 disables pooling),
+# and open up to REDSHIFT_CONNECTION_POOL_MAX_OVERFLOW more when they are all in use.
+REDSHIFT_CONNECTION_POOL_SIZE = 4
+REDSHIFT_CONNECTION_POOL_MAX_OVERFLOW = 12
+REDSHIFT_CONNECTION_POOL_RECYCLE_SECONDS = 600
+
+# How long the reflected Redshift schema is reused for before being reflected again
+REDSHIFT_METADATA_TTL_SECONDS = 300
 
 
 WEBHOOKS = {
@@ -499,6 +564,14 @@ ILT_LOOKBACK_MINS = 24 * 60
 ILT_DECK_POPULARITY_LOOKBACK_MINS = 6 * 60
 # Remove only up to this number of cards when fuzzy matching
 ILT_FUZZY_MAXIMUM_CARDS_REMOVED = 6
+# Keep an in-memory copy of the ILTs for predictions (observations still go to redis)
+ILT_IN_MEMORY_ENABLED = False
+# How often the in-memory ILTs pull observations made by other processes from redis
+ILT_IN_MEMORY_REFRESH_SECONDS = 60
+
+# Count the unique daily / weekly contributors with HyperLogLogs instead of sets. They
+# use different keys, so the weekly count starts over when this is switched.
+LIVE_STATS_HYPERLOGLOG_CONTRIBUTORS = False
 
 # Used in some pages such as /downloads
 FONTAWESOME_CSS_URL = "https://cdnjs.cloudflare.com/ajax/libs/font-awesome/4.7.0/css/font-awesome.min.css"
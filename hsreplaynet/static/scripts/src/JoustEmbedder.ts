@@ -203,6 +203,33 @@ export default class JoustEmbedder {
 		if (!this.url) {
 			throw new Error("Not prepared"); // you are
 		}
-		this.launcher.fromUrl(this.url, cb);
+		this.waitForReplay(this.url).then(() => {
+			this.launcher.fromUrl(this.url, cb);
+		});
+	}
+
+	private async waitForReplay(url: string): Promise<void> {
+		// Replays rendered on first request are answered with a 202 (and a Retry-After)
+		// until their hsreplay.xml exists, which Joust does not retry on its own. Those
+		// are served by our own view, so stored replays are not downloaded twice.
+		if (!url.startsWith("/")) {
+			return;
+		}
+		for (let attempt = 0; attempt < 30; attempt++) {
+			let response: Response;
+			try {
+				response = await fetch(url, {
+					credentials: "same-origin",
+					redirect: "manual",
+				});
+			} catch (e) {
+				return;
+			}
+			if (response.status !== 202) {
+				return;
+			}
+			const retryAfter = +response.headers.get("Retry-After") || 2;
+			await new Promise(resolve => setTimeout(resolve, retryAfter * 1000));
+		}
 	}
 }
@@ -0,0 +1,316 @@
+"""
+Dependency-aware scheduling of the Redshift ETL maintenance tasks.
+
+Every table of a staging track goes through the same operations: gathering stats,
+deduplicating, inserting, refreshing materialized views, vacuuming, analyzing and
+cleaning up. Rather than waiting for every table of a track to finish an operation
+before starting the next one, the scheduler moves each table on as soon as the
+operations it depends on have completed, and launches as many tables' (background)
+statements at once as there are free ETL slots in the WLM queue.
+"""
+import time
+from threading import Thread
+
+from hsredshift.etl.materialized_views import get_view_dependencies
+from hsreplaynet.utils import log
+from hsreplaynet.utils.aws.redshift import report_redshift_pool_metrics
+from hsreplaynet.utils.influx import influx_metric, influx_timer
+from hsreplaynet.utils.instrumentation import error_handler
+
+from .models import RedshiftETLStage, RedshiftStagingTrack
+
+
+class TableOperation:
+	def __init__(
+		self, name, ready_stage, stage, complete_stage, get_task,
+		for_staging_tables=True, for_views=True, exclusive=False
+	):
+		"""
+		:param name: the name of the operation, used in logs and metrics
+		:param ready_stage: the stage a table is in when the operation can start
+		:param stage: the stage a table is in while the operation runs
+		:param complete_stage: the stage a table is in once the operation completed
+		:param get_task: the RedshiftStagingTrackTable method returning the task
+		:param for_staging_tables: whether staging tables run the operation (or skip it)
+		:param for_views: whether materialized views run the operation (or skip it)
+		:param exclusive: whether the operation needs the WLM queue to itself
+		"""
+		self.name = name
+		self.ready_stage = ready_stage
+		self.stage = stage
+		self.complete_stage = complete_stage
+		self.get_task = get_task
+		self.for_staging_tables = for_staging_tables
+		self.for_views = for_views
+		self.exclusive = exclusive
+
+	def __str__(self):
+		return self.name
+
+	def applies_to(self, table):
+		if table.is_materialized_view:
+			return self.for_views
+		return self.for_staging_tables
+
+
+TABLE_OPERATIONS = (
+	TableOperation(
+		"gathering_stats",
+		RedshiftETLStage.READY_TO_LOAD,
+		RedshiftETLStage.GATHERING_STATS,
+		RedshiftETLStage.GATHERING_STATS_COMPLETE,
+		"get_gathering_stats_task",
+		for_views=False,
+	),
+	TableOperation(
+		"deduplicating",
+		RedshiftETLStage.GATHERING_STATS_COMPLETE,
+		RedshiftETLStage.DEDUPLICATING,
+		RedshiftETLStage.DEDUPLICATION_COMPLETE,
+		"get_deduplication_task",
+		for_views=False,
+	),
+	TableOperation(
+		"inserting",
+		RedshiftETLStage.DEDUPLICATION_COMPLETE,
+		RedshiftETLStage.INSERTING,
+		RedshiftETLStage.INSERT_COMPLETE,
+		"get_insert_task",
+		for_views=False,
+	),
+	TableOperation(
+		"refreshing_materialized_views",
+		RedshiftETLStage.INSERT_COMPLETE,
+		RedshiftETLStage.REFRESHING_MATERIALIZED_VIEWS,
+		RedshiftETLStage.REFRESHING_MATERIALIZED_VIEWS_COMPLETE,
+		"get_refresh_view_task",
+		for_staging_tables=False,
+	),
+	TableOperation(
+		"vacuuming",
+		RedshiftETLStage.REFRESHING_MATERIALIZED_VIEWS_COMPLETE,
+		RedshiftETLStage.VACUUMING,
+		RedshiftETLStage.VACUUM_COMPLETE,
+		"get_vacuum_task",
+		# The vacuum claims every free slot (see do_vacuum())
+		exclusive=True,
+	),
+	TableOperation(
+		"analyzing",
+		RedshiftETLStage.VACUUM_COMPLETE,
+		RedshiftETLStage.ANALYZING,
+		RedshiftETLStage.ANALYZE_COMPLETE,
+		"get_analyze_task",
+	),
+	TableOperation(
+		"cleaning_up",
+		RedshiftETLStage.ANALYZE_COMPLETE,
+		RedshiftETLStage.CLEANING_UP,
+		RedshiftETLStage.FINISHED,
+		"get_cleanup_task",
+		for_views=False,
+	),
+)
+
+# The stages during which a table has a statement running on the cluster. Cleaning up
+# is synchronous, so a table left in CLEANING_UP is simply cleaned up again.
+IN_FLIGHT_STAGES = tuple(
+	op.stage for op in TABLE_OPERATIONS if op.stage != RedshiftETLStage.CLEANING_UP
+)
+
+
+def get_table_operation(table):
+	"""
+	Return the operation a table is ready for (or running, if it is cleaning up), or None.
+	"""
+	for operation in TABLE_OPERATIONS:
+		if table.stage == operation.ready_stage:
+			return operation
+	if table.stage == RedshiftETLStage.CLEANING_UP:
+		return TABLE_OPERATIONS[-1]
+	return None
+
+
+def dependencies_are_met(operation, table, tables):
+	"""
+	Return whether the operation can start on a table, given the other tables of its track.
+
+	Tables do not depend on each other until their inserts, except through the views:
+	a view is only refreshed once every staging table of the track has been inserted and
+	the views it depends on have been refreshed, and tables are only vacuumed once every
+	view of the track has been refreshed.
+	"""
+	if operation.stage == RedshiftETLStage.REFRESHING_MATERIALIZED_VIEWS:
+		for t in tables:
+			if not t.is_materialized_view and t.stage < RedshiftETLStage.INSERT_COMPLETE:
+				return False
+
+		views = {t.target_table: t for t in tables if t.is_materialized_view}
+		for dependent_view in get_view_dependencies(table.target_table):
+			required_stage = RedshiftETLStage.REFRESHING_MATERIALIZED_VIEWS_COMPLETE
+			if views[dependent_view].stage < required_stage:
+				return False
+
+	if operation.stage == RedshiftETLStage.VACUUMING:
+		required_stage = RedshiftETLStage.REFRESHING_MATERIALIZED_VIEWS_COMPLETE
+		if any(t.stage < required_stage for t in tables):
+			return False
+
+	return True
+
+
+def select_tasks(tasks, available_slots):
+	"""
+	Pick the tasks to launch from a list of (operation, task) tuples ordered by priority,
+	each taking one of the available slots. An exclusive task is only launched on its own.
+	"""
+	selected = []
+	for operation, task in tasks:
+		if len(selected) >= available_slots:
+			break
+		if operation is not None and operation.exclusive:
+			if not selected:
+				selected.append(task)
+				break
+			continue
+		selected.append(task)
+
+	return selected
+
+
+class RedshiftETLScheduler:
+	def __init__(
+		self, target_duration_seconds=55, poll_interval_seconds=5, reserved_slots=1
+	):
+		"""
+		:param target_duration_seconds: how long the maintenance cycle may run for
+		:param poll_interval_seconds: how long to wait for in flight statements between
+			two scheduling rounds
+		:param reserved_slots: how many free ETL slots to always leave free
+		"""
+		self.target_duration_seconds = target_duration_seconds
+		self.poll_interval_seconds = poll_interval_seconds
+		self.reserved_slots = reserved_slots
+		# Tasks are launched at most once per cycle, whether they succeed or fail
+		self.attempted_tasks = set()
+		self.failed_tasks = set()
+
+	def get_processing_tracks(self):
+		return RedshiftStagingTrack.objects.filter(
+			stage__gte=RedshiftETLStage.IN_QUIESCENCE,
+			stage__lt=RedshiftETLStage.FINISHED,
+		).order_by("id")
+
+	def get_track_lifecycle_tasks(self):
+		manager = RedshiftStagingTrack.objects
+		if manager.filter(stage=RedshiftETLStage.INITIALIZING).exists():
+			return manager.attempt_continue_initializing_tasks()
+		return manager.get_track_lifecycle_tasks() or []
+
+	def get_ready_tasks(self):
+		"""
+		Refresh the state of every processing track and return the tasks that can start
+		now as a list of (operation, task) tuples, latest operations first so that tracks
+		already in flight are carried to completion first. Also return whether any table
+		has a statement in flight.
+		"""
+		tasks = []
+		in_flight = False
+		vacuum_in_flight = False
+
+		for track in self.get_processing_tracks():
+			tables = list(track.tables.all())
+			track.refresh_track_state(tables)
+			if track.stage in (RedshiftETLStage.ERROR, RedshiftETLStage.IN_QUIESCENCE):
+				continue
+
+			for table in tables:
+				operation = get_table_operation(table)
+				while operation is not None and not operation.applies_to(table):
+					table.skip_stage(operation.stage, operation.complete_stage)
+					operation = get_table_operation(table)
+
+				if table.stage in IN_FLIGHT_STAGES:
+					in_flight = True
+				if table.stage == RedshiftETLStage.VACUUMING:
+					vacuum_in_flight = True
+
+				if operation is None or not dependencies_are_met(operation, table, tables):
+					continue
+
+				task = getattr(table, operation.get_task)()
+				if str(task) not in self.attempted_tasks:
+					tasks.append((operation, task))
+
+		if vacuum_in_flight:
+			# The cluster only runs one vacuum at a time
+			tasks = [t for t in tasks if t[0].stage != RedshiftETLStage.VACUUMING]
+
+		tasks.sort(key=lambda t: TABLE_OPERATIONS.index(t[0]), reverse=True)
+
+		for task in self.get_track_lifecycle_tasks():
+			if str(task) not in self.attempted_tasks:
+				tasks.append((None, task))
+
+		return tasks, in_flight
+
+	def launch(self, tasks):
+		"""Run the tasks concurrently, returning once they have all returned."""
+
+		def run(task):
+			from django import db
+
+			try:
+				log.info("Next Task: %s" % str(task))
+				task()
+				log.info("Complete: %s" % str(task))
+			except Exception as e:
+				self.failed_tasks.add(str(task))
+				error_handler(e)
+			finally:
+				# Django connections are thread local; close the ones this task opened
+				db.connections.close_all()
+
+		self.attempted_tasks.update(str(task) for task in tasks)
+		threads = [Thread(target=run, args=(task, )) for task in tasks]
+		for thread in threads:
+			thread.start()
+		for thread in threads:
+			thread.join()
+
+	def run(self):
+		start_time = time.time()
+		rounds = 0
+		launched = 0
+
+		while self.target_duration_seconds - (time.time() - start_time) >= 5:
+			rounds += 1
+			with influx_timer("redshift_etl_task_generation_duration"):
+				tasks, in_flight = self.get_ready_tasks()
+
+			if not tasks:
+				if not in_flight:
+					log.info("No ETL tasks are ready or in flight.")
+					break
+				log.info("Waiting for in flight ETL statements to complete.")
+				time.sleep(self.poll_interval_seconds)
+				continue
+
+			available_slots = RedshiftStagingTrack.objects.get_current_available_slots()
+			log.info("Currently available ETL slots: %i" % available_slots)
+			selected = select_tasks(tasks, available_slots - self.reserved_slots)
+			if not selected:
+				log.info("Not enough free etl slots will sleep.")
+				time.sleep(self.poll_interval_seconds)
+				continue
+
+			self.launch(selected)
+			launched += len(selected)
+
+		influx_metric("redshift_etl_maintenance_cycle", {
+			"rounds": rounds,
+			"launched_tasks": launched,
+			"failed_tasks": len(self.failed_tasks),
+			"duration_seconds": time.time() - start_time,
+		})
+		report_redshift_pool_metrics()
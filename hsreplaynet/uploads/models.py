@@ -3,8 +3,10 @@ import os
 import re
 import time
 from base64 import b64decode
+from collections import namedtuple
 from datetime import datetime, timedelta
 from enum import IntEnum
+from io import BufferedReader
 from uuid import uuid4
 
 from django.conf import settings
@@ -16,85 +18,109 @@ from django_intenum import IntEnumField
 from sqlalchemy.sql import func, select
 
 from hsredshift.etl.materialized_views import (
-	get_materialized_view_list, get_materialized_view_update_statement, get_view_dependencies
+	get_materialized_view_list, get_materialized_view_update_statement
 )
 from hsredshift.etl.models import create_staging_table, list_staging_eligible_tables
-from hsredshift.utils.sql import is_in_flight, run_redshift_background_statement
+from hsredshift.utils.sql import run_redshift_background_statement
 from hsreplaynet.utils import aws, log
 from hsreplaynet.utils.aws import redshift, streams
 from hsreplaynet.utils.aws.clients import FIREHOSE
 from hsreplaynet.utils.fields import ShortUUIDField
-from hsreplaynet.utils.influx import influx_metric, influx_timer
+from hsreplaynet.utils.influx import influx_metric
 from hsreplaynet.utils.instrumentation import error_handler
 from hsreplaynet.utils.synchronization import advisory_lock
 
 
-def get_handle_status(handle, min_statements=1):
+HandleStatus = namedtuple("HandleStatus", (
+	"in_flight", "is_complete", "had_errors", "num_statements", "finished_at",
+	"analyze_skipped", "vacuum_finished_at",
+))
+
+
+def get_handle_statuses(handles, min_statements=1):
 	"""
-	The handle can have:
+	Return a dict of handle -> HandleStatus for a list of background statement handles,
+	querying each system table once for all of them, over a single connection.
+
+	A handle can have:
 		- No records
 		- Below the min records with errors
 		- Below the min records without errors
 		- Above the min records with errors
 		- Above the min records without errors
 	"""
-	query = """
-	SELECT
-		sum(aborted) > 0 AS had_errors,
-		count(*) AS num_statements,
-		max(endtime) AS finished_at
-	FROM SVL_QLOG WHERE label = '%s'
-	GROUP BY label;
-	""" % handle
-	log.info("Fetching handle status for: %s" % handle)
-
-	conn = redshift.get_new_redshift_connection(etl_user=True)
-	rp = conn.execute(query)
-	first_row = rp.first()
-	if first_row:
-		had_errors = first_row[0]
-		num_statements = first_row[1]
-		finished_at = first_row[2]
-
-		# Even if we have fewer than the min_statements
-		# We assume that no further statements will execute
-		# Due to the earlier aborted query
-		is_complete = had_errors or (num_statements >= min_statements)
-		msg = "is_complete = %s, had_errors = %s, num_statements = %s, finished_at = %s"
-		log.info(msg % (is_complete, had_errors, num_statements, finished_at))
-		return is_complete, had_errors, num_statements, finished_at
-
-	else:
-		log.info("No records in SVL_QLOG for handle yet")
-		if not is_in_flight(conn, handle):
-			log.warn("%s does not seem to be in_flight" % (handle))
-			# TODO: Return an error state so we can fail or restart
-		return False, None, None, None
+	handles = sorted(set(h for h in handles if h))
+	if not handles:
+		return {}
 
+	labels = ", ".join("'%s'" % (handle) for handle in handles)
+	log.info("Fetching handle status for: %s" % labels)
 
-_md_cache = {}
-
-
-def get_redshift_metadata(refresh=False):
-	from sqlalchemy import MetaData
-	from sqlalchemy.exc import InternalError
-
-	if "md" not in _md_cache or refresh:
-		md = MetaData()
-
-		try:
-			md.reflect(redshift.get_redshift_engine(etl_user=True))
-		except InternalError:
-			# We get intermittent cache lookup failures
-			# Due to concurrent modifications of an internal postgres engine cache
-			# AWS suggests waiting and then re-attempting.
-			# https://dba.stackexchange.com/questions/173815/redshift-internalerror-cache-lookup-failed-for-relation
-			time.sleep(5)
-			# We try one more time before raising the exception
-			md.reflect(redshift.get_redshift_engine(etl_user=True))
+	conn = redshift.get_new_redshift_connection(etl_user=True)
+	try:
+		in_flight = dict(conn.execute("""
+			SELECT label, count(*)
+			FROM STV_INFLIGHT WHERE label IN (%s)
+			GROUP BY label;
+		""" % labels).fetchall())
+
+		qlog = {row[0]: row[1:] for row in conn.execute("""
+			SELECT
+				label,
+				sum(aborted) > 0 AS had_errors,
+				count(*) AS num_statements,
+				max(endtime) AS finished_at
+			FROM SVL_QLOG WHERE label IN (%s)
+			GROUP BY label;
+		""" % labels)}
+
+		analyze_skipped = dict(conn.execute("""
+			SELECT label, count(*)
+			FROM STL_UTILITYTEXT u
+			JOIN stl_analyze a ON a.xid = u.xid
+			WHERE label IN (%s)
+			AND text like 'Analyze%%%%'
+			AND status = 'Skipped'
+			GROUP BY label;
+		""" % labels).fetchall())
+
+		vacuum_finished_at = dict(conn.execute("""
+			SELECT q.label, max(endtime)
+			FROM SVL_QLOG q
+			JOIN stl_Vacuum v ON v.xid = q.xid
+			WHERE q.label IN (%s)
+			AND status = 'Finished'
+			GROUP BY q.label;
+		""" % labels).fetchall())
+	finally:
+		conn.close()
+
+	ret = {}
+	for handle in handles:
+		if handle in qlog:
+			had_errors, num_statements, finished_at = qlog[handle]
+			# Even if we have fewer than the min_statements
+			# We assume that no further statements will execute
+			# Due to the earlier aborted query
+			is_complete = had_errors or (num_statements >= min_statements)
+		else:
+			had_errors, num_statements, finished_at = None, None, None
+			is_complete = False
+			if not in_flight.get(handle):
+				log.warn("%s does not seem to be in_flight" % (handle))
+				# TODO: Return an error state so we can fail or restart
+
+		ret[handle] = HandleStatus(
+			in_flight=in_flight.get(handle, 0) > 0,
+			is_complete=is_complete,
+			had_errors=had_errors,
+			num_statements=num_statements,
+			finished_at=finished_at,
+			analyze_skipped=analyze_skipped.get(handle, 0) >= 1,
+			vacuum_finished_at=vacuum_finished_at.get(handle),
+		)
 
-		_md_cache["md"] = md
-	return _md_cache["md"]
+	return ret
 
 
 class UploadEventStatus(IntEnum):
@@ -404,6 +430,51 @@ class UploadEvent(models.Model):
 
 		return self.file.read()
 
+	def open_log_stream(self):
+		"""
+		Open the uploaded log as a stream of (inflated) bytes.
+
+		Unlike log_bytes(), the log is never held in memory in its entirety: on S3 the
+		object body is streamed and inflated chunk by chunk as it is read. Corrupt
+		compressed data surfaces as an OSError or EOFError while reading.
+		"""
+		from botocore.vendored.requests.packages.urllib3.exceptions import ReadTimeoutError
+		from hsreplaynet.uploads.utils import ChunkedReader, InflatingReader
+
+		storage = self.file.storage
+		try:
+			log_file = storage.open(self.file.name, mode="rb")
+		except ReadTimeoutError:
+			# We wait one second and then give it a second attempt before we fail
+			time.sleep(1)
+			log_file = storage.open(self.file.name, mode="rb")
+
+		s3_object = getattr(log_file, "obj", None)
+		if s3_object is None:
+			# Local storage, eg. in development
+			return BufferedReader(ChunkedReader(log_file))
+
+		# Reading an S3Boto3StorageFile would download the whole object into memory,
+		# so stream the body of the underlying S3 object instead.
+		try:
+			response = s3_object.get()
+		finally:
+			log_file.close()
+
+		body = response["Body"]
+		if response.get("ContentEncoding") == "gzip":
+			return BufferedReader(InflatingReader(body))
+		return BufferedReader(ChunkedReader(body))
+
+	def check_log_stream(self, size=4096):
+		"""
+		Open the log stream and read its first block, so that logs which cannot be read at
+		all are detected before processing starts. Only that block is read, and the stream
+		is closed again rather than held open until the log is parsed.
+		"""
+		with self.open_log_stream() as stream:
+			stream.peek(size)
+
 	def process(self):
 		from hsreplaynet.games.processing import process_upload_event
 
@@ -435,43 +506,109 @@ class RedshiftETLStage(IntEnum):
 	FINISHED = 20
 
 
+# For each long running stage of a track: the stage its tables run in, the stage they
+# complete in, and the fields recording when the first table started and the last table
+# completed it.
+TRACK_STAGE_TIMESTAMPS = (
+	(
+		RedshiftETLStage.GATHERING_STATS,
+		RedshiftETLStage.GATHERING_STATS_COMPLETE,
+		"gathering_stats_started_at",
+		"gathering_stats_ended_at",
+	),
+	(
+		RedshiftETLStage.DEDUPLICATING,
+		RedshiftETLStage.DEDUPLICATION_COMPLETE,
+		"deduplicating_started_at",
+		"deduplicating_ended_at",
+	),
+	(
+		RedshiftETLStage.INSERTING,
+		RedshiftETLStage.INSERT_COMPLETE,
+		"insert_started_at",
+		"insert_ended_at",
+	),
+	(
+		RedshiftETLStage.REFRESHING_MATERIALIZED_VIEWS,
+		RedshiftETLStage.REFRESHING_MATERIALIZED_VIEWS_COMPLETE,
+		"refreshing_view_start_at",
+		"refreshing_view_end_at",
+	),
+	(
+		RedshiftETLStage.VACUUMING,
+		RedshiftETLStage.VACUUM_COMPLETE,
+		"vacuum_started_at",
+		"vacuum_ended_at",
+	),
+	(
+		RedshiftETLStage.ANALYZING,
+		RedshiftETLStage.ANALYZE_COMPLETE,
+		"analyze_started_at",
+		"analyze_ended_at",
+	),
+	(
+		RedshiftETLStage.CLEANING_UP,
+		RedshiftETLStage.FINISHED,
+		"track_cleanup_start_at",
+		"track_cleanup_end_at",
+	),
+)
+
+# For each stage during which a table has a statement running in the background: the
+# field holding the statement's handle, the field recording when it ended, and the stage
+# the table completes in.
+IN_FLIGHT_STAGE_FIELDS = {
+	RedshiftETLStage.GATHERING_STATS: (
+		"gathering_stats_handle",
+		"gathering_stats_ended_at",
+		RedshiftETLStage.GATHERING_STATS_COMPLETE,
+	),
+	RedshiftETLStage.DEDUPLICATING: (
+		"dedupe_query_handle",
+		"deduplicating_ended_at",
+		RedshiftETLStage.DEDUPLICATION_COMPLETE,
+	),
+	RedshiftETLStage.INSERTING: (
+		"insert_query_handle",
+		"inserting_ended_at",
+		RedshiftETLStage.INSERT_COMPLETE,
+	),
+	RedshiftETLStage.REFRESHING_MATERIALIZED_VIEWS: (
+		"refreshing_view_handle",
+		"refreshing_materialized_views_ended_at",
+		RedshiftETLStage.REFRESHING_MATERIALIZED_VIEWS_COMPLETE,
+	),
+	RedshiftETLStage.VACUUMING: (
+		"vacuum_query_handle",
+		"vacuuming_ended_at",
+		RedshiftETLStage.VACUUM_COMPLETE,
+	),
+	RedshiftETLStage.ANALYZING: (
+		"analyze_query_handle",
+		"analyzing_ended_at",
+		RedshiftETLStage.ANALYZE_COMPLETE,
+	),
+}
+
+
 class RedshiftStagingTrackManager(models.Manager):
 	def do_maintenance(self):
+		from .etl import RedshiftETLScheduler
+
 		log.info("Starting Redshift ETL Maintenance Cycle")
-		start_time = time.time()
-		target_duration_seconds = 55
-		duration = 0
 
 		# We use this as a shared value so 2 ETL Lambdas never start concurrently
 		LOCK_NAME = "REDSHIFT_ETL_MAINTENANCE_LOCK"
 		NAMESPACE, ADVISORY_LOCK_ID = settings.ADVISORY_LOCK_NAMESPACES[LOCK_NAME]
 		with advisory_lock([NAMESPACE, ADVISORY_LOCK_ID]) as acquired:
 			if acquired:
-				log.info("Lock acquired. Generating tasks...")
-				with influx_timer("redshift_etl_task_generation_duration"):
-					tasks = RedshiftStagingTrack.objects.get_ready_maintenance_tasks()
-
-				if tasks:
-					for task in tasks:
-						remaining_seconds = target_duration_seconds - duration
-						if remaining_seconds < 5:
-							break
-
-						current_available_slots = self.get_current_available_slots()
-						log.info(
-							"Currently available ETL slots: %i" % current_available_slots
-						)
-						if current_available_slots > 1:
-							# If we want to by-pass the slot check we can add
-							# this to the if clause or task._name.startswith("Cleanup")
-							log.info("Next Task: %s" % str(task))
-							task()
-							log.info("Complete.")
-						else:
-							log.info("Not enough free etl slots will sleep.")
-							time.sleep(5)
-							current_time = time.time()
-							duration = current_time - start_time
+				log.info("Lock acquired. Scheduling tasks...")
+				self.check_for_error_states()
+				scheduler = RedshiftETLScheduler(
+					target_duration_seconds=settings.REDSHIFT_ETL_MAINTENANCE_TARGET_SECONDS,
+					poll_interval_seconds=settings.REDSHIFT_ETL_MAINTENANCE_POLL_SECONDS,
+				)
+				scheduler.run()
 			else:
 				log.info("Could not acquire lock. Will skip maintenance run.")
 
@@ -500,91 +637,6 @@ class RedshiftStagingTrackManager(models.Manager):
 		with redshift.get_redshift_engine(etl_user=True).connect() as conn:
 			return conn.execute(q).scalar()
 
-	def get_ready_maintenance_tasks(self):
-		"""
-		Return a list of callables that will each be invoked in sequence by the lambda.
-		Each one must return within seconds to ensure the lambda finishes within 5 min.
-
-		We attempt to generate tasks in reverse of the track's normal lifecycle in order
-		to advance any in flight tracks to completion before initializing new tracks
-		"""
-		self.check_for_error_states()
-		# The state of tracks in the uploads-db might be stale
-		# Since long running queries kicked off against the cluster may have completed.
-		# So first we refresh the state of the track
-		operation_in_progress, operation_name, prefix = self.refresh_track_states()
-
-		if operation_in_progress:
-			log.info("%s is still %s" % (prefix, str(operation_name)))
-			log.info("Will check for additional unstarted tasks")
-			if operation_name == RedshiftETLStage.INITIALIZING:
-				return self.attempt_continue_initializing_tasks()
-			elif operation_name == RedshiftETLStage.GATHERING_STATS:
-				return self.attempt_continue_gathering_stats_tasks()
-			elif operation_name == RedshiftETLStage.VACUUMING:
-				return self.attempt_continue_vacuum_tasks()
-			elif operation_name == RedshiftETLStage.ANALYZING:
-				return self.attempt_continue_analyzing_tasks()
-			elif operation_name == RedshiftETLStage.INSERTING:
-				return self.attempt_continue_inserting_tasks()
-			elif operation_name == RedshiftETLStage.DEDUPLICATING:
-				return self.attempt_continue_deduplicating_tasks()
-			elif operation_name == RedshiftETLStage.REFRESHING_MATERIALIZED_VIEWS:
-				return self.attempt_continue_refreshing_views_tasks()
-			elif operation_name == RedshiftETLStage.CLEANING_UP:
-				return self.attempt_continue_cleaning_up_tasks()
-			else:
-				log.info("Will wait until it has completed to initiate new tasks")
-				return []
-
-		# If we reach here then we know that we don't have any long running
-		# operations in flight on the cluster.
-
-		cleanup_tasks = self.get_cleanup_tasks()
-		if cleanup_tasks:
-			log.info("Found %s cleanup tasks" % str(len(cleanup_tasks)))
-			return cleanup_tasks
-
-		analyze_tasks = self.get_analyze_tasks()
-		if analyze_tasks:
-			log.info("Found %s analyze tasks" % str(len(analyze_tasks)))
-			return analyze_tasks
-
-		vacuum_tasks = self.get_vacuum_tasks()
-		if vacuum_tasks:
-			log.info("Found %s vacuum tasks" % str(len(vacuum_tasks)))
-			return vacuum_tasks
-
-		refresh_view_tasks = self.get_refresh_view_tasks()
-		if refresh_view_tasks:
-			log.info("Found %s refresh view tasks" % str(len(refresh_view_tasks)))
-			return refresh_view_tasks
-
-		insert_tasks = self.get_insert_tasks()
-		if insert_tasks:
-			log.info("Found %s insert tasks" % str(len(insert_tasks)))
-			return insert_tasks
-
-		deduplication_tasks = self.get_deduplication_tasks()
-		if deduplication_tasks:
-			log.info("Found %s deduplication tasks" % str(len(deduplication_tasks)))
-			return deduplication_tasks
-
-		gathering_stats_tasks = self.get_gathering_stats_tasks()
-		if gathering_stats_tasks:
-			log.info("Found %s gathering stats tasks" % str(len(gathering_stats_tasks)))
-			return gathering_stats_tasks
-
-		# Tack lifecycle tasks include initializing new tracks
-		# And closing active tracks
-		track_lifecycle_tasks = self.get_track_lifecycle_tasks()
-		if track_lifecycle_tasks:
-			log.info("Found %s track lifecycle tasks" % str(len(track_lifecycle_tasks)))
-			return track_lifecycle_tasks
-
-		# Nothing to do, so return empty list
-		return []
-
 	def check_for_error_states(self):
 		error_track_count = RedshiftStagingTrack.objects.filter(
 			stage__exact=RedshiftETLStage.ERROR
@@ -593,153 +645,6 @@ class RedshiftStagingTrackManager(models.Manager):
 			msg = "There are Error Tracks. They must be resolved before ETL can continue."
 			raise RuntimeError(msg)
 
-	def refresh_track_states(self):
-		unfinished_tracks = RedshiftStagingTrack.objects.exclude(
-			stage__in=(RedshiftETLStage.ERROR, RedshiftETLStage.FINISHED)
-		).all()
-
-		if unfinished_tracks:
-			for unfinished_track in unfinished_tracks:
-				in_progress, name = unfinished_track.refresh_track_state()
-				if in_progress:
-					return in_progress, name, unfinished_track.track_prefix
-
-		return False, None, None
-
-	def get_gathering_stats_tasks(self):
-		track = RedshiftStagingTrack.objects.filter(
-			stage=RedshiftETLStage.READY_TO_LOAD,
-		).first()
-
-		if track:
-			track.stage = RedshiftETLStage.GATHERING_STATS
-			track.gathering_stats_started_at = timezone.now()
-			track.save()
-			return track.get_gathering_stats_tasks()
-
-	def attempt_continue_gathering_stats_tasks(self):
-		track_for_continue = RedshiftStagingTrack.objects.filter(
-			stage=RedshiftETLStage.GATHERING_STATS,
-		).first()
-
-		if track_for_continue:
-			return track_for_continue.get_gathering_stats_tasks()
-
-	def get_deduplication_tasks(self):
-		track = RedshiftStagingTrack.objects.filter(
-			stage=RedshiftETLStage.GATHERING_STATS_COMPLETE,
-		).first()
-
-		if track:
-			track.stage = RedshiftETLStage.DEDUPLICATING
-			track.deduplicating_started_at = timezone.now()
-			track.save()
-			return track.get_deduplication_tasks()
-
-	def attempt_continue_deduplicating_tasks(self):
-		track_for_continue = RedshiftStagingTrack.objects.filter(
-			stage=RedshiftETLStage.DEDUPLICATING
-		).first()
-
-		if track_for_continue:
-			return track_for_continue.get_deduplication_tasks()
-
-	def get_insert_tasks(self):
-		track = RedshiftStagingTrack.objects.filter(
-			stage=RedshiftETLStage.DEDUPLICATION_COMPLETE,
-		).first()
-
-		if track:
-			track.stage = RedshiftETLStage.INSERTING
-			track.insert_started_at = timezone.now()
-			track.save()
-			return track.get_insert_tasks()
-
-	def attempt_continue_inserting_tasks(self):
-		track_for_continue = RedshiftStagingTrack.objects.filter(
-			stage=RedshiftETLStage.INSERTING
-		).first()
-
-		if track_for_continue:
-			return track_for_continue.get_insert_tasks()
-
-	def get_refresh_view_tasks(self):
-		track_for_refresh = RedshiftStagingTrack.objects.filter(
-			stage=RedshiftETLStage.INSERT_COMPLETE,
-		).first()
-
-		if track_for_refresh:
-			track_for_refresh.stage = RedshiftETLStage.REFRESHING_MATERIALIZED_VIEWS
-			track_for_refresh.refreshing_view_start_at = timezone.now()
-			track_for_refresh.save()
-			return track_for_refresh.get_refresh_view_tasks()
-
-	def attempt_continue_refreshing_views_tasks(self):
-		track_for_continue = RedshiftStagingTrack.objects.filter(
-			stage=RedshiftETLStage.REFRESHING_MATERIALIZED_VIEWS
-		).first()
-
-		if track_for_continue:
-			return track_for_continue.get_refresh_view_tasks()
-
-	def get_vacuum_tasks(self):
-		track_for_vacuum = RedshiftStagingTrack.objects.filter(
-			stage=RedshiftETLStage.REFRESHING_MATERIALIZED_VIEWS_COMPLETE,
-		).first()
-
-		if track_for_vacuum:
-			track_for_vacuum.stage = RedshiftETLStage.VACUUMING
-			track_for_vacuum.vacuum_started_at = timezone.now()
-			track_for_vacuum.save()
-			return track_for_vacuum.get_vacuum_tasks()
-
-	def attempt_continue_vacuum_tasks(self):
-		track_for_continue = RedshiftStagingTrack.objects.filter(
-			stage=RedshiftETLStage.VACUUMING,
-		).first()
-
-		if track_for_continue:
-			return track_for_continue.attempt_get_next_vacuum_task()
-
-	def get_analyze_tasks(self):
-		track_for_analyze = RedshiftStagingTrack.objects.filter(
-			stage=RedshiftETLStage.VACUUM_COMPLETE,
-		).first()
-
-		if track_for_analyze:
-			track_for_analyze.stage = RedshiftETLStage.ANALYZING
-			track_for_analyze.analyze_started_at = timezone.now()
-			track_for_analyze.save()
-			return track_for_analyze.get_analyze_tasks()
-
-	def attempt_continue_analyzing_tasks(self):
-		track_for_continue = RedshiftStagingTrack.objects.filter(
-			stage=RedshiftETLStage.ANALYZING
-		).first()
-
-		if track_for_continue:
-			return track_for_continue.get_analyze_tasks()
-
-	def get_cleanup_tasks(self):
-
-		track_for_cleanup = RedshiftStagingTrack.objects.filter(
-			stage=RedshiftETLStage.ANALYZE_COMPLETE,
-		).first()
-
-		if track_for_cleanup:
-			track_for_cleanup.stage = RedshiftETLStage.CLEANING_UP
-			track_for_cleanup.track_cleanup_start_at = timezone.now()
-			track_for_cleanup.save()
-			return track_for_cleanup.get_cleanup_tasks()
-
-	def attempt_continue_cleaning_up_tasks(self):
-		track_for_cleanup = RedshiftStagingTrack.objects.filter(
-			stage=RedshiftETLStage.CLEANING_UP
-		).first()
-
-		if track_for_cleanup:
-			return track_for_cleanup.get_cleanup_tasks()
-
 	def get_track_lifecycle_tasks(self):
 		track = RedshiftStagingTrack.objects.filter(
 			stage=RedshiftETLStage.ACTIVE,
@@ -1081,110 +986,62 @@ class RedshiftStagingTrack(models.Model):
 		from hsreplaynet.analytics.processing import fill_global_query_queue
 		fill_global_query_queue()
 
-	def _all_staging_tables_are_empty(self):
-		return all(t.is_empty() for t in self.tables.all() if not t.is_materialized_view)
+	def _all_staging_tables_are_empty(self, tables):
+		return all(t.is_empty() for t in tables if not t.is_materialized_view)
 
-	def refresh_track_state(self):
+	def refresh_track_state(self, tables=None):
+		"""
+		Check whether the long running operations launched by the track's tables have
+		completed, then move the track to the earliest stage of its tables.
+
+		The track is in ERROR as soon as any of its tables is.
+		"""
 		if self.stage == RedshiftETLStage.ERROR:
 			# We never automatically move a track out of error once it has
 			# entered an error stage. This must be done manually.
 			raise RuntimeError("Refresh should never get called on errored tracks")
 
-		if self.stage == RedshiftETLStage.INITIALIZING:
-			return True, RedshiftETLStage.INITIALIZING
+		if tables is None:
+			tables = list(self.tables.all())
 
-		for table in self.tables.all():
-			# If the table previously launched a long running operation
-			# This is where we check to see if completed.
-			table.refresh_table_state()
+		if self.stage == RedshiftETLStage.IN_QUIESCENCE:
+			if not self.is_in_quiescence:
+				self.stage = RedshiftETLStage.READY_TO_LOAD
+				for t in tables:
+					t.stage = RedshiftETLStage.READY_TO_LOAD
+					t.save()
+				self.save()
+			return
+
+		# If the tables previously launched long running operations
+		# This is where we check to see if they completed.
+		RedshiftStagingTrackTable.objects.refresh_table_states(tables)
 
-		if self._all_staging_tables_are_empty():
+		if self._all_staging_tables_are_empty(tables):
 			# If all the staging tables have no data
 			# The likely processing was paused for the entire track ETL cycle
 			# So we can short circuit this track to the cleanup stage.
-			for table in self.tables.all():
+			for table in tables:
 				if table.stage < RedshiftETLStage.ANALYZE_COMPLETE:
 					table.stage = RedshiftETLStage.ANALYZE_COMPLETE
 					table.save()
 
-		if self._all_tables_are_in_stage(RedshiftETLStage.FINISHED):
-			# If all the child tables are finished, then the track is always finished.
-			self.stage = RedshiftETLStage.FINISHED
-			self.track_cleanup_end_at = timezone.now()
-			self.save()
+		current_timestamp = timezone.now()
+		for stage, complete_stage, started_at, ended_at in TRACK_STAGE_TIMESTAMPS:
+			if getattr(self, started_at) is None and any(t.stage >= stage for t in tables):
+				setattr(self, started_at, current_timestamp)
+			if getattr(self, ended_at) is None and all(t.stage >= complete_stage for t in tables):
+				setattr(self, ended_at, current_timestamp)
+
+		previous_stage = self.stage
+		self.stage = min((t.stage for t in tables), default=self.stage)
+		self.save()
+
+		if self.stage == RedshiftETLStage.ERROR:
+			log.error("Track %s has tables in error" % self.track_prefix)
+		elif self.stage == RedshiftETLStage.FINISHED and previous_stage != self.stage:
 			self.capture_track_finished_metrics()
 			# self.schedule_global_query_cache_warming()
-			return False, None
-
-		if self.stage == RedshiftETLStage.CLEANING_UP:
-			return True, RedshiftETLStage.CLEANING_UP
-
-		if self._all_tables_are_in_stage(RedshiftETLStage.ANALYZE_COMPLETE):
-			self.stage = RedshiftETLStage.ANALYZE_COMPLETE
-			self.analyze_ended_at = timezone.now()
-			self.save()
-
-		if self.stage == RedshiftETLStage.ANALYZING:
-			return True, RedshiftETLStage.ANALYZING
-
-		if self._all_tables_are_in_stage(RedshiftETLStage.VACUUM_COMPLETE):
-			self.stage = RedshiftETLStage.VACUUM_COMPLETE
-			self.vacuum_ended_at = timezone.now()
-			self.save()
-
-		if self.stage == RedshiftETLStage.VACUUMING:
-			return True, RedshiftETLStage.VACUUMING
-
-		views_complete = RedshiftETLStage.REFRESHING_MATERIALIZED_VIEWS_COMPLETE
-		if self._all_tables_are_in_stage(views_complete):
-			self.stage = RedshiftETLStage.REFRESHING_MATERIALIZED_VIEWS_COMPLETE
-			self.refreshing_view_end_at = timezone.now()
-			self.save()
-
-		if self.stage == RedshiftETLStage.REFRESHING_MATERIALIZED_VIEWS:
-			return True, RedshiftETLStage.REFRESHING_MATERIALIZED_VIEWS
-
-		if self._all_tables_are_in_stage(RedshiftETLStage.INSERT_COMPLETE):
-			self.stage = RedshiftETLStage.INSERT_COMPLETE
-			self.insert_ended_at = timezone.now()
-			self.save()
-
-		if self.stage == RedshiftETLStage.INSERTING:
-			return True, RedshiftETLStage.INSERTING
-
-		if self._all_tables_are_in_stage(RedshiftETLStage.DEDUPLICATION_COMPLETE):
-			self.stage = RedshiftETLStage.DEDUPLICATION_COMPLETE
-			self.deduplicating_ended_at = timezone.now()
-			self.save()
-
-		if self.stage == RedshiftETLStage.DEDUPLICATING:
-			return True, RedshiftETLStage.DEDUPLICATING
-
-		if self._all_tables_are_in_stage(RedshiftETLStage.GATHERING_STATS_COMPLETE):
-			self.stage = RedshiftETLStage.GATHERING_STATS_COMPLETE
-			self.gathering_stats_ended_at = timezone.now()
-			self.save()
-
-		if self.stage == RedshiftETLStage.GATHERING_STATS:
-			return True, RedshiftETLStage.GATHERING_STATS
-
-		if self.stage == RedshiftETLStage.IN_QUIESCENCE and not self.is_in_quiescence:
-			self.stage = RedshiftETLStage.READY_TO_LOAD
-			for t in self.tables.all():
-				t.stage = RedshiftETLStage.READY_TO_LOAD
-				t.save()
-			self.save()
-
-		if self.stage == RedshiftETLStage.IN_QUIESCENCE:
-			return True, RedshiftETLStage.IN_QUIESCENCE
-
-		return False, None
-
-	def _any_tables_are_in_stage(self, stage):
-		return any(map(lambda t: t.stage == stage, self.tables.all()))
-
-	def _all_tables_are_in_stage(self, stage):
-		return all(map(lambda t: t.stage == stage, self.tables.all()))
 
 	def initialize_successor(self):
 		if not self.is_able_to_initialize_successor:
@@ -1240,104 +1097,6 @@ class RedshiftStagingTrack(models.Model):
 
 		return current_timestamp
 
-	def get_gathering_stats_tasks(self):
-		results = []
-		for t in self.tables.all():
-			if t.stage == RedshiftETLStage.READY_TO_LOAD:
-				if t.is_materialized_view:
-					t.stage = RedshiftETLStage.GATHERING_STATS_COMPLETE
-					t.gathering_stats_started_at = timezone.now()
-					t.gathering_stats_ended_at = t.gathering_stats_started_at
-					t.save()
-					t.heartbeat_track_status_metrics()
-				else:
-					results.append(t.get_gathering_stats_task())
-		return results
-
-	def get_deduplication_tasks(self):
-		results = []
-		for t in self.tables.all():
-			if t.stage == RedshiftETLStage.GATHERING_STATS_COMPLETE:
-				if t.is_materialized_view:
-					t.stage = RedshiftETLStage.DEDUPLICATION_COMPLETE
-					t.deduplicating_started_at = timezone.now()
-					t.deduplicating_ended_at = t.deduplicating_started_at
-					t.save()
-				else:
-					results.append(t.get_deduplication_task())
-		return results
-
-	def get_insert_tasks(self):
-		results = []
-		for t in self.tables.all():
-			if t.stage == RedshiftETLStage.DEDUPLICATION_COMPLETE:
-				if t.is_materialized_view:
-					t.stage = RedshiftETLStage.INSERT_COMPLETE
-					t.inserting_started_at = timezone.now()
-					t.inserting_ended_at = t.inserting_started_at
-					t.save()
-				else:
-					results.append(t.get_insert_task())
-		return results
-
-	def get_refresh_view_tasks(self):
-		results = []
-		for t in self.tables.all():
-			if t.stage == RedshiftETLStage.INSERT_COMPLETE:
-				if t.is_materialized_view:
-					# This allows views to depend on other views in their refresh logic.
-					dependent_views = get_view_dependencies(t.target_table)
-
-					dependencies_met = True
-					for dependent_view in dependent_views:
-						table_for_view = self.tables.filter(target_table=dependent_view).first()
-						required_stage = RedshiftETLStage.REFRESHING_MATERIALIZED_VIEWS_COMPLETE
-						if table_for_view.stage != required_stage:
-							dependencies_met = False
-
-					if dependencies_met:
-						results.append(t.get_refresh_view_task())
-				else:
-					t.stage = RedshiftETLStage.REFRESHING_MATERIALIZED_VIEWS_COMPLETE
-					t.refreshing_materialized_views_started_at = timezone.now()
-					t.refreshing_materialized_views_ended_at = t.refreshing_materialized_views_started_at
-					t.save()
-		return results
-
-	def get_vacuum_tasks(self):
-		# Vacuuming can only proceed one table at a time.
-		for table in self.tables.all():
-			if table.stage == RedshiftETLStage.REFRESHING_MATERIALIZED_VIEWS_COMPLETE:
-				return [table.get_vacuum_task()]
-		return []
-
-	def attempt_get_next_vacuum_task(self):
-		if self._any_tables_are_in_stage(RedshiftETLStage.VACUUMING):
-			# Don't start any additional vacuums while one is still in flight
-			return []
-		# If none are in flight then get the next task
-		return self.get_vacuum_tasks()
-
-	def get_analyze_tasks(self):
-		results = []
-		for t in self.tables.all():
-			if t.stage == RedshiftETLStage.VACUUM_COMPLETE:
-				results.append(t.get_analyze_task())
-		return results
-
-	def get_cleanup_tasks(self):
-		results = []
-		for t in self.tables.all():
-			if t.stage in (RedshiftETLStage.ANALYZE_COMPLETE, RedshiftETLStage.CLEANING_UP):
-				if t.is_materialized_view:
-					t.stage = RedshiftETLStage.FINISHED
-					t.cleaning_up_started_at = timezone.now()
-					t.cleaning_up_ended_at = t.cleaning_up_started_at
-					t.save()
-				else:
-					results.append(t.get_cleanup_task())
-		return results
-
 	def get_initialize_successor_tasks(self):
 		tmpl = "Initializing successor for track_prefix: %s"
 		task_name = tmpl % (self.track_prefix,)
@@ -1350,6 +1109,14 @@ class RedshiftStagingTrack(models.Model):
 
 
 class RedshiftStagingTrackTableManager(models.Manager):
+	def refresh_table_states(self, tables):
+		"""
+		Check whether the long running operations launched by a list of tables finished,
+		fetching the status of all their handles at once.
+		"""
+		statuses = get_handle_statuses(t.in_flight_handle for t in tables)
+		for table in tables:
+			table.refresh_table_state(statuses)
 
 	def create_view_table_for_track(self, view, track):
 		# Create the record once we know the table and stream creation didn't error
@@ -1363,10 +1130,10 @@ class RedshiftStagingTrackTableManager(models.Manager):
 		return track_table
 
 	def staging_table_exists(self, staging_table_name, refresh=True):
-		return staging_table_name in get_redshift_metadata(refresh).tables
+		return staging_table_name in redshift.get_redshift_metadata(refresh).tables
 
 	def create_tables_for_track(self, tables, track):
-		get_redshift_metadata(refresh=True)
+		redshift.get_redshift_metadata(refresh=True)
 		for table in tables:
 			self.create_table_for_track(table, track, refresh=False)
 
@@ -1502,7 +1269,7 @@ class RedshiftStagingTrackTable(models.Model):
 		if self.final_staging_table_size:
 			self.get_min_max_game_dates_from_staging_table()
 
-			engine = redshift.get_redshift_engine(etl_user=True)
+			engine = redshift.get_redshift_background_engine(etl_user=True)
 			stmt = "ANALYZE %s;" % self.staging_table
 			run_redshift_background_statement(
 				stmt,
@@ -1582,7 +1349,7 @@ class RedshiftStagingTrackTable(models.Model):
 				staging_table=self.staging_table
 			)
 
-			engine = redshift.get_redshift_engine(etl_user=True)
+			engine = redshift.get_redshift_background_engine(etl_user=True)
 			engine.execute(sql1)
 			engine.execute(sql2)
 
@@ -1599,6 +1366,12 @@ class RedshiftStagingTrackTable(models.Model):
 			)
 			self.save()
 
+		else:
+			self.skip_stage(
+				RedshiftETLStage.DEDUPLICATING,
+				RedshiftETLStage.DEDUPLICATION_COMPLETE
+			)
+
 	def get_insert_task(self):
 		tmpl = "Inserting %s for track_prefix: %s"
 		task_name = tmpl % (self.target_table, self.track.track_prefix)
@@ -1643,7 +1416,7 @@ class RedshiftStagingTrackTable(models.Model):
 				game_id=game_id_val
 			)
 
-			engine = redshift.get_redshift_engine(etl_user=True)
+			engine = redshift.get_redshift_background_engine(etl_user=True)
 			run_redshift_background_statement(
 				sql,
 				self.insert_query_handle,
@@ -1657,6 +1430,9 @@ class RedshiftStagingTrackTable(models.Model):
 			)
 			self.save()
 
+		else:
+			self.skip_stage(RedshiftETLStage.INSERTING, RedshiftETLStage.INSERT_COMPLETE)
+
 	def get_refresh_view_task(self):
 		task_name = "Refreshing View %s" % self.target_table
 		return RedshiftETLTask(task_name, self.do_refresh_view)
@@ -1682,7 +1458,7 @@ class RedshiftStagingTrackTable(models.Model):
 				max_date
 			)
 
-			engine = redshift.get_redshift_engine(etl_user=True)
+			engine = redshift.get_redshift_background_engine(etl_user=True)
 			run_redshift_background_statement(
 				sql,
 				self.refreshing_view_handle,
@@ -1696,6 +1472,13 @@ class RedshiftStagingTrackTable(models.Model):
 			)
 			self.save()
 
+		else:
+			# None of the track's tables had any records
+			self.skip_stage(
+				RedshiftETLStage.REFRESHING_MATERIALIZED_VIEWS,
+				RedshiftETLStage.REFRESHING_MATERIALIZED_VIEWS_COMPLETE
+			)
+
 	def get_vacuum_task(self):
 		tmpl = "Vacuuming %s for track_prefix: %s"
 		task_name = tmpl % (self.target_table, self.track.track_prefix)
@@ -1719,7 +1502,7 @@ class RedshiftStagingTrackTable(models.Model):
 			))
 
 			vacuum_target = 100 - settings.REDSHIFT_PCT_UNSORTED_ROWS_TOLERANCE
-			engine = redshift.get_redshift_engine(etl_user=True)
+			engine = redshift.get_redshift_background_engine(etl_user=True)
 			available_slots = RedshiftStagingTrack.objects.get_current_available_slots()
 			sql = """
 				SET wlm_query_slot_count TO %i;
@@ -1764,7 +1547,7 @@ class RedshiftStagingTrackTable(models.Model):
 			self.analyze_query_handle
 		))
 
-		engine = redshift.get_redshift_engine(etl_user=True)
+		engine = redshift.get_redshift_background_engine(etl_user=True)
 		sql = "ANALYZE %s;" % self.target_table
 		run_redshift_background_statement(
 			sql,
@@ -1845,103 +1628,69 @@ class RedshiftStagingTrackTable(models.Model):
 
 		self.save()
 
+	def skip_stage(self, stage, complete_stage):
+		"""
+		Move the table straight through a stage it has nothing to do in, e.g. because it
+		is a materialized view or its staging table is empty.
+		"""
+		current_timestamp = timezone.now()
+		self.set_stage_started_at(stage, current_timestamp)
+		self.set_stage_ended_at(stage, current_timestamp)
+		self.stage = complete_stage
+		self.save()
+		self.heartbeat_track_status_metrics()
+
 	def _make_async_query_handle(self):
 		return "handle-%s" % str(uuid4())[:7]
 
-	def refresh_table_state(self):
-		# If the table previously launched a long running operation
-		# Check whether it finished here.
-		if self.stage == RedshiftETLStage.ANALYZING:
-			self._attempt_update_status_to_stage(
-				RedshiftETLStage.ANALYZE_COMPLETE,
-				"analyzing_ended_at",
-				self.analyze_query_handle
-			)
+	@property
+	def in_flight_handle(self):
+		"""The handle of the long running statement the table is waiting on, if any."""
+		if self.stage in IN_FLIGHT_STAGE_FIELDS:
+			return getattr(self, IN_FLIGHT_STAGE_FIELDS[self.stage][0])
 
-		if self.stage == RedshiftETLStage.VACUUMING:
-			# Requires special handling
-			self._attempt_update_vacuum_state()
-
-		if self.stage == RedshiftETLStage.REFRESHING_MATERIALIZED_VIEWS:
-			self._attempt_update_status_to_stage(
-				RedshiftETLStage.REFRESHING_MATERIALIZED_VIEWS_COMPLETE,
-				"refreshing_materialized_views_ended_at",
-				self.refreshing_view_handle
-			)
+	def refresh_table_state(self, statuses=None):
+		"""
+		If the table previously launched a long running operation, check whether it
+		finished. statuses is a dict of handle -> HandleStatus, as returned by
+		get_handle_statuses(), to share between the tables of a track.
+		"""
+		handle = self.in_flight_handle
+		if handle is None:
+			return
 
-		if self.stage == RedshiftETLStage.INSERTING:
-			self._attempt_update_status_to_stage(
-				RedshiftETLStage.INSERT_COMPLETE,
-				"inserting_ended_at",
-				self.insert_query_handle
-			)
+		if statuses is None:
+			statuses = get_handle_statuses([handle])
+		status = statuses.get(handle)
+		if status is None:
+			return
 
-		if self.stage == RedshiftETLStage.DEDUPLICATING:
-			self._attempt_update_status_to_stage(
-				RedshiftETLStage.DEDUPLICATION_COMPLETE,
-				"deduplicating_ended_at",
-				self.dedupe_query_handle
-			)
+		_, ended_at_field, complete_stage = IN_FLIGHT_STAGE_FIELDS[self.stage]
 
-		if self.stage == RedshiftETLStage.GATHERING_STATS:
-			self._attempt_update_status_to_stage(
-				RedshiftETLStage.GATHERING_STATS_COMPLETE,
-				"gathering_stats_ended_at",
-				self.gathering_stats_handle
-			)
+		if self.stage == RedshiftETLStage.VACUUMING:
+			# Vacuums are complete once stl_vacuum reports them finished
+			if status.vacuum_finished_at:
+				self.stage = complete_stage
+				setattr(self, ended_at_field, timezone.make_aware(status.vacuum_finished_at))
+				self.save()
+				self.heartbeat_track_status_metrics()
+			return
 
-	def _attempt_update_status_to_stage(self, stage, field, handle, min_expected_count=1):
-		# Use the handle to check the status of the query
-		if redshift.has_inflight_queries(handle):
+		if status.in_flight:
 			# If we see there is still something actively in flight then we can exit early.
 			return
 
-		# The min_expected_count is the minimum number of statements that must exist
-		# in the QLOG table to be complete.
-		# It's possible that there could be more.
-		is_complete, had_errors, num_stmts, finished_at = get_handle_status(
-			handle,
-			min_expected_count
-		)
-
-		if redshift.is_analyze_skipped(handle):
+		is_complete, finished_at = status.is_complete, status.finished_at
+		if status.analyze_skipped:
 			finished_at = datetime.now()
 			is_complete = True
 
 		if is_complete:
-			tz_aware_ending_timestamp = timezone.make_aware(finished_at)
-			if had_errors:
+			if status.had_errors:
 				self.stage = RedshiftETLStage.ERROR
 			else:
-				self.stage = stage
-			setattr(self, field, tz_aware_ending_timestamp)
-			self.save()
-			self.heartbeat_track_status_metrics()
-
-	def _attempt_update_vacuum_state(self):
-		template = """
-			SELECT endtime
-			FROM SVL_QLOG q
-			JOIN stl_Vacuum v ON v.xid = q.xid
-			WHERE q.label = '{handle}'
-			AND status = 'Finished'
-			ORDER BY endtime DESC
-			LIMIT 1;
-		"""
-
-		sql = template.format(
-			handle=self.vacuum_query_handle,
-		)
-
-		conn = redshift.get_new_redshift_connection(etl_user=True)
-		rp1 = conn.execute(sql)
-
-		rows = list(rp1)
-		if len(rows) == 1:
-			latest_end_date = rows[0][0]
-			tz_aware_ending_timestamp = timezone.make_aware(latest_end_date)
-			self.stage = RedshiftETLStage.VACUUM_COMPLETE
-			self.vacuuming_ended_at = tz_aware_ending_timestamp
+				self.stage = complete_stage
+			setattr(self, ended_at_field, timezone.make_aware(finished_at))
 			self.save()
 			self.heartbeat_track_status_metrics()
 
@@ -1957,10 +1706,10 @@ class RedshiftStagingTrackTable(models.Model):
 		return pct_unsorted >= VACUUM_THRESHOLD
 
 	def _get_table_obj(self):
-		return get_redshift_metadata(refresh=True).tables[self.staging_table]
+		return redshift.get_redshift_table(self.staging_table)
 
 	def _get_target_table_obj(self):
-		return get_redshift_metadata(refresh=True).tables[self.target_table]
+		return redshift.get_redshift_table(self.target_table)
 
 	def _get_staging_table_size_stmt(self):
 		return select([func.count()]).select_from(self._get_table_obj())
@@ -31,7 +31,13 @@ def queue_raw_uploads_for_processing(attempt_reprocessing, limit=None):
 	publisher_func = aws.publish_raw_upload_batch_to_processing_stream
 	iterable = generate_raw_uploads_for_processing(attempt_reprocessing, limit)
 	stream_name = settings.KINESIS_UPLOAD_PROCESSING_STREAM_NAME
-	fill_stream_from_iterable(stream_name, iterable, publisher_func)
+	fill_stream_from_iterable(
+		stream_name, iterable, publisher_func, partition_key=_get_partition_key
+	)
+
+
+def _get_partition_key(raw_upload):
+	return raw_upload.kinesis_partition_key
 
 
 def generate_raw_uploads_for_processing(attempt_reprocessing, limit: int = 0):
@@ -65,7 +71,10 @@ def queue_upload_events_for_reprocessing(events, use_kinesis=False):
 		iterable = _generate_raw_uploads_from_events(events)
 		publisher_func = aws.publish_raw_upload_batch_to_processing_stream
 		stream_name = settings.KINESIS_UPLOAD_PROCESSING_STREAM_NAME
-		fill_stream_from_iterable(stream_name, iterable, publisher_func)
+		fill_stream_from_iterable(
+			stream_name, iterable, publisher_func,
+			partition_key=_get_partition_key, total=len(events)
+		)
 	else:
 		for event in events:
 			logger.info("Processing UploadEvent %r locally", event)
@@ -1,3 +1,7 @@
+import io
+import zlib
+
+
 def user_agent_product(user_agent):
 	"""Returns the "product" component of the specified user agent string
 
@@ -26,3 +30,85 @@ def user_agent_product(user_agent):
 		return None
 
 	return user_agent[:idx]
+
+
+class ChunkedReader(io.RawIOBase):
+	"""A read-only binary stream over any object with a read(size) method
+
+	This lets file-likes which only implement read(), such as botocore's StreamingBody,
+	be wrapped in an io.BufferedReader or io.TextIOWrapper. At most one chunk of data is
+	buffered at a time.
+	"""
+
+	def __init__(self, fileobj, chunk_size=64 * 1024):
+		self._fileobj = fileobj
+		self._chunk_size = chunk_size
+		self._buffer = b""
+		self._exhausted = False
+
+	def readable(self):
+		return True
+
+	def readinto(self, b):
+		while not self._buffer:
+			if self._exhausted:
+				return 0
+			self._buffer = self._read_chunk()
+
+		size = min(len(b), len(self._buffer))
+		b[:size] = self._buffer[:size]
+		self._buffer = self._buffer[size:]
+		return size
+
+	def _read_chunk(self):
+		data = self._fileobj.read(self._chunk_size)
+		if not data:
+			self._exhausted = True
+		return data
+
+	def close(self):
+		if not self.closed:
+			self._fileobj.close()
+		super().close()
+
+
+class InflatingReader(ChunkedReader):
+	"""A read-only binary stream which inflates gzip or zlib data as it is read
+
+	Memory use does not depend on the size of the stream. Like gzip.GzipFile, several
+	concatenated gzip members are inflated one after the other, and corrupt or truncated
+	compressed data raises OSError (or EOFError) from read().
+	"""
+
+	def __init__(self, fileobj, chunk_size=64 * 1024):
+		super().__init__(fileobj, chunk_size)
+		# 32 + MAX_WBITS automatically detects a gzip or zlib header
+		self._decompressor = zlib.decompressobj(32 + zlib.MAX_WBITS)
+
+	def _read_chunk(self):
+		decompressor = self._decompressor
+		try:
+			if decompressor.eof:
+				# Whatever follows the end of a member is the start of the next one
+				data = decompressor.unused_data or self._fileobj.read(self._chunk_size)
+				if not data:
+					self._exhausted = True
+					return b""
+				decompressor = self._decompressor = zlib.decompressobj(32 + zlib.MAX_WBITS)
+				return decompressor.decompress(data, self._chunk_size)
+
+			if decompressor.unconsumed_tail:
+				return decompressor.decompress(decompressor.unconsumed_tail, self._chunk_size)
+
+			data = self._fileobj.read(self._chunk_size)
+			if data:
+				return decompressor.decompress(data, self._chunk_size)
+
+			self._exhausted = True
+			ret = decompressor.flush()
+		except zlib.error as e:
+			raise OSError("Invalid compressed data: %s" % (e))
+
+		if not decompressor.eof:
+			raise EOFError("Compressed file ended before the end-of-stream marker was reached")
+		return ret
@@ -26,7 +26,8 @@ from .web.views.oauth2 import (
 from .web.views.premium import PremiumDetailView
 from .web.views.profiles import PackListView, ProfileView
 from .web.views.replays import (
-	AnnotatedReplayView, MyReplaysView, ReplayDetailView, ReplayEmbedView, UploadDetailView
+	AnnotatedReplayView, MyReplaysView, ReplayDetailView,
+	ReplayEmbedView, ReplayXMLView, UploadDetailView
 )
 
 
@@ -65,6 +66,10 @@ urlpatterns = [
 		r"^replay/(?P<shortid>\w+)/annotated_xml$",
 		AnnotatedReplayView.as_view(), name="annotated_replay"
 	),
+	url(
+		r"^replay/(?P<shortid>\w+)/hsreplay\.xml$",
+		ReplayXMLView.as_view(), name="games_replay_xml"
+	),
 	url(r"^replay/(?P<id>\w+)/embed$", ReplayEmbedView.as_view(), name="games_replay_embed"),
 
 	# Includes
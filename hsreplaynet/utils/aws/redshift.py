@@ -1,33 +1,136 @@
+import os
+import threading
+import time
+
 from django.conf import settings
 from django.core.cache import caches
-from sqlalchemy import create_engine
+from sqlalchemy import MetaData, create_engine, event
 from sqlalchemy.engine.url import URL
+from sqlalchemy.exc import InternalError
 from sqlalchemy.orm import sessionmaker
 from sqlalchemy.pool import NullPool
 
 from hsredshift.analytics.queries import RedshiftCatalogue
-from hsreplaynet.utils.influx import influx
+from hsreplaynet.utils.influx import influx, influx_metric
 
 
 def get_redshift_cache_redis_client():
 	return caches["redshift"].client.get_client()
 
 
-def get_redshift_engine(etl_user=False):
+_engines = {}
+_engines_lock = threading.Lock()
+
+
+def _reset_session_state(dbapi_connection, connection_record):
+	"""
+	Reset the session settings statements may have changed (e.g. the ETL claiming every
+	WLM slot for a vacuum) before a connection is returned to the pool, in case the
+	statement that would have reset them failed.
+	"""
+	if dbapi_connection is None:
+		# The connection was invalidated
+		return
+
+	try:
+		cursor = dbapi_connection.cursor()
+		try:
+			cursor.execute("RESET wlm_query_slot_count; RESET query_group;")
+		finally:
+			cursor.close()
+		dbapi_connection.commit()
+	except Exception as e:
+		# Rather drop the connection than hand it out with unknown settings
+		connection_record.invalidate(e)
+
+
+def _get_credentials(etl_user):
+	db = settings.REDSHIFT_DATABASE
+	if etl_user:
+		return db["ETL_USER"], db["ETL_PASSWORD"]
+	return db["USER"], db["PASSWORD"]
+
+
+def _create_redshift_engine(username, password, pooled=True):
 	db = settings.REDSHIFT_DATABASE
-	username = db["ETL_USER"] if etl_user else db["USER"]
-	password = db["ETL_PASSWORD"] if etl_user else db["PASSWORD"]
 	url = URL(
 		db["ENGINE"],
 		username=username, password=password,
 		host=db["HOST"], port=db["PORT"],
 		database=db["NAME"]
 	)
-	return create_engine(
-		url, poolclass=NullPool,
-		connect_args=settings.REDSHIFT_DATABASE["OPTIONS"]
+
+	pool_size = getattr(settings, "REDSHIFT_CONNECTION_POOL_SIZE", 0)
+	if not pooled or not pool_size:
+		return create_engine(url, poolclass=NullPool, connect_args=db["OPTIONS"])
+
+	engine = create_engine(
+		url,
+		pool_size=pool_size,
+		max_overflow=getattr(settings, "REDSHIFT_CONNECTION_POOL_MAX_OVERFLOW", 0),
+		pool_recycle=getattr(settings, "REDSHIFT_CONNECTION_POOL_RECYCLE_SECONDS", -1),
+		# Connections left idle in the pool (e.g. in a frozen Lambda container) may have
+		# been closed by the cluster in the meantime
+		pool_pre_ping=True,
+		connect_args=db["OPTIONS"]
 	)
 
+	@event.listens_for(engine, "connect")
+	def on_connect(dbapi_connection, connection_record):
+		influx_metric("redshift_connection_created", {"count": 1}, user=username)
+
+	event.listen(engine, "checkin", _reset_session_state)
+
+	return engine
+
+
+def get_redshift_engine(etl_user=False):
+	"""
+	Return the engine of the analytics (or ETL) user.
+
+	Engines are created once per process and user, and keep a pool of up to
+	REDSHIFT_CONNECTION_POOL_SIZE idle connections (plus up to
+	REDSHIFT_CONNECTION_POOL_MAX_OVERFLOW more in use), so that connections are reused
+	rather than set up again for every query.
+	"""
+	username, password = _get_credentials(etl_user)
+
+	with _engines_lock:
+		pid, engine = _engines.get(username, (None, None))
+		if pid != os.getpid():
+			# Pooled connections must not be shared with a forked process
+			engine = _create_redshift_engine(username, password)
+			_engines[username] = os.getpid(), engine
+
+	return engine
+
+
+def get_redshift_background_engine(etl_user=False):
+	"""
+	Return a new, unpooled engine for run_redshift_background_statement().
+
+	Background statements keep running after the connection that submitted them is
+	released. A pooled connection would be reset (and handed out again) on checkin while
+	its statement is still executing, so each one gets a connection of its own instead.
+	"""
+	username, password = _get_credentials(etl_user)
+	return _create_redshift_engine(username, password, pooled=False)
+
+
+def report_redshift_pool_metrics():
+	"""Emit the usage of each engine's connection pool as a metric."""
+	for username, (pid, engine) in list(_engines.items()):
+		pool = engine.pool
+		if pid != os.getpid() or isinstance(pool, NullPool):
+			continue
+
+		influx_metric("redshift_connection_pool", {
+			"size": pool.size(),
+			"checked_in": pool.checkedin(),
+			"checked_out": pool.checkedout(),
+			"overflow": max(pool.overflow(), 0),
+		}, user=username)
+
 
 def get_new_redshift_connection(autocommit=True, etl_user=False):
 	conn = get_redshift_engine(etl_user).connect()
@@ -36,6 +139,56 @@ def get_new_redshift_connection(autocommit=True, etl_user=False):
 	return conn
 
 
+_metadata = {}
+_metadata_lock = threading.Lock()
+
+
+def _reflect_redshift_metadata(engine):
+	md = MetaData()
+	try:
+		md.reflect(engine)
+	except InternalError:
+		# We get intermittent cache lookup failures
+		# Due to concurrent modifications of an internal postgres engine cache
+		# AWS suggests waiting and then re-attempting.
+		# https://dba.stackexchange.com/questions/173815/redshift-internalerror-cache-lookup-failed-for-relation
+		time.sleep(5)
+		# We try one more time before raising the exception
+		md.reflect(engine)
+	return md
+
+
+def get_redshift_metadata(refresh=False, etl_user=True):
+	"""
+	Return the reflected MetaData of the Redshift database, as seen by the ETL user.
+
+	The MetaData is reflected at most once every REDSHIFT_METADATA_TTL_SECONDS per
+	process, unless refresh is True.
+	"""
+	ttl = getattr(settings, "REDSHIFT_METADATA_TTL_SECONDS", 300)
+	engine = get_redshift_engine(etl_user=etl_user)
+
+	with _metadata_lock:
+		reflected_at, md = _metadata.get(engine, (0, None))
+		if md is None or refresh or time.time() - reflected_at > ttl:
+			md = _reflect_redshift_metadata(engine)
+			_metadata[engine] = time.time(), md
+			influx_metric("redshift_metadata_reflected", {"count": 1, "tables": len(md.tables)})
+
+	return md
+
+
+def get_redshift_table(name, etl_user=True):
+	"""
+	Return the reflected Table for a table name, only reflecting the database again if
+	the table was created since the cached MetaData was.
+	"""
+	md = get_redshift_metadata(etl_user=etl_user)
+	if name not in md.tables:
+		md = get_redshift_metadata(refresh=True, etl_user=etl_user)
+	return md.tables[name]
+
+
 def get_new_redshift_session(autoflush=False):
 	Session = sessionmaker()
 	session = Session(bind=get_new_redshift_connection(autocommit=False), autoflush=autoflush)
@@ -1,9 +1,20 @@
+import hashlib
 import logging
+import random
+import threading
 import time
+from bisect import bisect_right
+from collections import Counter, defaultdict, deque
+from contextlib import contextmanager
+from itertools import islice
 from math import ceil
+from queue import Empty, Queue
 
+from botocore.exceptions import ClientError
 from django.conf import settings
 
+from hsreplaynet.utils.influx import influx_metric
+
 from .clients import FIREHOSE, IAM, KINESIS
 
 
@@ -12,6 +23,22 @@ logger = logging.getLogger("hsreplaynet")
 KINESIS_WRITES_PER_SEC = 1000
 KINESIS_MAX_BATCH_WRITE_SIZE = 500
 MAX_WRITES_SAFETY_LIMIT = .8
+KINESIS_MAX_ATTEMPTS = 5
+KINESIS_THROTTLING_ERROR_CODES = (
+	"ProvisionedThroughputExceededException", "KMSThrottlingException"
+)
+# How a shard's rate is adjusted when its writes are (or are not) throttled
+KINESIS_THROTTLED_RATE_FACTOR = .5
+KINESIS_RATE_INCREASE_RATIO = .02
+KINESIS_MIN_RATE_RATIO = .05
+
+# https://docs.aws.amazon.com/firehose/latest/dev/limits.html
+FIREHOSE_MAX_RECORD_SIZE = 1000 * 1024
+FIREHOSE_MAX_BATCH_RECORDS = 500
+FIREHOSE_MAX_BATCH_SIZE = 4 * 1024 * 1024
+FIREHOSE_MAX_ATTEMPTS = 4
+FIREHOSE_BACKOFF_BASE_SECONDS = 0.1
+FIREHOSE_BACKOFF_MAX_SECONDS = 5
 
 
 def get_firehose_role_arn() -> str:
@@ -85,14 +112,46 @@ def current_stream_size(stream_name: str) -> int:
 
 
 def next_record_batch_of_size(iterable, max_batch_size: int):
-	result = []
-	count = 0
-	record = next(iterable, None)
-	while record and count < max_batch_size:
-		result.append(record)
-		count += 1
-		record = next(iterable, None)
-	return result
+	# The iterator must not be advanced past the batch, or that record would be lost
+	return list(islice(iterable, max_batch_size))
+
+
+class TokenBucket:
+	"""
+	Paces the records published to a rate (in records per second), letting bursts of up
+	to a second's worth of records through. Safe to share between threads.
+	"""
+
+	def __init__(self, rate):
+		self.rate = rate
+		self.tokens = rate
+		self._updated = time.monotonic()
+		self._lock = threading.Lock()
+
+	def _refill(self):
+		now = time.monotonic()
+		self.tokens = min(self.rate, self.tokens + (now - self._updated) * self.rate)
+		self._updated = now
+
+	def acquire(self, count=1):
+		"""
+		Take count tokens, sleeping for as long as the bucket is left in debt. Concurrent
+		callers queue up behind each other's debt. Return how long the call slept for.
+		"""
+		with self._lock:
+			self._refill()
+			self.tokens -= count
+			wait = -self.tokens / self.rate if self.tokens < 0 else 0
+
+		if wait > 0:
+			time.sleep(wait)
+		return wait
+
+	def set_rate(self, rate):
+		with self._lock:
+			self._refill()
+			self.rate = rate
+			self.tokens = min(self.tokens, rate)
 
 
 def publish_from_iterable_at_fixed_speed(
@@ -104,62 +163,289 @@ def publish_from_iterable_at_fixed_speed(
 	if max_records_per_second == 0:
 		raise ValueError("times_per_second must be greater than 0!")
 
-	finished = False
-	while not finished:
+	bucket = TokenBucket(max_records_per_second)
+	iterator = iter(iterable)
+	while True:
+		batch = next_record_batch_of_size(iterator, publish_batch_size)
+		if not batch:
+			break
+		bucket.acquire(len(batch))
+		publisher_func(batch)
+
+
+class KinesisShardMap:
+	"""Maps partition keys to the open shards of a stream, the way Kinesis does."""
+
+	def __init__(self, shards):
+		shards = sorted(shards, key=lambda s: int(s["HashKeyRange"]["StartingHashKey"]))
+		self.shard_ids = [shard["ShardId"] for shard in shards]
+		self._starting_hash_keys = [
+			int(shard["HashKeyRange"]["StartingHashKey"]) for shard in shards
+		]
+
+	def __len__(self):
+		return len(self.shard_ids)
+
+	def get_shard_id(self, partition_key):
+		hash_key = int(hashlib.md5(partition_key.encode("utf-8")).hexdigest(), 16)
+		index = bisect_right(self._starting_hash_keys, hash_key) - 1
+		return self.shard_ids[max(index, 0)]
+
+
+class AdaptiveKinesisPublisher:
+	"""
+	Publishes the records of an iterable to a Kinesis stream as fast as its shards accept
+	them, with several PutRecords batches in flight at once.
+
+	Each shard gets a token bucket, starting at a safe fraction of the shard's write limit.
+	A shard's rate is halved whenever its records are throttled and creeps back up while
+	they are not; throttled (and otherwise failed) records are retried in later batches.
+	Without a partition_key function, records cannot be attributed to their shard ahead
+	of time and a single bucket paces the whole stream instead.
+	"""
+
+	def __init__(
+		self, stream_name, publisher_func, shards, partition_key=None,
+		max_in_flight_batches=4, batch_size=KINESIS_MAX_BATCH_WRITE_SIZE,
+		max_attempts=KINESIS_MAX_ATTEMPTS, total=None, progress_interval_seconds=10
+	):
+		"""
+		:param publisher_func: called with a list of records, returns the PutRecords response
+		:param shards: the open shards of the stream, as returned by list_open_shards()
+		:param partition_key: called with a record, returns its partition key
+		:param max_in_flight_batches: how many batches to publish at once
+		:param max_attempts: how many times to try publishing a record before giving up
+		:param total: how many records the iterable holds, if known, to estimate an ETA
+		:param progress_interval_seconds: how often to report progress
+		"""
+		self.stream_name = stream_name
+		self.publisher_func = publisher_func
+		self.partition_key = partition_key
+		self.max_in_flight_batches = max_in_flight_batches
+		self.batch_size = batch_size
+		self.max_attempts = max_attempts
+		self.total = total
+		self.progress_interval_seconds = progress_interval_seconds
+
+		self.shard_map = KinesisShardMap(shards)
+		if partition_key is not None:
+			self.max_rate = KINESIS_WRITES_PER_SEC
+			bucket_keys = self.shard_map.shard_ids
+		else:
+			self.max_rate = KINESIS_WRITES_PER_SEC * len(self.shard_map)
+			bucket_keys = [None]
+		self.min_rate = self.max_rate * KINESIS_MIN_RATE_RATIO
+		self.buckets = {
+			key: TokenBucket(ceil(self.max_rate * MAX_WRITES_SAFETY_LIMIT))
+			for key in bucket_keys
+		}
+		self._last_throttled = {}
+
+		self._lock = threading.Lock()
+		self._retries = deque()
+		self.published = 0
+		self.retried = 0
+		self.throttled = 0
+		self.failed = 0
+		self.shard_records = Counter()
+		self._start_time = None
+		self._last_report = None
+
+	def get_bucket_key(self, record):
+		if self.partition_key is None:
+			return None
+		return self.shard_map.get_shard_id(self.partition_key(record))
+
+	def _adapt_rate(self, key, throttled):
+		bucket = self.buckets[key]
+		now = time.monotonic()
+		if throttled:
+			# Batches in flight at the same time all see the same throttling: only back
+			# off once per second.
+			if now - self._last_throttled.get(key, 0) >= 1:
+				self._last_throttled[key] = now
+				bucket.set_rate(max(self.min_rate, bucket.rate * KINESIS_THROTTLED_RATE_FACTOR))
+		elif bucket.rate < self.max_rate:
+			step = self.max_rate * KINESIS_RATE_INCREASE_RATIO
+			bucket.set_rate(min(self.max_rate, bucket.rate + step))
+
+	def publish_batch(self, batch, attempt=0):
+		keys = [self.get_bucket_key(record) for record in batch]
+		for key, count in Counter(keys).items():
+			self.buckets[key].acquire(count)
+
 		try:
-			start_time = time.time()
-			records_this_second = 0
-			while not finished and records_this_second < max_records_per_second:
-				# NOTE: If the aggregate data published exceeds 1MB / second there will
-				# be write throughput failures.
-				# As Of 9-20-16 the average record was ~ 180 Bytes
-				# 180 Bytes * 1000 = 180KB (which is well below the threshold)
-				batch = next_record_batch_of_size(iterable, publish_batch_size)
-				if batch:
-					records_this_second += len(batch)
-					publisher_func(batch)
-				else:
-					finished = True
-
-			if not finished:
-				elapsed_time = time.time() - start_time
-				sleep_duration = 1 - elapsed_time
-				if sleep_duration > 0:
-					time.sleep(sleep_duration)
-		except StopIteration:
-			finished = True
-
-
-def fill_stream_from_iterable(stream_name, iterable, publisher_func):
-	"""
-	Invoke func on the next item from iter at the maximum throughput the stream supports.
+			results = self.publisher_func(batch)["Records"]
+		except ClientError as e:
+			error_code = e.response.get("Error", {}).get("Code")
+			if error_code not in KINESIS_THROTTLING_ERROR_CODES:
+				raise
+			results = [{"ErrorCode": error_code}] * len(batch)
+
+		failed = []
+		throttled_keys = set()
+		shard_records = Counter()
+		for record, key, result in zip(batch, keys, results):
+			if "ErrorCode" in result:
+				failed.append(record)
+				if result["ErrorCode"] in KINESIS_THROTTLING_ERROR_CODES:
+					throttled_keys.add(key)
+			else:
+				shard_records[result.get("ShardId")] += 1
+
+		with self._lock:
+			for key in set(keys):
+				self._adapt_rate(key, key in throttled_keys)
+			self.published += len(batch) - len(failed)
+			self.shard_records.update(shard_records)
+			if throttled_keys:
+				self.throttled += len(failed)
+			if failed and attempt + 1 < self.max_attempts:
+				self.retried += len(failed)
+				self._retries.append((failed, attempt + 1))
+			elif failed:
+				self.failed += len(failed)
+				logger.warning(
+					"Giving up on %i records after %i attempts", len(failed), self.max_attempts
+				)
+
+	def _worker(self, queue):
+		while True:
+			item = queue.get()
+			try:
+				if item is None:
+					break
+				batch, attempt = item
+				try:
+					self.publish_batch(batch, attempt)
+				except Exception:
+					logger.exception("Could not publish a batch to %s", self.stream_name)
+					with self._lock:
+						self.failed += len(batch)
+			finally:
+				queue.task_done()
+
+	def _next_batch(self, iterator):
+		with self._lock:
+			if self._retries:
+				return self._retries.popleft()
+		batch = next_record_batch_of_size(iterator, self.batch_size)
+		if batch:
+			return batch, 0
+		return None
+
+	def get_progress(self):
+		elapsed_seconds = time.monotonic() - self._start_time
+		with self._lock:
+			progress = {
+				"published": self.published,
+				"retried": self.retried,
+				"throttled": self.throttled,
+				"failed": self.failed,
+				"target_records_per_second": sum(b.rate for b in self.buckets.values()),
+			}
+			if self.shard_records:
+				progress["busiest_shard_records"] = max(self.shard_records.values())
+
+		records_per_second = progress["published"] / elapsed_seconds if elapsed_seconds else 0
+		progress["records_per_second"] = records_per_second
+		if self.total is not None and records_per_second:
+			remaining = max(self.total - progress["published"] - progress["failed"], 0)
+			progress["eta_seconds"] = remaining / records_per_second
+		return progress
+
+	def report_progress(self, force=False):
+		now = time.monotonic()
+		if not force and now - self._last_report < self.progress_interval_seconds:
+			return
+		self._last_report = now
+
+		progress = self.get_progress()
+		logger.info(
+			"Published %i records to %s (%.1f/s, %i retried, %i failed), ETA: %s",
+			progress["published"], self.stream_name, progress["records_per_second"],
+			progress["retried"], progress["failed"],
+			"%is" % progress["eta_seconds"] if "eta_seconds" in progress else "unknown"
+		)
+		influx_metric("kinesis_stream_fill", progress, stream_name=self.stream_name)
+
+	def run(self, iterable):
+		"""Publish every record of the iterable, returning once they have all been sent."""
+		self._start_time = self._last_report = time.monotonic()
+		iterator = iter(iterable)
+		queue = Queue(maxsize=self.max_in_flight_batches)
+		workers = [
+			threading.Thread(target=self._worker, args=(queue, ))
+			for _ in range(self.max_in_flight_batches)
+		]
+		for thread in workers:
+			thread.start()
+
+		try:
+			while True:
+				item = self._next_batch(iterator)
+				if item is None:
+					# Wait for the batches in flight, which may have records to retry
+					queue.join()
+					with self._lock:
+						if not self._retries:
+							break
+					continue
+				queue.put(item)
+				self.report_progress()
+		finally:
+			for _ in workers:
+				queue.put(None)
+			for thread in workers:
+				thread.join()
+
+		self.report_progress(force=True)
+
+
+def fill_stream_from_iterable(
+	stream_name, iterable, publisher_func, partition_key=None, total=None
+):
+	"""
+	Invoke publisher_func on batches of items from the iterable, at the maximum throughput
+	the stream supports.
+
+	:param partition_key: called with an item, returns its partition key; lets the
+		throughput be tracked (and throttled) per shard
+	:param total: how many items the iterable holds, if known
 	"""
 
 	wait_for_stream_ready(stream_name)
-	stream_size = current_stream_size(stream_name)
-	max_transactions_per_sec = stream_size * KINESIS_WRITES_PER_SEC
-	target_writes_per_sec = ceil(max_transactions_per_sec * MAX_WRITES_SAFETY_LIMIT)
+	shards = list(list_open_shards(stream_name))
+	publisher = AdaptiveKinesisPublisher(
+		stream_name, publisher_func, shards,
+		partition_key=partition_key,
+		max_in_flight_batches=getattr(settings, "KINESIS_STREAM_FILL_MAX_IN_FLIGHT_BATCHES", 4),
+		total=total,
+	)
 	logger.info(
-		"About to fill stream %s at a target of %s writes per second",
-		stream_name, target_writes_per_sec
+		"About to fill stream %s (%i shards) at up to %s writes per second",
+		stream_name, len(shards), publisher.max_rate * len(publisher.buckets)
 	)
 
-	publish_from_iterable_at_fixed_speed(
-		iterable, publisher_func, target_writes_per_sec,
-		publish_batch_size=KINESIS_MAX_BATCH_WRITE_SIZE
-	)
+	publisher.run(iterable)
+	return publisher
 
 
-def to_data_blobs(records, max_blob_size=1000):
+def to_data_blobs(records, max_blob_size=FIREHOSE_MAX_RECORD_SIZE):
+	"""
+	Pack a list of (newline terminated) string records into as few Firehose records as
+	possible, each at most max_blob_size bytes long. A record longer than that on its own
+	is left in a Firehose record of its own.
+	"""
 	result = []
 	current_blob_size = 0
 	current_blob_components = []
 
 	for rec in records:
-		rec_data = rec
-		if current_blob_size + len(rec_data) >= max_blob_size:
+		rec_data = rec.encode("utf-8")
+		if current_blob_size and current_blob_size + len(rec_data) > max_blob_size:
 			result.append({
-				"Data": "".join(current_blob_components).encode("utf-8")
+				"Data": b"".join(current_blob_components)
 			})
 			current_blob_size = 0
 			current_blob_components = []
@@ -170,21 +456,55 @@ def to_data_blobs(records, max_blob_size=1000):
 	if current_blob_size > 0:
 		# At the end flush the remaining blob if its > 0
 		result.append({
-			"Data": "".join(current_blob_components).encode("utf-8")
+			"Data": b"".join(current_blob_components)
 		})
 
 	return result
 
 
-def publish_batch_to_firehose(stream_name, batch):
+def to_firehose_batches(
+	blobs, max_records=FIREHOSE_MAX_BATCH_RECORDS, max_size=FIREHOSE_MAX_BATCH_SIZE
+):
+	"""Split a list of Firehose records into the batches of a PutRecordBatch call each."""
+	batch = []
+	batch_size = 0
+	for blob in blobs:
+		blob_size = len(blob["Data"])
+		if batch and (len(batch) >= max_records or batch_size + blob_size > max_size):
+			yield batch
+			batch = []
+			batch_size = 0
+		batch.append(blob)
+		batch_size += blob_size
+
+	if batch:
+		yield batch
+
+
+def _backoff(attempt_count):
+	"""Sleep for an exponentially growing (and jittered) time before retrying."""
+	ceiling = FIREHOSE_BACKOFF_BASE_SECONDS * 2 ** attempt_count
+	time.sleep(random.uniform(0, min(ceiling, FIREHOSE_BACKOFF_MAX_SECONDS)))
+
+
+def publish_batch_to_firehose(stream_name, batch, max_attempts=FIREHOSE_MAX_ATTEMPTS):
+	"""
+	Publish a batch of Firehose records, retrying the records which failed (with an
+	exponential backoff) up to max_attempts times in total.
+
+	Return the failure reports of the records which could not be published.
+	"""
 	remainder = batch
-	failure_report_records = None
+	failure_report_records = []
 	attempt_count = 0
-	while len(remainder) and attempt_count <= 3:
+	while len(remainder) and attempt_count < max_attempts:
+		if attempt_count:
+			_backoff(attempt_count)
 		remainder, failure_report_records = _attempt_publish_batch_to_firehose(
 			stream_name,
 			remainder
 		)
+		attempt_count += 1
 		if len(remainder):
 			msg = "Firehose attempt %i had %i publish failures"
 			logger.warning(msg % (attempt_count, len(remainder)))
@@ -193,12 +513,27 @@ def publish_batch_to_firehose(stream_name, batch):
 		msg = "Firehose had %i publish failures remaining after last attempt"
 		logger.warning(msg % len(failure_report_records))
 
+	return failure_report_records
+
 
 def _attempt_publish_batch_to_firehose(stream_name, batch):
-	result = FIREHOSE.put_record_batch(
-		DeliveryStreamName=stream_name,
-		Records=batch
-	)
+	try:
+		result = FIREHOSE.put_record_batch(
+			DeliveryStreamName=stream_name,
+			Records=batch
+		)
+	except ClientError as e:
+		error = e.response.get("Error", {})
+		if error.get("Code") != "ServiceUnavailableException":
+			raise
+		# The whole batch was throttled
+		failure_report_records = [dict(
+			record=record,
+			stream_name=stream_name,
+			error_code=error["Code"],
+			error_message=error.get("Message", "")
+		) for record in batch]
+		return batch, failure_report_records
 
 	failed_put_count = result["FailedPutCount"]
 
@@ -216,3 +551,139 @@ def _attempt_publish_batch_to_firehose(stream_name, batch):
 
 	assert failed_put_count == len(failed_records)
 	return failed_records, failure_report_records
+
+
+def publish_records_to_firehose(stream_name, records):
+	"""
+	Publish a list of newline terminated string records to a delivery stream, packed
+	into as few Firehose records and PutRecordBatch calls as the limits allow.
+
+	Return the failure reports of the records which could not be published.
+	"""
+	failure_report_records = []
+	for batch in to_firehose_batches(to_data_blobs(records)):
+		failure_report_records.extend(publish_batch_to_firehose(stream_name, batch))
+
+	influx_metric("firehose_publish", {
+		"records": len(records),
+		"failures": len(failure_report_records),
+	}, stream_name=stream_name)
+
+	return failure_report_records
+
+
+class FirehosePublisher:
+	"""
+	Buffers string records per delivery stream, to publish them with as few calls as
+	possible, to several streams concurrently.
+	"""
+
+	def __init__(self, max_workers=4, max_buffer_size=FIREHOSE_MAX_BATCH_SIZE):
+		"""
+		:param max_workers: how many streams to publish to at once
+		:param max_buffer_size: how many bytes of records to buffer for a stream before
+			publishing them
+		"""
+		self.max_workers = max_workers
+		self.max_buffer_size = max_buffer_size
+		self._lock = threading.Lock()
+		self._buffers = defaultdict(list)
+		self._buffer_sizes = defaultdict(int)
+		self.failure_reports = defaultdict(list)
+
+	def add(self, stream_name, records):
+		with self._lock:
+			self._buffers[stream_name].extend(records)
+			self._buffer_sizes[stream_name] += sum(len(r.encode("utf-8")) for r in records)
+			full = self._buffer_sizes[stream_name] >= self.max_buffer_size
+
+		if full:
+			self.flush([stream_name])
+
+	def flush(self, stream_names=None):
+		"""
+		Publish the records buffered for the given streams (or all streams), returning
+		a dict of stream name -> failure reports.
+		"""
+		queue = Queue()
+		with self._lock:
+			for stream_name in list(stream_names or self._buffers.keys()):
+				records = self._buffers.pop(stream_name, None)
+				self._buffer_sizes.pop(stream_name, None)
+				if records:
+					queue.put((stream_name, records))
+
+		ret = {}
+
+		def worker():
+			while True:
+				try:
+					stream_name, records = queue.get_nowait()
+				except Empty:
+					break
+				try:
+					failures = publish_records_to_firehose(stream_name, records)
+				except Exception as e:
+					logger.exception("Could not publish to %s", stream_name)
+					failures = [dict(
+						record=None,
+						stream_name=stream_name,
+						error_code=type(e).__name__,
+						error_message=str(e)
+					)]
+				ret[stream_name] = failures
+				if failures:
+					with self._lock:
+						self.failure_reports[stream_name].extend(failures)
+
+		num_workers = min(self.max_workers, queue.qsize())
+		if num_workers == 1:
+			worker()
+		elif num_workers > 1:
+			workers = [threading.Thread(target=worker) for _ in range(num_workers)]
+			for thread in workers:
+				thread.start()
+			for thread in workers:
+				thread.join()
+
+		return ret
+
+
+_buffering = threading.local()
+
+
+def publish_to_firehose(stream_name, records):
+	"""
+	Publish string records to a delivery stream, unless the current thread is buffering
+	them with buffered_firehose_publishing(), in which case they are published when it
+	exits and their failures are reported then.
+	"""
+	publisher = getattr(_buffering, "publisher", None)
+	if publisher is not None:
+		publisher.add(stream_name, records)
+		return []
+
+	return publish_records_to_firehose(stream_name, records)
+
+
+@contextmanager
+def buffered_firehose_publishing(**kwargs):
+	"""
+	Buffer the records the current thread publishes with publish_to_firehose() while the
+	block runs, to publish them together once it exits.
+	"""
+	publisher = FirehosePublisher(**kwargs)
+	previous = getattr(_buffering, "publisher", None)
+	_buffering.publisher = publisher
+	try:
+		yield publisher
+	finally:
+		_buffering.publisher = previous
+		publisher.flush()
+		for stream_name, failures in publisher.failure_reports.items():
+			logger.warning(
+				"%i records could not be published to %s", len(failures), stream_name
+			)
+			influx_metric(
+				"firehose_flush_failure", {"count": len(failures)}, stream_name=stream_name
+			)
@@ -0,0 +1,162 @@
+"""
+A cache for payloads which every web worker would otherwise compute on its own.
+
+Values live in a small in-process LRU in front of Redis, so each worker only goes to
+Redis once per ttl, and only one worker at a time recomputes an expired value: the
+others keep serving the previous one (for up to stale_ttl seconds) in the meantime.
+
+Hits and misses are counted in process and reported to Influx every metric_interval
+seconds, rather than once per lookup.
+"""
+import pickle
+import threading
+import time
+from collections import Counter, OrderedDict
+
+from redis_lock import Lock as RedisLock, NotAcquired
+
+from .influx import influx_metric
+
+
+class SharedCache:
+	def __init__(
+		self, name, get_redis, ttl, stale_ttl=None, local_size=128, lock_timeout=30,
+		metric_interval=60
+	):
+		"""
+		:param name: a name for the cache, used in its Redis keys and metrics
+		:param get_redis: a callable returning the Redis client to use
+		:param ttl: how many seconds a value is fresh for
+		:param stale_ttl: how many seconds a value may be served for after it expired,
+			while it is being recomputed (default: ttl)
+		:param local_size: how many values to keep in memory
+		:param lock_timeout: the maximum number of seconds a recomputation may take
+		:param metric_interval: how often (in seconds) to report the hit/miss counts
+		"""
+		self.name = name
+		self.get_redis = get_redis
+		self.ttl = ttl
+		self.stale_ttl = ttl if stale_ttl is None else stale_ttl
+		self.local_size = local_size
+		self.lock_timeout = lock_timeout
+		self._local = OrderedDict()
+		self._local_lock = threading.Lock()
+		self.metric_interval = metric_interval
+		self._results = Counter()
+		self._results_reported_at = time.time()
+		self._results_lock = threading.Lock()
+
+	def _redis_key(self, key):
+		return "SHARED_CACHE:%s:%s" % (self.name, key)
+
+	def _get_local(self, key):
+		with self._local_lock:
+			entry = self._local.get(key)
+			if entry is not None:
+				self._local.move_to_end(key)
+			return entry
+
+	def _set_local(self, key, entry):
+		with self._local_lock:
+			self._local[key] = entry
+			self._local.move_to_end(key)
+			while len(self._local) > self.local_size:
+				self._local.popitem(last=False)
+
+	def _get_shared(self, redis, key):
+		raw = redis.get(self._redis_key(key))
+		if raw is None:
+			return None
+
+		entry = pickle.loads(raw)
+		self._set_local(key, entry)
+		return entry
+
+	def _compute(self, redis, key, compute):
+		value = compute()
+		entry = (time.time(), value)
+		redis.set(
+			self._redis_key(key),
+			pickle.dumps(entry, pickle.HIGHEST_PROTOCOL),
+			ex=int(self.ttl + self.stale_ttl) or 1
+		)
+		self._set_local(key, entry)
+		return value
+
+	def _is_fresh(self, entry):
+		return entry is not None and entry[0] + self.ttl > time.time()
+
+	def _metric(self, result):
+		now = time.time()
+		with self._results_lock:
+			self._results[result] += 1
+			if now - self._results_reported_at < self.metric_interval:
+				return
+			results, self._results = self._results, Counter()
+			self._results_reported_at = now
+
+		for result, count in results.items():
+			influx_metric("shared_cache", {"count": count}, cache=self.name, result=result)
+
+	def get(self, key, compute):
+		"""
+		Return the cached value for key, calling compute() to (re)compute it if needed.
+
+		The value returned by compute() must be picklable.
+		"""
+		key = str(key)
+		entry = self._get_local(key)
+		if self._is_fresh(entry):
+			self._metric("local_hit")
+			return entry[1]
+
+		redis = self.get_redis()
+		entry = self._get_shared(redis, key)
+		if self._is_fresh(entry):
+			self._metric("hit")
+			return entry[1]
+
+		lock = RedisLock(redis, "%s:LOCK" % self._redis_key(key), expire=self.lock_timeout)
+
+		if entry is not None:
+			# The value is stale: if another worker is already recomputing it, serve the
+			# stale value rather than waiting.
+			if not lock.acquire(blocking=False):
+				self._metric("stale")
+				return entry[1]
+		elif not lock.acquire(timeout=self.lock_timeout):
+			# Whoever is computing the value is taking too long; do it ourselves.
+			self._metric("lock_timeout")
+			return self._compute(redis, key, compute)
+
+		try:
+			# Someone else may have stored a fresh value while we waited for the lock
+			entry = self._get_shared(redis, key)
+			if self._is_fresh(entry):
+				self._metric("hit")
+				return entry[1]
+
+			self._metric("miss")
+			return self._compute(redis, key, compute)
+		finally:
+			try:
+				lock.release()
+			except NotAcquired:
+				# The computation outlived the lock, which has expired
+				pass
+
+	def clear(self, key=None):
+		"""Forget the value for key, or every value if key is None."""
+		with self._local_lock:
+			if key is None:
+				self._local.clear()
+			else:
+				self._local.pop(str(key), None)
+
+		redis = self.get_redis()
+		if key is None:
+			keys = list(redis.scan_iter(match=self._redis_key("*")))
+		else:
+			keys = [self._redis_key(key)]
+		if keys:
+			redis.delete(*keys)
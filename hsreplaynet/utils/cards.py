@@ -0,0 +1,168 @@
+"""
+A process-wide, read-only index of the card table.
+
+The hot paths of replay processing and deck serialization only ever need a handful of
+attributes per card, so rather than joining through the card table (or calling
+Card.objects.get()) for every deck and player, we load those attributes once per
+process and keep them in memory.
+"""
+import threading
+import time
+from collections import namedtuple
+
+from django.conf import settings
+
+
+CardInfo = namedtuple(
+	"CardInfo", ["dbf_id", "card_id", "card_class", "card_set", "cost", "name", "type"]
+)
+
+
+class CardIndex:
+	"""
+	An immutable snapshot of the card table.
+
+	Cards are stored in a list indexed by dbf_id, along with a card_id -> dbf_id dict, so
+	lookups by either id are O(1).
+	"""
+
+	def __init__(self, cards, version=None):
+		self.version = version
+		max_dbf_id = max((card.dbf_id for card in cards), default=0)
+		self._by_dbf_id = [None] * (max_dbf_id + 1)
+		self._dbf_ids = {}
+		for card in cards:
+			self._by_dbf_id[card.dbf_id] = card
+			self._dbf_ids[card.card_id] = card.dbf_id
+
+	def __len__(self):
+		return len(self._dbf_ids)
+
+	def __contains__(self, id):
+		return self.get(id) is not None
+
+	def get(self, id):
+		"""Return the CardInfo for a dbf_id or card_id, or None if it is unknown."""
+		if id is None:
+			return None
+		if isinstance(id, str):
+			id = self._dbf_ids.get(id)
+			if id is None:
+				return None
+		if 0 <= id < len(self._by_dbf_id):
+			return self._by_dbf_id[id]
+		return None
+
+	def get_dbf_id(self, card_id):
+		return self._dbf_ids.get(card_id)
+
+	def sort_key(self, id):
+		"""
+		A sort key ordering cards by cost and then name (like the deck list views), and
+		unknown cards last.
+		"""
+		card = self.get(id)
+		if card is None:
+			return (1, 0, str(id))
+		return (0, card.cost or 0, card.name or "")
+
+	@classmethod
+	def from_db(cls):
+		from django_hearthstone.cards.models import Card
+
+		rows = Card.objects.exclude(dbf_id=None).values_list(*CardInfo._fields)
+		return cls([CardInfo(*row) for row in rows], version=get_card_data_version())
+
+
+def get_card_data_version():
+	"""
+	Return a fingerprint of the indexed columns of the card table.
+
+	load_cards updates existing cards in place (cost, text, ...) as well as adding new
+	ones, so the fingerprint is a hash of the content itself, computed by the database.
+	"""
+	from django.db import connection
+	from django_hearthstone.cards.models import Card
+
+	opts = Card._meta
+	columns = ", ".join(opts.get_field(field).column for field in CardInfo._fields)
+	dbf_id = opts.get_field("dbf_id").column
+	with connection.cursor() as cursor:
+		cursor.execute(
+			"SELECT md5(string_agg(concat_ws('|', %s), ',' ORDER BY %s)) "
+			"FROM %s WHERE %s IS NOT NULL" % (columns, dbf_id, opts.db_table, dbf_id)
+		)
+		return cursor.fetchone()[0]
+
+
+_CARD_INDEX_CACHE = {}
+_card_index_lock = threading.Lock()
+
+
+def card_index(check_version=False):
+	"""
+	Return the process-wide CardIndex, building it on first use.
+
+	The card data version is checked at most every CARD_INDEX_VERSION_CHECK_SECONDS, or
+	every CARD_INDEX_MIN_VERSION_CHECK_SECONDS if check_version is True (so that lookups
+	of a card which really does not exist do not query the version every time), and the
+	index is rebuilt if it changed.
+	"""
+	check_interval = getattr(settings, "CARD_INDEX_VERSION_CHECK_SECONDS", 300)
+	if check_version:
+		check_interval = getattr(settings, "CARD_INDEX_MIN_VERSION_CHECK_SECONDS", 30)
+
+	with _card_index_lock:
+		index = _CARD_INDEX_CACHE.get("index")
+		checked_at = _CARD_INDEX_CACHE.get("checked_at", 0)
+
+		if index is None:
+			index = CardIndex.from_db()
+		elif time.time() - checked_at > check_interval:
+			if get_card_data_version() != index.version:
+				index = CardIndex.from_db()
+		else:
+			return index
+
+		_CARD_INDEX_CACHE["index"] = index
+		_CARD_INDEX_CACHE["checked_at"] = time.time()
+
+	return index
+
+
+def get_card(id):
+	"""
+	Return the CardInfo for a dbf_id or card_id, or None if there is no such card.
+
+	Unknown ids trigger a version check, in case the card data was updated since the
+	index was last built.
+	"""
+	card = card_index().get(id)
+	if card is None:
+		card = card_index(check_version=True).get(id)
+	return card
+
+
+def get_cards(card_ids):
+	"""
+	Return a card_id -> CardInfo dict for several card_ids, leaving out the ids which are
+	not cards (or have no dbf_id).
+
+	Like get_card(), unknown ids trigger a version check. Cards still missing from the
+	index after that (because they were added since the last check) are read from the
+	database, so that the result never depends on how fresh the index is.
+	"""
+	from django_hearthstone.cards.models import Card
+
+	index = card_index()
+	if any(card_id not in index for card_id in card_ids):
+		index = card_index(check_version=True)
+
+	cards = {card_id: index.get(card_id) for card_id in card_ids}
+	missing = [card_id for card_id, card in cards.items() if card is None]
+	if missing:
+		rows = Card.objects.filter(card_id__in=missing).exclude(dbf_id=None) \
+			.values_list(*CardInfo._fields)
+		cards.update((row[1], CardInfo(*row)) for row in rows)
+
+	return {card_id: card for card_id, card in cards.items() if card is not None}
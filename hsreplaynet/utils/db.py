@@ -16,3 +16,74 @@ def execute_query(query):
 		ret = dictfetchall(cursor)
 
 	return ret
+
+
+def bulk_get_or_create(model, objs, unique_fields, using="default"):
+	"""
+	Like Model.objects.get_or_create() for a list of unsaved instances.
+
+	All the instances are inserted with a single INSERT ... ON CONFLICT DO NOTHING and
+	the ones that conflicted are then fetched with a single SELECT on unique_fields (the
+	attnames of a unique constraint of the model). This costs two round trips however
+	many instances there are.
+
+	Returns a list of (obj, created) tuples in the same order as objs.
+	"""
+	from functools import reduce
+	from operator import or_
+
+	from django.db import IntegrityError, connections
+	from django.db.models import AutoField, Q
+
+	if not objs:
+		return []
+
+	conn = connections[using]
+	qn = conn.ops.quote_name
+	meta = model._meta
+	fields = [f for f in meta.concrete_fields if not isinstance(f, AutoField)]
+	unique_columns = [meta.get_field(name).column for name in unique_fields]
+
+	values, params = [], []
+	for obj in objs:
+		values.append("(%s)" % (", ".join(["%s"] * len(fields))))
+		params += [f.get_db_prep_save(f.pre_save(obj, True), conn) for f in fields]
+
+	query = "INSERT INTO %s (%s) VALUES %s ON CONFLICT DO NOTHING RETURNING %s" % (
+		qn(meta.db_table),
+		", ".join(qn(f.column) for f in fields),
+		", ".join(values),
+		", ".join(qn(column) for column in [meta.pk.column] + unique_columns),
+	)
+
+	with conn.cursor() as cursor:
+		cursor.execute(query, params)
+		inserted = {tuple(row[1:]): row[0] for row in cursor.fetchall()}
+
+	def get_key(obj):
+		return tuple(getattr(obj, name) for name in unique_fields)
+
+	missing = [get_key(obj) for obj in objs if get_key(obj) not in inserted]
+	existing = {}
+	if missing:
+		lookup = reduce(or_, (Q(**dict(zip(unique_fields, key))) for key in missing))
+		for obj in model.objects.using(using).filter(lookup):
+			existing[get_key(obj)] = obj
+
+	ret = []
+	for obj in objs:
+		key = get_key(obj)
+		if key in inserted:
+			obj.pk = inserted.pop(key)
+			obj._state.adding = False
+			obj._state.db = using
+			# Any later duplicate of this object resolves to the row we just created
+			existing[key] = obj
+			ret.append((obj, True))
+		elif key in existing:
+			ret.append((existing[key], False))
+		else:
+			# Conflicted on a different unique constraint than unique_fields
+			raise IntegrityError("Could not get or create %r (%r)" % (obj, key))
+
+	return ret
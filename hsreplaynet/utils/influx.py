@@ -1,7 +1,10 @@
 """Utils for interacting with Influx"""
+import atexit
 import resource
+import threading
 import time
 from contextlib import contextmanager
+from queue import Empty, Full, Queue
 
 from django.conf import settings
 from django.core.exceptions import ImproperlyConfigured
@@ -65,6 +68,114 @@ def influx_write_payload(payload, client=influx):
 	return result
 
 
+class InfluxBuffer:
+	"""
+	A bounded, in-process buffer of Influx points.
+
+	Points are written in batches from a background thread, whenever batch_size points
+	are waiting or flush_interval seconds have passed. When the buffer is full, new
+	points are dropped rather than blocking the caller.
+	"""
+
+	def __init__(self, client, max_size=10000, batch_size=500, flush_interval=5):
+		self.client = client
+		self.batch_size = batch_size
+		self.flush_interval = flush_interval
+		self.dropped = 0
+		self._queue = Queue(maxsize=max_size)
+		self._flush_lock = threading.Lock()
+		self._wakeup = threading.Event()
+		self._thread = None
+		self._thread_lock = threading.Lock()
+
+	def put(self, payload):
+		self._ensure_thread()
+		for point in payload:
+			try:
+				self._queue.put_nowait(point)
+			except Full:
+				self.dropped += 1
+
+		if self._queue.qsize() >= self.batch_size:
+			self._wakeup.set()
+
+	def flush(self):
+		"""Synchronously write all buffered points."""
+		with self._flush_lock:
+			while True:
+				batch = self._take(self.batch_size)
+				if not batch:
+					break
+				influx_write_payload(batch, client=self.client)
+
+			if self.dropped:
+				dropped, self.dropped = self.dropped, 0
+				log.warning("Dropped %i influx points, the buffer was full", dropped)
+
+	def _take(self, count):
+		batch = []
+		while len(batch) < count:
+			try:
+				batch.append(self._queue.get_nowait())
+			except Empty:
+				break
+		return batch
+
+	def _ensure_thread(self):
+		# Lambda may freeze the process between invocations, and a forked process does
+		# not inherit threads, so check the flusher is still alive on every put().
+		if self._thread is not None and self._thread.is_alive():
+			return
+
+		with self._thread_lock:
+			if self._thread is None or not self._thread.is_alive():
+				self._thread = threading.Thread(
+					target=self._run, name="influx-buffer", daemon=True
+				)
+				self._thread.start()
+
+	def _run(self):
+		while True:
+			self._wakeup.wait(self.flush_interval)
+			self._wakeup.clear()
+			try:
+				self.flush()
+			except Exception:
+				log.exception("Exception while flushing the influx buffer.")
+
+
+if influx is not None and getattr(settings, "INFLUX_BUFFER_ENABLED", False):
+	_influx_buffer = InfluxBuffer(
+		influx,
+		max_size=settings.INFLUX_BUFFER_MAX_SIZE,
+		batch_size=settings.INFLUX_BUFFER_BATCH_SIZE,
+		flush_interval=settings.INFLUX_BUFFER_FLUSH_INTERVAL
+	)
+else:
+	_influx_buffer = None
+
+
+def influx_buffer_payload(payload):
+	"""
+	Write payload to influx in the background if buffering is enabled, otherwise write
+	it synchronously.
+	"""
+	if _influx_buffer is None:
+		return influx_write_payload(payload)
+
+	_influx_buffer.put(payload)
+
+
+def flush_influx():
+	"""Write any buffered influx points; call this before the process may be frozen."""
+	if _influx_buffer is not None:
+		_influx_buffer.flush()
+
+
+# The buffer is flushed by a daemon thread, which is not waited for on exit
+atexit.register(flush_influx)
+
+
 def influx_metric(measure, fields, timestamp=None, **kwargs):
 	if timestamp is None:
 		timestamp = now()
@@ -75,7 +186,7 @@ def influx_metric(measure, fields, timestamp=None, **kwargs):
 		"fields": fields,
 		"time": timestamp.isoformat()
 	}
-	influx_write_payload([payload])
+	influx_buffer_payload([payload])
 
 
 @contextmanager
@@ -112,7 +223,7 @@ def influx_timer(measure, timestamp=None, cloudwatch_url=None, **kwargs):
 
 		if exception_raised and cloudwatch_url:
 			payload["fields"]["cloudwatch"] = cloudwatch_url
-		influx_write_payload([payload])
+		influx_buffer_payload([payload])
 
 
 def get_current_lambda_average_duration_millis(lambda_name, lookback_hours=1):
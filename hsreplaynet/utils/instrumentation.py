@@ -5,7 +5,7 @@ from django.utils.timezone import now
 from raven.contrib.django.raven_compat.models import client as sentry
 
 from . import log
-from .influx import influx_timer
+from .influx import flush_influx, influx_timer
 
 
 def error_handler(e):
@@ -62,7 +62,7 @@ def lambda_handler(
 
 	The following standard lifecycle services are provided:
 		- Sentry reporting for all Exceptions that propagate
-		- Capturing a standard set of metrics for Influx
+		- Capturing a standard set of metrics for Influx (and flushing buffered points)
 		- Making sure all connections to the DB are closed
 		- Capturing metadata to facilitate deployment
 
@@ -137,6 +137,10 @@ def lambda_handler(
 				if not trap_exceptions:
 					raise
 			finally:
+				# Lambda freezes the process once the handler returns, which would strand
+				# any points still waiting in the influx buffer.
+				flush_influx()
+
 				from django import db
 				db.connections.close_all()
 
@@ -1,53 +1,81 @@
 import random
+import threading
 import time
+from collections import defaultdict
 from copy import copy
 from datetime import datetime, timedelta
+from itertools import chain
 from random import randrange
-from typing import Dict, Iterable, List, Optional, Set
+from typing import Dict, Iterable, List, Optional, Set, Tuple
 from uuid import uuid4
 
+import numpy as np
 from django.conf import settings
 from hearthstone.enums import CardClass, FormatType
 from redis import StrictRedis
 
 from hsreplaynet.decks.models import ClusterSnapshot
+from hsreplaynet.utils import log
 from hsreplaynet.utils.redis import (
 	SECONDS_PER_DAY, RedisIntegerMapStorage, RedisPopularityDistribution, RedisTree
 )
 
 
-def _get_random_cache(available_caches, name):
+def _get_random_cache_alias(name):
 	available_replicas = [c for c in settings.CACHES if name in c]
-	return available_caches[random.choice(available_replicas)]
+	return random.choice(available_replicas) if available_replicas else None
+
+
+_DECK_PREDICTION_TREES = {}
+_deck_prediction_trees_lock = threading.Lock()
 
 
 def deck_prediction_tree(player_class, game_format, redis_client=None):
+	"""
+	Return the DeckPredictionTree for a player class and format.
+
+	Trees (along with the node handles and popularity distributions they cache) are kept
+	for the lifetime of the process, one per primary and replica cache alias. The cache
+	objects are thread local, but the Redis clients they hand out are thread safe and share
+	their connection pools process-wide, so the clients of whichever thread first built a
+	tree serve every thread. Trees for an explicit redis_client are not cached.
+	"""
 	from django.core.cache import caches
 
 	player_class = CardClass(int(player_class))
 	game_format = FormatType(int(game_format))
-	if redis_client is None:
-		redis_primary = caches["deck_prediction_primary"]
-		redis_replica = _get_random_cache(caches, "deck_prediction_replica") or redis_primary
-		redis_primary = redis_primary.client.get_client()
-		redis_replica = redis_replica.client.get_client()
-	else:
-		redis_primary = redis_client
-		redis_replica = redis_primary
-
-	return DeckPredictionTree(
-		player_class, game_format, redis_primary, redis_replica
-	)
+	if redis_client is not None:
+		return DeckPredictionTree(player_class, game_format, redis_client, redis_client)
+
+	primary_alias = "deck_prediction_primary"
+	replica_alias = _get_random_cache_alias("deck_prediction_replica") or primary_alias
+	key = (player_class, game_format, primary_alias, replica_alias)
+	with _deck_prediction_trees_lock:
+		tree = _DECK_PREDICTION_TREES.get(key)
+		if tree is None:
+			tree = DeckPredictionTree(
+				player_class, game_format,
+				caches[primary_alias].client.get_client(),
+				caches[replica_alias].client.get_client(),
+			)
+			_DECK_PREDICTION_TREES[key] = tree
+		return tree
 
 
 class PredictionResult:
-	def __init__(self, tree, predicted_deck_id, node, tie, match_attempts, sequence):
+	def __init__(
+		self, tree, predicted_deck_id, popularity, node, tie, match_attempts, sequence,
+		timings=None
+	):
 		self.tree = tree
 		self.predicted_deck_id = predicted_deck_id
+		self.popularity = popularity
 		self.node = node
 		self.tie = tie
 		self.match_attempts = match_attempts
 		self.play_sequences = sequence
+		# How long (in ms) each phase of the lookup took
+		self.timings = timings or {}
 		if node:
 			self.popularity_distribution = tree._popularity_distribution(node)
 		else:
@@ -88,117 +116,131 @@ class DeckPredictionTree:
 		)
 		self.tree_name = "%s_%s_%s" % ("DECK_PREDICTION", player_class.name, format.name)
 		self.tree = RedisTree(self.redis_primary, self.tree_name, ttl=self.ttl)
+		self._popularity_distributions = {}
+		self._popularity_distributions_lock = threading.Lock()
 
 	def lookup(self, dbf_map, sequence):
-		play_sequence = copy(sequence)
-		predicted_deck_id, node, tie, match_attempts = self._lookup(dbf_map, play_sequence)
+		timings = {}
+		predicted_deck_id, popularity, node, tie, match_attempts = self._lookup(
+			dbf_map, sequence, timings
+		)
 		return PredictionResult(
 			self,
 			predicted_deck_id,
+			popularity,
 			node,
 			tie,
 			match_attempts,
-			sequence
+			sequence,
+			timings
 		)
 
-	def _lookup(self, dbf_map, play_sequence):
-		# Seek to the maximum depth in the tree
+	def _lookup(self, dbf_map, play_sequence, timings):
+		# Seek to the maximum depth in the tree, then look for a match starting from the
+		# deepest node (labels that are not in the tree are skipped, so the same node may
+		# come up several times in a row; it is only tried once).
+		start = time.perf_counter()
 		stack = []
-		node = self.tree.root
-
-		while node and len(play_sequence):
-			stack.insert(0, node)
-			next_sequence = play_sequence.pop(0)
-			next_node = node.get_child(next_sequence, create=False)
-			if next_node:
-				node = next_node
-		stack.insert(0, node)
-
-		# Then start looking for a match starting from the deepest node
-		match_attempts = 0
-		while len(stack):
-			node = stack.pop(0)
-			popularity_dist = self._popularity_distribution(node)
-
-			if self.include_current_bucket:
-				end_ts = datetime.utcnow()
-			else:
-				end_ts = datetime.utcnow() - timedelta(seconds=self.bucket_size)
-
-			# Do not request more candidates than the maximum amount
-			# That our deck storage system supports brute force search over
-			# - 1 because distribution(limit=..) is inclusive
-			num_candidates = self.storage.max_match_size - 1
-			candidate_decks = popularity_dist.distribution(
-				end_ts=end_ts,
-				limit=num_candidates
-			)
+		for node in reversed(self.tree.resolve_path(play_sequence)):
+			if not stack or stack[-1] is not node:
+				stack.append(node)
+		timings["resolve_path"] = (time.perf_counter() - start) * 1000
 
-			sorted_candidates = sorted(
-				candidate_decks.items(),
-				key=lambda t: t[1],
-				reverse=True
-			)
-			most_popular = [k for k, v in sorted_candidates]
-
-			matches = self.storage.match(dbf_map, *most_popular)
-			match_attempts += 1
-
-			if len(matches) > 1:
-				first_match = matches[0]
-				first_match_popularity = candidate_decks[first_match]
-				second_match = matches[1]
-				second_match_popularity = candidate_decks[second_match]
+		if self.include_current_bucket:
+			end_ts = datetime.utcnow()
+		else:
+			end_ts = datetime.utcnow() - timedelta(seconds=self.bucket_size)
 
-				# If multiple matches have equal popularity then return None
-				if first_match_popularity > second_match_popularity:
-					return int(first_match), node, False, match_attempts
-				else:
+		start = time.perf_counter()
+		distributions = [self._popularity_distribution(node) for node in stack]
+		ranking_keys = RedisPopularityDistribution.existing_summary_keys(
+			distributions, end_ts=end_ts
+		)
+		timings["summary_keys"] = (time.perf_counter() - start) * 1000
+
+		start = time.perf_counter()
+		try:
+			match_attempts = 0
+			for node, popularity_dist, ranking_key in zip(stack, distributions, ranking_keys):
+				match_attempts += 1
+				if not ranking_key:
+					ranking_key = popularity_dist.summary_key(end_ts=end_ts)
+					if not ranking_key:
+						continue
+
+				# The most popular decks matching dbf_map (several if they are tied)
+				matches = self.storage.ranked_match(dbf_map, ranking_key)
+
+				if len(matches) == 1:
+					deck_id, popularity = matches[0]
+					return int(deck_id), popularity, node, False, match_attempts
+				elif len(matches) > 1:
 					# There is a tie for most popular deck
 					if node.depth == 0:
 						# We are at the root so we must make a choice.
-						top_matches = [first_match, second_match]
-						# Get all the decks tied for first place
-						for additional_match in matches[2:]:
-							if candidate_decks[additional_match] == first_match_popularity:
-								top_matches.append(additional_match)
-						final_match = top_matches[randrange(0, len(top_matches))]
-						return int(final_match), node, False, match_attempts
+						deck_id, popularity = matches[randrange(0, len(matches))]
+						return int(deck_id), popularity, node, False, match_attempts
 					else:
 						pass
 						# We are not at the root, so we pass
 						# And let a node higher up the tree decide
 
-			if len(matches) == 1:
-				return int(matches[0]), node, False, match_attempts
-
-		return None, None, False, match_attempts
+			return None, None, None, False, match_attempts
+		finally:
+			timings["ranked_match"] = (time.perf_counter() - start) * 1000
 
 	def observe(self, deck_id, dbf_map, play_sequence, as_of=None):
-		self.storage.store(deck_id, dbf_map)
-		return self._observe(deck_id, copy(play_sequence), as_of)
+		self.observe_many([(deck_id, dbf_map, play_sequence, as_of)])
+
+	def observe_many(self, observations, as_of=None):
+		"""
+		Observe a batch of (deck_id, dbf_map, play_sequence[, as_of]) tuples.
+
+		The deck maps and tree paths of the whole batch are written in one pipeline, and
+		the popularity of each deck along its path is updated with one increment_many().
+		"""
+		pipeline = self.redis_primary.pipeline(transaction=False)
+		increments = []
+		for deck_id, dbf_map, play_sequence, *overrides in observations:
+			observation_as_of = overrides[0] if overrides and overrides[0] else as_of
+			self.storage.store(deck_id, dbf_map, pipeline=pipeline)
+			for node in self._observe_path(copy(play_sequence), pipeline):
+				increments.append(
+					(self._popularity_distribution(node), deck_id, observation_as_of)
+				)
+		pipeline.execute()
 
-	def _observe(self, deck_id, play_sequence, as_of=None):
+		# Update the popularity of the decks along all the paths at once
+		RedisPopularityDistribution.increment_many(increments)
+
+	def _observe_path(self, play_sequence, pipeline):
+		path = []
 		node = self.tree.root
 		while node and node.depth < self.max_depth:
-			popularity_dist = self._popularity_distribution(node)
-			popularity_dist.increment(deck_id, as_of=as_of)
+			path.append(node)
 			if len(play_sequence):
 				next_sequence = play_sequence.pop(0)
-				node = node.get_child(next_sequence, create=True)
+				node = node.add_child(next_sequence, pipeline=pipeline)
 			else:
 				break
+		return path
 
 	def _popularity_distribution(self, node):
-		dist = RedisPopularityDistribution(
-			self.redis_primary,
-			name=node.key,
-			namespace="POPULARITY",
-			ttl=self.popularity_ttl,
-			max_items=self._max_collection_size_for_depth(node.depth),
-			bucket_size=self.bucket_size
-		)
-		return dist
+		with self._popularity_distributions_lock:
+			dist = self._popularity_distributions.get(node.key)
+			if dist is None:
+				dist = RedisPopularityDistribution(
+					self.redis_primary,
+					name=node.key,
+					namespace="POPULARITY",
+					ttl=self.popularity_ttl,
+					max_items=self._max_collection_size_for_depth(node.depth),
+					bucket_size=self.bucket_size
+				)
+				if len(self._popularity_distributions) >= self.tree.max_cached_nodes:
+					self._popularity_distributions.clear()
+				self._popularity_distributions[node.key] = dist
+			return dist
 
 	def _max_collection_size_for_depth(self, depth, min_size=1000.0):
 		# Nodes closer to the root retain more deck state
@@ -262,6 +304,17 @@ class BaseInverseLookupTable:
 		"""
 		raise NotImplementedError
 
+	def observe_many(
+		self, observations: Iterable[Tuple[Dict[int, int], int, Optional[str]]]
+	) -> None:
+		"""
+		This method takes an iterable of (dbf_map, deck_id, uuid) observations and
+		observes all of them, as if observe() was called for each. Implementations should
+		override this to store the whole batch at once.
+		"""
+		for dbf_map, deck_id, uuid in observations:
+			self.observe(dbf_map, deck_id, uuid)
+
 	def predict(self, dbf_map: Dict[int, int]) -> Optional[int]:
 		"""
 		This method takes a list of cards as a dict of {card_id: count} items and attempts
@@ -300,31 +353,88 @@ class RedisInverseLookupTable(BaseInverseLookupTable):
 	def observe(
 		self, dbf_map: Dict[int, int], deck_id: int, uuid: Optional[str] = None
 	) -> None:
-		if not self._is_full_deck(dbf_map):
-			raise ValueError("The deck is not a full deck")
+		self.observe_many([(dbf_map, deck_id, uuid)])
+
+	def observe_many(
+		self, observations: Iterable[Tuple[Dict[int, int], int, Optional[str]]]
+	) -> None:
+		observations = list(observations)
+		if not observations:
+			return
+
+		for dbf_map, deck_id, uuid in observations:
+			if not self._is_full_deck(dbf_map):
+				raise ValueError("The deck is not a full deck")
 
 		# calculate times
 		now_msecs = int(time.time() * 1000)
 		lookback_msecs = self.deck_popularity_lookback_mins * 60 * 1000
 
+		# group the observations by key, so that each key is written only once
+		decks_by_card_key = defaultdict(set)
+		uuids_by_deck_key = defaultdict(set)
+		for dbf_map, deck_id, uuid in observations:
+			for key in self._get_card_keys(dbf_map):
+				decks_by_card_key[key].add(deck_id)
+			uuids_by_deck_key[self._get_deck_key(deck_id)].add(uuid or str(uuid4()))
+
 		# pipeline all the following commands
 		pipeline = self.redis.pipeline()
 
 		# observe the cards in ILTs
-		for key in self._get_card_keys(dbf_map):
-			pipeline.zadd(key, now_msecs, deck_id)
+		for key, deck_ids in decks_by_card_key.items():
+			pipeline.zadd(key, *chain.from_iterable((now_msecs, d) for d in deck_ids))
 			pipeline.expire(key, self.ilt_lookback_mins * 60)
 
-		# observe the deck for popularity
-		deck_key = self._get_deck_key(deck_id)
-		uuid = uuid or str(uuid4())
-		pipeline.zadd(deck_key, now_msecs, uuid)
-		pipeline.zremrangebyscore(deck_key, 0, now_msecs - lookback_msecs)
-		pipeline.expire(deck_key, self.deck_popularity_lookback_mins * 60)
+		# observe the decks for popularity
+		for deck_key, uuids in uuids_by_deck_key.items():
+			pipeline.zadd(deck_key, *chain.from_iterable((now_msecs, u) for u in uuids))
+			pipeline.zremrangebyscore(deck_key, 0, now_msecs - lookback_msecs)
+			pipeline.expire(deck_key, self.deck_popularity_lookback_mins * 60)
+
+		# index the keys written above, so that they can be listed without a SCAN
+		self._index_keys(pipeline, "ILT", decks_by_card_key, now_msecs, self.ilt_lookback_mins)
+		self._index_keys(
+			pipeline,
+			"POPULARITY",
+			uuids_by_deck_key,
+			now_msecs,
+			self.deck_popularity_lookback_mins
+		)
+
+		# remember since when the indexes have been kept up
+		index_lookback_mins = max(self.ilt_lookback_mins, self.deck_popularity_lookback_mins)
+		pipeline.set(self._get_index_start_key(), now_msecs, nx=True)
+		pipeline.expire(self._get_index_start_key(), index_lookback_mins * 60)
 
 		# send the pipeline over the wire
 		pipeline.execute()
 
+	def _index_keys(
+		self, pipeline, kind: str, keys: Iterable[str], now_msecs: int, lookback_mins: int
+	) -> None:
+		if not keys:
+			return
+
+		index_key = self._get_index_key(kind)
+		pipeline.zadd(index_key, *chain.from_iterable((now_msecs, key) for key in keys))
+		pipeline.zremrangebyscore(index_key, 0, now_msecs - lookback_mins * 60 * 1000)
+		pipeline.expire(index_key, lookback_mins * 60)
+
+	def _get_index_key(self, kind: str) -> str:
+		"""
+		Return the key of the sorted set indexing the ILT ("ILT") or popularity
+		("POPULARITY") keys of this table, scored by the time they were last written to.
+		"""
+		return f"{self.namespace}:INDEX:{kind}"
+
+	def _get_index_start_key(self) -> str:
+		"""
+		Return the key holding the time since which the indexes have been written to
+		without interruption; keys written to before that time may be missing from them.
+		"""
+		return f"{self.namespace}:INDEX:SINCE"
+
 	def _is_full_deck(self, dbf_map: Dict[int, int]) -> bool:
 		return sum(count for card_id, count in dbf_map.items()) == self.full_deck_size
 
@@ -432,6 +542,329 @@ class RedisInverseLookupTable(BaseInverseLookupTable):
 		return self.redis.zcount(key, now_msecs - lookback_msecs, "+inf")
 
 
+class InMemoryInverseLookupTable(BaseInverseLookupTable):
+	"""
+	An Inverse Lookup Table that keeps its card -> deck mappings in process memory.
+
+	The mappings are stored as a bitmap with a row per card key and a bit per deck, so
+	intersecting the cards of a prediction (including fuzzy matching) comes down to a
+	few vectorized AND and popcount operations.
+
+	The Redis ILT it wraps remains the source of truth: observations are written through
+	to it, and observations made by other processes are pulled from it incrementally, at
+	most every `refresh_interval` seconds. Refreshes run in a background thread, one at
+	a time; until one of them has loaded a full lookback window of observations,
+	predictions are served by the Redis ILT.
+
+	Deck popularity is kept as per-minute observation counts; only the observations that
+	the next refresh may read again are kept individually, so that they are not counted
+	twice.
+	"""
+
+	# Re-read this much history on every refresh, to pick up observations that were in
+	# flight (or made by a process with a slightly different clock) during the last one.
+	REFRESH_OVERLAP_MSECS = 60 * 1000
+
+	OBSERVATION_BUCKET_MSECS = 60 * 1000
+
+	def __init__(
+		self,
+		source: RedisInverseLookupTable,
+		refresh_interval: int = settings.ILT_IN_MEMORY_REFRESH_SECONDS,
+	) -> None:
+		self.source = source
+		self.refresh_interval = refresh_interval
+		self._lock = threading.RLock()
+		self._refresh_lock = threading.Lock()
+		self._refreshed_at_msecs = None
+		self._refresh_checked_at = 0.0
+		self._complete = False
+
+		self._rows = {}  # card key -> bitmap row
+		self._columns = {}  # deck id -> bitmap column
+		self._allocate(num_rows=0, num_columns=0)
+
+	def _allocate(self, num_rows: int, num_columns: int) -> None:
+		# Columns are packed eight to a byte, so keep their number a multiple of eight
+		num_columns = -(-num_columns // 8) * 8
+		self._bitmap = np.zeros((num_rows, num_columns // 8), dtype=np.uint8)
+		self._deck_ids = np.zeros(num_columns, dtype=np.int64)
+		self._last_seen = np.zeros(num_columns, dtype=np.int64)
+		self._observations = [{} for _ in range(num_columns)]  # uuid -> timestamp
+		self._observation_counts = [{} for _ in range(num_columns)]  # bucket -> count
+
+	def _grow(self, num_rows: int, num_columns: int) -> None:
+		bitmap = self._bitmap
+		deck_ids = self._deck_ids
+		last_seen = self._last_seen
+		observations = self._observations
+		observation_counts = self._observation_counts
+
+		self._allocate(num_rows, num_columns)
+		self._bitmap[:bitmap.shape[0], :bitmap.shape[1]] = bitmap
+		self._deck_ids[:len(deck_ids)] = deck_ids
+		self._last_seen[:len(last_seen)] = last_seen
+		self._observations[:len(observations)] = observations
+		self._observation_counts[:len(observation_counts)] = observation_counts
+
+	def _get_row(self, key: str) -> int:
+		if key not in self._rows:
+			if len(self._rows) == self._bitmap.shape[0]:
+				self._grow(max(64, 2 * len(self._rows)), len(self._deck_ids))
+			self._rows[key] = len(self._rows)
+		return self._rows[key]
+
+	def _get_column(self, deck_id: int) -> int:
+		if deck_id not in self._columns:
+			if len(self._columns) == len(self._deck_ids):
+				self._grow(self._bitmap.shape[0], max(64, 2 * len(self._columns)))
+			column = len(self._columns)
+			self._columns[deck_id] = column
+			self._deck_ids[column] = deck_id
+		return self._columns[deck_id]
+
+	def _add_deck(self, keys: Iterable[str], deck_id: int, ts: int) -> None:
+		column = self._get_column(deck_id)
+		byte, bit = divmod(column, 8)
+		for key in keys:
+			# (_get_row may reallocate the bitmap, so call it first)
+			row = self._get_row(key)
+			self._bitmap[row, byte] |= 0x80 >> bit
+		self._last_seen[column] = max(self._last_seen[column], ts)
+
+	def _add_observation(self, deck_id: int, uuid: str, ts: int) -> None:
+		observations = self._observations[self._get_column(deck_id)]
+		observations[uuid] = max(observations.get(uuid, 0), ts)
+
+	def _compact(self, now_msecs: int) -> None:
+		"""Drop the columns of decks that have not been observed within the lookback."""
+		cutoff = now_msecs - self.source.ilt_lookback_mins * 60 * 1000
+		live = np.flatnonzero(self._last_seen[:len(self._columns)] >= cutoff)
+		if not self._columns or 2 * len(live) > len(self._columns):
+			return
+
+		bitmap = np.unpackbits(self._bitmap, axis=1)[:, live]
+		deck_ids = self._deck_ids[live]
+		last_seen = self._last_seen[live]
+		observations = [self._observations[column] for column in live]
+		observation_counts = [self._observation_counts[column] for column in live]
+
+		self._allocate(self._bitmap.shape[0], max(64, 2 * len(live)))
+		self._bitmap[:, :-(-len(live) // 8)] = np.packbits(bitmap, axis=1)
+		self._deck_ids[:len(live)] = deck_ids
+		self._last_seen[:len(live)] = last_seen
+		self._observations[:len(live)] = observations
+		self._observation_counts[:len(live)] = observation_counts
+		self._columns = {int(deck_id): column for column, deck_id in enumerate(deck_ids)}
+
+	def _prune_observations(self, now_msecs: int) -> None:
+		"""
+		Fold the observations that the next refresh will not read again into their
+		counts, and forget those that have dropped out of the popularity lookback.
+		"""
+		settled = self._refreshed_at_msecs - self.REFRESH_OVERLAP_MSECS
+		cutoff = now_msecs - self.source.deck_popularity_lookback_mins * 60 * 1000
+		cutoff_bucket = cutoff // self.OBSERVATION_BUCKET_MSECS
+		for column, observations in enumerate(self._observations[:len(self._columns)]):
+			counts = self._observation_counts[column]
+			if observations and min(observations.values()) < settled:
+				for ts in observations.values():
+					bucket = ts // self.OBSERVATION_BUCKET_MSECS
+					if ts < settled and bucket >= cutoff_bucket:
+						counts[bucket] = counts.get(bucket, 0) + 1
+				self._observations[column] = {
+					uuid: ts for uuid, ts in observations.items() if ts >= settled
+				}
+			for bucket in [bucket for bucket in counts if bucket < cutoff_bucket]:
+				del counts[bucket]
+
+	def refresh(self) -> None:
+		"""Pull the observations made since the last refresh from the Redis ILT."""
+		now_msecs = int(time.time() * 1000)
+		self._refresh_checked_at = time.time()
+		if self._refreshed_at_msecs is None:
+			since_msecs = now_msecs - self.source.ilt_lookback_mins * 60 * 1000
+		else:
+			since_msecs = self._refreshed_at_msecs - self.REFRESH_OVERLAP_MSECS
+
+		# list the keys written to since the last refresh from their indexes...
+		redis = self.source.redis
+		pipeline = redis.pipeline(transaction=False)
+		pipeline.zrangebyscore(self.source._get_index_key("ILT"), since_msecs, "+inf")
+		pipeline.zrangebyscore(self.source._get_index_key("POPULARITY"), since_msecs, "+inf")
+		pipeline.get(self.source._get_index_start_key())
+		card_keys, deck_keys, indexed_since = pipeline.execute()
+
+		# The indexes only list the keys written to since they were started; until they
+		# go back a full lookback window, observations may be missing from the table.
+		index_lookback_msecs = max(
+			self.source.ilt_lookback_mins, self.source.deck_popularity_lookback_mins
+		) * 60 * 1000
+		complete = (
+			indexed_since is not None and
+			now_msecs - int(indexed_since) >= index_lookback_msecs
+		)
+
+		# ...and read their new members
+		pipeline = redis.pipeline(transaction=False)
+		for key in card_keys + deck_keys:
+			pipeline.zrangebyscore(key, since_msecs, "+inf", withscores=True)
+		results = pipeline.execute()
+
+		with self._lock:
+			for key, members in zip(card_keys, results):
+				key = key.decode("utf-8")
+				for deck_id, ts in members:
+					self._add_deck([key], int(deck_id), int(ts))
+			for key, members in zip(deck_keys, results[len(card_keys):]):
+				deck_id = int(key.decode("utf-8").rsplit(":", 1)[-1])
+				for uuid, ts in members:
+					self._add_observation(deck_id, uuid.decode("utf-8"), int(ts))
+
+			self._refreshed_at_msecs = now_msecs
+			self._complete = self._complete or complete
+			self._prune_observations(now_msecs)
+			self._compact(now_msecs)
+
+	def _refresh_in_background(self) -> None:
+		try:
+			self.refresh()
+		except Exception:
+			log.exception("Could not refresh the in-memory ILT %s", self.source.namespace)
+		finally:
+			self._refresh_lock.release()
+
+	def _maybe_refresh(self) -> None:
+		if time.time() - self._refresh_checked_at < self.refresh_interval:
+			return
+
+		# Only one refresh at a time: callers that find one in progress carry on with
+		# the data that is already loaded.
+		if not self._refresh_lock.acquire(blocking=False):
+			return
+
+		self._refresh_checked_at = time.time()
+		threading.Thread(target=self._refresh_in_background, daemon=True).start()
+
+	def observe(
+		self, dbf_map: Dict[int, int], deck_id: int, uuid: Optional[str] = None
+	) -> None:
+		self.observe_many([(dbf_map, deck_id, uuid)])
+
+	def observe_many(
+		self, observations: Iterable[Tuple[Dict[int, int], int, Optional[str]]]
+	) -> None:
+		observations = [
+			(dbf_map, deck_id, uuid or str(uuid4())) for dbf_map, deck_id, uuid in observations
+		]
+		self.source.observe_many(observations)
+
+		if self._refreshed_at_msecs is None:
+			# Nothing loaded yet: the first refresh will read these from Redis
+			return
+
+		now_msecs = int(time.time() * 1000)
+		with self._lock:
+			for dbf_map, deck_id, uuid in observations:
+				self._add_deck(self.source._get_card_keys(dbf_map), deck_id, now_msecs)
+				self._add_observation(deck_id, uuid, now_msecs)
+
+		# Keep the table refreshed (and its observations folded) in processes that
+		# mostly observe
+		self._maybe_refresh()
+
+	def predict(self, dbf_map: Dict[int, int]) -> Optional[int]:
+		# store some debugging data
+		self._cards_removed = None
+
+		# check to see whether enough the deck to predict has enough cards
+		if not self.source._is_predictable_deck(dbf_map):
+			return None
+
+		self._maybe_refresh()
+
+		if not self._complete:
+			# Still loading, or the Redis indexes do not go back a full lookback window
+			# yet: don't hold up the prediction on it, nor answer from a partial table
+			return self.source.predict(dbf_map)
+
+		with self._lock:
+			return self._predict(dbf_map, int(time.time() * 1000))
+
+	def _predict(self, dbf_map: Dict[int, int], now_msecs: int) -> Optional[int]:
+		# only decks observed within the lookback window take part in the intersection
+		cutoff = now_msecs - self.source.ilt_lookback_mins * 60 * 1000
+		live = np.packbits(self._last_seen >= cutoff)
+		empty = np.zeros_like(live)
+		bits = {
+			key: self._bitmap[self._rows[key]] & live if key in self._rows else empty
+			for key in self.source._get_card_keys(dbf_map)
+		}
+
+		# trivial case: find the decks from a intersection over all cards
+		candidates = self._intersect(bits.values())
+		if len(candidates):
+			return self._most_popular(candidates, now_msecs)
+
+		# count number of decks for each card once before fuzzy matching
+		cardinalities = {
+			key: int(np.unpackbits(row).sum()) for key, row in bits.items()
+		}
+		sorted_keys = sorted(bits, key=lambda key: cardinalities[key])
+		required_keys = self.source._get_card_keys(
+			{key: 1 for key in self.source.required_cards}
+		)
+
+		# fuzzy matching: as long as we can safely remove one card...
+		self._cards_removed = 0
+		while (
+			len(sorted_keys) > self.source.min_cards_for_prediction and
+			self._cards_removed < self.source.max_fuzzy_cards_removed
+		):
+			# ...find a non-required card to remove
+			for index, key_to_remove in enumerate(sorted_keys):
+				if key_to_remove not in required_keys:
+					del sorted_keys[index]
+					self._cards_removed += 1
+					break
+			else:
+				# we were unable to remove anything, terminate
+				return None
+			# ...calculate our new candidates
+			candidates = self._intersect(bits[key] for key in sorted_keys)
+			# ...and finally check whether we got a match
+			if len(candidates) > 0:
+				return self._most_popular(candidates, now_msecs)
+
+		# we were unable to match a deck
+		return None
+
+	def _intersect(self, rows: Iterable[np.ndarray]) -> np.ndarray:
+		"""Return the bitmap columns of the decks that are set in all of the rows."""
+		rows = list(rows)
+		if not rows:
+			return np.zeros(0, dtype=np.int64)
+		return np.flatnonzero(np.unpackbits(np.bitwise_and.reduce(rows)))
+
+	def _most_popular(self, columns: np.ndarray, now_msecs: int) -> int:
+		cutoff = now_msecs - self.source.deck_popularity_lookback_mins * 60 * 1000
+
+		cutoff_bucket = cutoff // self.OBSERVATION_BUCKET_MSECS
+
+		def popularity(column):
+			counts = self._observation_counts[column]
+			return (
+				sum(count for bucket, count in counts.items() if bucket >= cutoff_bucket) +
+				sum(1 for ts in self._observations[column].values() if ts >= cutoff)
+			)
+
+		return int(self._deck_ids[max(columns, key=popularity)])
+
+
+_IN_MEMORY_ILTS = {}
+_in_memory_ilts_lock = threading.Lock()
+
+
 def inverse_lookup_table(
 	game_format: FormatType, player_class: CardClass, redis_client=None
 ) -> BaseInverseLookupTable:
@@ -446,4 +879,16 @@ def inverse_lookup_table(
 		game_format, player_class
 	)
 
-	return RedisInverseLookupTable(redis_client, game_format, player_class, required_cards)
+	table = RedisInverseLookupTable(redis_client, game_format, player_class, required_cards)
+
+	if settings.ILT_IN_MEMORY_ENABLED:
+		key = (game_format, player_class)
+		with _in_memory_ilts_lock:
+			if key not in _IN_MEMORY_ILTS:
+				_IN_MEMORY_ILTS[key] = InMemoryInverseLookupTable(table)
+			else:
+				# Pick up changes to the required cards
+				_IN_MEMORY_ILTS[key].source = table
+			return _IN_MEMORY_ILTS[key]
+
+	return table
@@ -1,8 +1,10 @@
 import json
+import threading
+from collections import OrderedDict
 from datetime import datetime, timedelta
 from itertools import chain
+from weakref import WeakKeyDictionary
 
-import redis_lock
 from redis import StrictRedis
 
 
@@ -12,6 +14,82 @@ SECONDS_PER_DAY = 24 * SECONDS_PER_HOUR
 DEFAULT_TTL = 15 * SECONDS_PER_DAY  # 15 Days
 
 
+_registered_scripts = WeakKeyDictionary()
+
+
+def register_script(redis, script):
+	"""
+	Like redis.register_script(), but returns the same Script object for every call with
+	the same client and source, so the script is only loaded into Redis once.
+	"""
+	scripts = _registered_scripts.setdefault(redis, {})
+	if script not in scripts:
+		scripts[script] = redis.register_script(script)
+	return scripts[script]
+
+
+def _encode_member(member):
+	return member if isinstance(member, bytes) else str(member).encode("utf8")
+
+
+def _increment_in_transaction(redis, bucket_increments):
+	"""
+	The non-Lua equivalent of RedisPopularityDistribution.INCREMENT_SCRIPT.
+
+	All the state needed to apply the increments is read in one pipeline while the bucket
+	keys are watched, and the writes are then applied in a single MULTI / EXEC, which is
+	retried if any of the buckets changed in the meantime.
+	"""
+	buckets = OrderedDict()
+	for bucket_key, max_items, key, expire_at in bucket_increments:
+		bucket = buckets.setdefault(bucket_key, {
+			"max_items": max_items,
+			"members": [],
+			"expire_at": expire_at,
+		})
+		bucket["members"].append(_encode_member(key))
+		bucket["expire_at"] = max(bucket["expire_at"], expire_at)
+
+	def internal_increment(pipe):
+		reads = redis.pipeline(transaction=False)
+		for bucket_key, bucket in buckets.items():
+			reads.zcard(bucket_key)
+			# The lowest ranked members are the candidates for eviction; we can never need
+			# more of them than we have increments for this bucket.
+			reads.zrange(bucket_key, 0, len(bucket["members"]) - 1, withscores=True)
+			for member in bucket["members"]:
+				reads.zscore(bucket_key, member)
+		results = iter(reads.execute())
+
+		pipe.multi()
+		for bucket_key, bucket in buckets.items():
+			size = next(results)
+			scores = dict(next(results))
+			for member in bucket["members"]:
+				score = next(results)
+				if score is not None:
+					scores[member] = score
+
+			for member in bucket["members"]:
+				if member in scores:
+					pipe.zincrby(bucket_key, member, 1.0)
+					scores[member] += 1.0
+				elif size < bucket["max_items"]:
+					pipe.zadd(bucket_key, 1.0, member)
+					scores[member] = 1.0
+					size += 1
+				else:
+					evicted = min(scores, key=lambda m: (scores[m], m))
+					score = scores.pop(evicted) + 1.0
+					pipe.zrem(bucket_key, evicted)
+					pipe.zadd(bucket_key, score, member)
+					scores[member] = score
+
+			pipe.expireat(bucket_key, bucket["expire_at"])
+
+	redis.transaction(internal_increment, *buckets.keys())
+
+
 class RedisNamespace:
 	def __init__(self, redis, name, namespace, ttl=DEFAULT_TTL):
 		self.redis = redis
@@ -29,28 +107,36 @@ class RedisNamespace:
 
 class RedisPopularityDistribution:
 	INCREMENT_SCRIPT = """
-		local myset = ARGV[1]
-		local set_length = tonumber(ARGV[2])
-		local mykey = ARGV[3]
-		local exp_ts = tonumber(ARGV[4])
-
-		if redis.call('ZRANK', myset, mykey) then
-			redis.call('ZINCRBY', myset, 1.0, mykey)
-		elseif redis.call('ZCARD', myset) < set_length then
-			redis.call('ZADD', myset, 1.0, mykey)
-		else
-			local value = redis.call('ZRANGE', myset, 0, 0, 'withscores')
-			redis.call('ZREM', myset, value[1])
-			redis.call('ZADD', myset, value[2] + 1.0, mykey)
-		end
+		-- Increment a member in each of the sorted sets in KEYS.
+		-- ARGV holds a (max_items, member, expire_at) triple for each key.
+
+		for i, myset in ipairs(KEYS) do
+			local offset = (i - 1) * 3
+			local set_length = tonumber(ARGV[offset + 1])
+			local mykey = ARGV[offset + 2]
+			local exp_ts = tonumber(ARGV[offset + 3])
+
+			if redis.call('ZSCORE', myset, mykey) then
+				redis.call('ZINCRBY', myset, 1.0, mykey)
+			elseif redis.call('ZCARD', myset) < set_length then
+				redis.call('ZADD', myset, 1.0, mykey)
+			else
+				local value = redis.call('ZRANGE', myset, 0, 0, 'withscores')
+				redis.call('ZREM', myset, value[1])
+				redis.call('ZADD', myset, value[2] + 1.0, mykey)
+			end
 
-		redis.call('EXPIREAT', myset, exp_ts)
+			redis.call('EXPIREAT', myset, exp_ts)
+		end
 	"""
 
+	# How often (in buckets) the summaries maintained incrementally are rebuilt from scratch
+	SUMMARY_REBUILD_INTERVAL = 24
+
 	def __init__(
 		self, redis: StrictRedis, name: str, namespace: str,
 		ttl: int = DEFAULT_TTL, max_items: int = 100, bucket_size: int = 3600,
-		use_lua: bool = None
+		use_lua: bool = None, live_summary_ttl: int = 60
 	) -> None:
 		self.redis = redis
 		self.name = name
@@ -58,6 +144,9 @@ class RedisPopularityDistribution:
 		self.ttl = ttl
 		self.max_items = max_items
 		self.bucket_size = bucket_size
+		# How long the summaries of windows which are still being written to are reused
+		# before being rebuilt (0 to rebuild them on every read)
+		self.live_summary_ttl = min(live_summary_ttl, bucket_size)
 
 		if self.bucket_size < 1:
 			raise ValueError("bucket_size must be >= 1")
@@ -71,58 +160,123 @@ class RedisPopularityDistribution:
 
 		self.use_lua = isinstance(redis, StrictRedis) if use_lua is None else use_lua
 
-		if self.use_lua:
-			self.lua_increment = self.redis.register_script(self.INCREMENT_SCRIPT)
-
 	def __repr__(self):
 		return f"<{self.__class__.__name__} {self.namespace}:{self.name}>"
 
 	def increment(self, key, as_of=None):
-		if as_of and not isinstance(as_of, datetime):
-			raise ValueError("as_of must be a datetime")
-
-		ts = as_of if as_of else datetime.utcnow()
-		start_token = self._to_start_token(ts)
-		end_token = self._to_end_token(ts)
-
-		bucket_key = self._bucket_key(start_token, end_token)
-		expire_at = self._to_expire_at(ts)
-
-		if self.use_lua:
-			args = [bucket_key, self.max_items, key, expire_at]
-			self.lua_increment(args=args)
+		self.increment_many([(self, key)], as_of=as_of)
+
+	@classmethod
+	def increment_many(cls, increments, as_of=None):
+		"""
+		Increment a key in each of several distributions in a single round trip.
+
+		increments is an iterable of (distribution, key) pairs, or of (distribution, key,
+		as_of) triples to override as_of per increment; the distributions must all share
+		the same Redis client. The increments are applied atomically, either with one Lua
+		script call or, if the first distribution does not use Lua, with a WATCH / MULTI
+		transaction.
+		"""
+		increments = list(increments)
+		if not increments:
+			return
+
+		redis = increments[0][0].redis
+		use_lua = increments[0][0].use_lua
+
+		now = datetime.utcnow()
+		bucket_increments = []
+		for distribution, key, *overrides in increments:
+			ts = overrides[0] if overrides and overrides[0] else as_of
+			if ts and not isinstance(ts, datetime):
+				raise ValueError("as_of must be a datetime")
+			ts = ts if ts else now
+
+			if distribution.redis is not redis:
+				raise ValueError("Distributions must share the same Redis client")
+
+			start_token = distribution._to_start_token(ts)
+			end_token = distribution._to_end_token(ts)
+			bucket_increments.append((
+				distribution._bucket_key(start_token, end_token),
+				distribution.max_items,
+				key,
+				distribution._to_expire_at(ts),
+			))
+
+		if use_lua:
+			keys = [bucket_key for bucket_key, _, _, _ in bucket_increments]
+			args = list(chain.from_iterable(
+				(max_items, key, expire_at) for _, max_items, key, expire_at in bucket_increments
+			))
+			register_script(redis, cls.INCREMENT_SCRIPT)(keys=keys, args=args)
 		else:
-			lock_name = "%s/%s" % (self.namespace, self.name)
-			with redis_lock.Lock(self.redis, lock_name, expire=300):
-				if self.redis.zrank(bucket_key, key) is not None:
-					self.redis.zincrby(bucket_key, key, 1.0)
-				elif self.redis.zcard(bucket_key) < self.max_items:
-					self.redis.zadd(bucket_key, 1.0, key)
-				else:
-					vals = self.redis.zrange(bucket_key, 0, 0, withscores=True)
-					value, score = vals[0]
-					self.redis.zrem(bucket_key, value)
-					self.redis.zadd(bucket_key, score + 1.0, key)
-
-				self.redis.expireat(bucket_key, expire_at)
+			_increment_in_transaction(redis, bucket_increments)
 
-	def distribution(self, start_ts=None, end_ts=None, limit=None, as_percentages=False):
+	def summary_key(self, start_ts=None, end_ts=None):
+		"""
+		Return the key of a sorted set holding the distribution between start_ts and end_ts,
+		or None if there is no data for the period.
+		"""
 		start_ts = start_ts if start_ts else self.earliest_available_datetime
 		end_ts = end_ts if end_ts else datetime.utcnow()
 
 		if start_ts > end_ts:
 			raise ValueError("start_ts cannot be greater than end_ts")
 
-		exists = self._ensure_exists(start_ts, end_ts)
-		if not exists:
+		return self._ensure_exists(start_ts, end_ts)
+
+	@classmethod
+	def existing_summary_keys(cls, distributions, start_ts=None, end_ts=None):
+		"""
+		Check, in one round trip, which of several distributions (sharing the same Redis
+		client) already have a summary for the period between start_ts and end_ts.
+
+		Return a list holding, for each distribution, the key of that summary or None if
+		it still has to be built by summary_key(). Summaries including the current bucket
+		(or the one that just closed) are only reused for live_summary_ttl seconds.
+		"""
+		distributions = list(distributions)
+		if not distributions:
+			return []
+
+		now = datetime.utcnow()
+		end_ts = end_ts if end_ts else now
+		pipe = distributions[0].redis.pipeline(transaction=False)
+		candidates = []
+		for distribution in distributions:
+			start_token = distribution._to_start_token(
+				start_ts if start_ts else now - timedelta(seconds=distribution.ttl)
+			)
+			end_token = distribution._to_end_token(end_ts)
+			if start_token > end_token:
+				raise ValueError("start_ts cannot be greater than end_ts")
+
+			is_complete = (
+				distribution._next_token(start_token) > end_token or
+				end_token < distribution._settled_start_token
+			)
+			bucket_key = distribution._bucket_key(start_token, end_token)
+			if not is_complete:
+				bucket_key = distribution._live_summary_key(start_token, end_token)
+			candidates.append(
+				bucket_key if is_complete or distribution.live_summary_ttl else None
+			)
+			pipe.exists(bucket_key)
+
+		return [
+			bucket_key if exists else None
+			for bucket_key, exists in zip(candidates, pipe.execute())
+		]
+
+	def distribution(self, start_ts=None, end_ts=None, limit=None, as_percentages=False):
+		summary_key = self.summary_key(start_ts, end_ts)
+		if not summary_key:
 			# We have no distribution data for this time period
 			return {}
 
-		start_token = self._to_start_token(start_ts)
-		end_token = self._to_end_token(end_ts)
-		bucket_key = self._bucket_key(start_token, end_token)
 		num_items = -1 if not limit else limit
-		raw_data = self.redis.zrevrange(bucket_key, 0, num_items, withscores=True)
+		raw_data = self.redis.zrevrange(summary_key, 0, num_items, withscores=True)
 		data = {k.decode("utf8"): int(v) for k, v in raw_data}
 		if len(data) and as_percentages:
 			total = sum(data.values())
@@ -130,6 +284,28 @@ class RedisPopularityDistribution:
 		else:
 			return data
 
+	def buckets(self, start_ts, end_ts):
+		"""
+		Return the raw buckets between start_ts and end_ts, fetched in one round trip, as a
+		(start_token, buckets) tuple. buckets holds a {member: count} dict per bucket (empty
+		for missing buckets), the first one being the bucket starting at start_token.
+		"""
+		start_token = self._to_start_token(start_ts)
+		end_token = self._to_end_token(end_ts)
+
+		pipe = self.redis.pipeline(transaction=False)
+		for bucket_start_token, bucket_end_token in self._generate_bucket_tokens_between(
+			start_token, end_token
+		):
+			pipe.zrange(
+				self._bucket_key(bucket_start_token, bucket_end_token), 0, -1, withscores=True
+			)
+
+		buckets = [
+			{k.decode("utf8"): int(v) for k, v in raw_data} for raw_data in pipe.execute()
+		]
+		return start_token, buckets
+
 	def size(self, start_ts=None, end_ts=None):
 		return len(self.distribution(start_ts, end_ts))
 
@@ -144,30 +320,83 @@ class RedisPopularityDistribution:
 		return round(popularity, precision)
 
 	def _ensure_exists(self, start_ts, end_ts):
+		"""
+		Make sure a summary of the buckets between start_ts and end_ts exists and return its
+		key, or None if there is no data for the period.
+		"""
 		start_token = self._to_start_token(start_ts)
 		end_token = self._to_end_token(end_ts)
-		summary_key = self._bucket_key(start_token, end_token)
-		summary_exists = self.redis.exists(summary_key)
 
 		if self._next_token(start_token) > end_token:
 			# We are dealing with the a single time bucket
-			return summary_exists
+			bucket_key = self._bucket_key(start_token, end_token)
+			return bucket_key if self.redis.exists(bucket_key) else None
+
+		settled_start_token = self._settled_start_token
+		if end_token < settled_start_token:
+			return self._ensure_complete_summary(start_token, end_token)
+
+		# The current bucket is still being written to (as is, by late observations, the one
+		# that just closed), so a summary including it is only reused for a short while.
+		summary_key = self._live_summary_key(start_token, end_token)
+		if self.live_summary_ttl and self.redis.exists(summary_key):
+			return summary_key
+
+		# Only union the summary of the settled buckets (which is maintained incrementally)
+		# with the live ones, rather than every bucket.
+		sources = []
+		live_start_token = max(start_token, settled_start_token)
+		if start_token < live_start_token:
+			sources.append(self._ensure_complete_summary(start_token, live_start_token - 1))
+		sources.extend(
+			self._bucket_key(s, e)
+			for s, e in self._generate_bucket_tokens_between(live_start_token, end_token)
+		)
 
-		includes_current_bucket = end_token > self._current_start_token
-		if not summary_exists or includes_current_bucket:
-			tokens_between = self._generate_bucket_tokens_between(start_token, end_token)
-			buckets = [self._bucket_key(s, e) for s, e in tokens_between]
+		pipe = self.redis.pipeline()
+		pipe.zunionstore(summary_key, sources)
+		pipe.expire(summary_key, self.live_summary_ttl or self.bucket_size)
+		pipe.execute()
+		return summary_key
 
-			if buckets:
-				self.redis.zunionstore(summary_key, buckets)
-				self.redis.expire(summary_key, self.ttl)
-				return True
-			else:
-				# This is an error state
-				return False
+	def _live_summary_key(self, start_token, end_token):
+		# Live summaries are kept apart from the complete ones, which are never rebuilt
+		return "%s:LIVE" % self._bucket_key(start_token, end_token)
+
+	def _ensure_complete_summary(self, start_token, end_token):
+		summary_key = self._bucket_key(start_token, end_token)
+		if self._next_token(start_token) > end_token or self.redis.exists(summary_key):
+			return summary_key
+
+		# Windows usually slide forward one bucket at a time, so if we have the summary of
+		# the previous window we can derive this one from it by adding the bucket that
+		# entered the window and subtracting the one that left it. That only works while
+		# the bucket that left the window has not expired yet.
+		# Observations recorded (with an as_of) in a bucket after it settled never reach the
+		# summaries derived from one that already included it, so every
+		# SUMMARY_REBUILD_INTERVAL buckets the summary is rebuilt from the buckets instead.
+		previous_start_token = start_token - self.bucket_size
+		previous_key = self._bucket_key(previous_start_token, end_token - self.bucket_size)
+		entered_key = self._bucket_key(end_token - self.bucket_size + 1, end_token)
+		left_key = self._bucket_key(previous_start_token, start_token - 1)
+		left_expires_at = start_token - 1 + self.ttl
+		is_rebuild = (start_token // self.bucket_size) % self.SUMMARY_REBUILD_INTERVAL == 0
+
+		pipe = self.redis.pipeline()
+		if (
+			not is_rebuild and
+			left_expires_at > self._current_start_token + self.bucket_size and
+			self.redis.exists(previous_key)
+		):
+			pipe.zunionstore(summary_key, {previous_key: 1, entered_key: 1, left_key: -1})
+			pipe.zremrangebyscore(summary_key, "-inf", 0)
 		else:
-			# The summary already exists and does not include the current bucket
-			return True
+			tokens_between = self._generate_bucket_tokens_between(start_token, end_token)
+			pipe.zunionstore(summary_key, [self._bucket_key(s, e) for s, e in tokens_between])
+		pipe.expire(summary_key, self.ttl)
+		pipe.execute()
+
+		return summary_key
 
 	def _generate_bucket_tokens_between(self, start_token, end_token):
 		result = []
@@ -205,6 +434,14 @@ class RedisPopularityDistribution:
 	def _current_start_token(self):
 		return self._to_start_token(datetime.utcnow())
 
+	@property
+	def _settled_start_token(self):
+		"""
+		The start token of the earliest bucket which may still receive observations: the
+		one which just closed, since observations are recorded shortly after the fact.
+		"""
+		return self._current_start_token - self.bucket_size
+
 	@property
 	def earliest_available_datetime(self):
 		return datetime.utcnow() - timedelta(seconds=self.ttl)
@@ -219,53 +456,97 @@ class RedisIntegerMapStorage:
 	# This native Lua implementation can brute force search: ~ 25 keys / ms
 	# In order to always return within 100ms we should never search more than 2,000 keys
 	MATCH_SCRIPT = """
-		-- Return the first deck_id in KEYS that is a superset of ARGV
-		-- Return -1 if nothing matches
+		-- Return the deck_ids in KEYS that are a superset of ARGV
+
+		local namespace = table.remove(ARGV, 1)
+		local fields = {}
+		local counts = {}
+
+		for i = 1, #ARGV, 2 do
+			fields[#fields+1] = ARGV[i]
+			counts[#counts+1] = tonumber(ARGV[i + 1])
+		end
 
-		local get_default = function (tab, element, default)
+		local is_superset = function (key)
+			if #fields == 0 then
+				return true
+			end
 
-			for k, v in pairs(tab) do
-				if k == element then
-					return v
+			local values = redis.call('HMGET', namespace .. ":" .. key, unpack(fields))
+			for i, count in ipairs(counts) do
+				if count > (tonumber(values[i]) or 0) then
+					return false
 				end
 			end
 
-			return default
+			return true
 		end
 
-		local to_map = function (members)
-			local result = {}
-			local nextkey
+		local final_result = {}
 
-			for i, v in ipairs(members) do
-				if i % 2 == 1 then
-					nextkey = tostring(v)
-				else
-					result[nextkey] = tonumber(v)
-				end
+		for i, key in ipairs(KEYS) do
+			if is_superset(key) then
+				final_result[#final_result+1]=key
 			end
-
-			return result
 		end
 
+		return final_result
+	"""
+
+	RANKED_MATCH_SCRIPT = """
+		-- Walk the sorted set in KEYS[1] from the highest score down and return the
+		-- highest ranked members that are a superset of ARGV, as member / score pairs.
+		-- Several members are only returned if they are tied for the highest score.
+
 		local namespace = table.remove(ARGV, 1)
-		local partial = to_map(ARGV)
+		local limit = tonumber(table.remove(ARGV, 1))
+		local page_size = 100
+		local fields = {}
+		local counts = {}
+
+		for i = 1, #ARGV, 2 do
+			fields[#fields+1] = ARGV[i]
+			counts[#counts+1] = tonumber(ARGV[i + 1])
+		end
+
+		local is_superset = function (key)
+			if #fields == 0 then
+				return true
+			end
+
+			local values = redis.call('HMGET', namespace .. ":" .. key, unpack(fields))
+			for i, count in ipairs(counts) do
+				if count > (tonumber(values[i]) or 0) then
+					return false
+				end
+			end
+
+			return true
+		end
 
 		local final_result = {}
+		local best_score
 
-		for i, key in ipairs(KEYS) do
-			local candidate_key = namespace .. ":" .. key
-			local candidate = to_map(redis.call('HGETALL', candidate_key))
-			local match = true
+		for offset = 0, limit - 1, page_size do
+			local stop = math.min(offset + page_size, limit) - 1
+			local page = redis.call('ZREVRANGE', KEYS[1], offset, stop, 'WITHSCORES')
+
+			for i = 1, #page, 2 do
+				local score = tonumber(page[i + 1])
+				if best_score and score < best_score then
+					-- Nothing further down can tie with the best match
+					return final_result
+				end
 
-			for k, v in pairs(partial) do
-				if v > get_default(candidate, k, 0) then
-					match = false
+				if is_superset(page[i]) then
+					best_score = score
+					final_result[#final_result+1] = page[i]
+					final_result[#final_result+1] = page[i + 1]
 				end
 			end
 
-			if match == true then
-				final_result[#final_result+1]=key
+			if #page < 2 * page_size then
+				break
 			end
 		end
 
@@ -279,14 +560,29 @@ class RedisIntegerMapStorage:
 		self.max_match_size = max_match_size
 		self.use_lua = isinstance(self.redis_primary, StrictRedis)
 		if self.use_lua:
-			self.lua_match = self.redis_replica.register_script(self.MATCH_SCRIPT)
+			self.lua_match = register_script(self.redis_replica, self.MATCH_SCRIPT)
+			self.lua_ranked_match = register_script(self.redis_primary, self.RANKED_MATCH_SCRIPT)
 
 	def namespaced_key(self, key):
 		return "%s:%s" % (self.namespace, key)
 
-	def store(self, key, val):
-		self.redis_primary.hmset(self.namespaced_key(key), val)
-		self.redis_primary.expire(self.namespaced_key(key), self.ttl)
+	def store(self, key, val, pipeline=None):
+		self.store_many([(key, val)], pipeline=pipeline)
+
+	def store_many(self, items, pipeline=None):
+		"""
+		Store a batch of (key, val) maps in a single pipeline.
+
+		If a pipeline is passed, the writes are only queued on it.
+		"""
+		pipe = pipeline if pipeline is not None else self.redis_primary.pipeline(
+			transaction=False
+		)
+		for key, val in items:
+			pipe.hmset(self.namespaced_key(key), val)
+			pipe.expire(self.namespaced_key(key), self.ttl)
+		if pipeline is None:
+			pipe.execute()
 
 	def retrieve(self, key):
 		data = self.redis_replica.hgetall(self.namespaced_key(key))
@@ -313,6 +609,37 @@ class RedisIntegerMapStorage:
 					final_result.append(str(key))
 			return final_result
 
+	def ranked_match(self, subset, ranking_key, limit=None):
+		"""
+		Return the most popular members of the ranking_key sorted set that contain the
+		subset argument, as a list of (key, popularity) tuples.
+
+		The list is empty if nothing matches and only holds more than one item if several
+		matches are tied for popularity. The ranking is expected to live on the primary
+		(e.g. a RedisPopularityDistribution summary), so the search runs there.
+		"""
+		limit = min(limit or self.max_match_size, self.max_match_size)
+
+		if self.use_lua:
+			full_args = [self.namespace, limit]
+			full_args.extend(chain.from_iterable(subset.items()))
+			result = self.lua_ranked_match(keys=[ranking_key], args=full_args)
+			return [
+				(key.decode("utf8"), int(float(score)))
+				for key, score in zip(result[::2], result[1::2])
+			]
+		else:
+			final_result = []
+			candidates = self.redis_primary.zrevrange(ranking_key, 0, limit - 1, withscores=True)
+			for key, score in candidates:
+				if final_result and score < final_result[0][1]:
+					break
+				key = key.decode("utf8")
+				candidate = self.retrieve(key)
+				if all(v <= candidate.get(k, 0) for k, v in subset.items()):
+					final_result.append((key, int(score)))
+			return final_result
+
 
 class RedisTreeNode:
 	"""A Key:Value store that represents a node in a tree."""
@@ -345,42 +672,32 @@ class RedisTreeNode:
 
 	def children(self):
 		for member in self.redis.smembers(self.children_key):
-			yield RedisTreeNode(
-				self.redis,
-				self.tree,
-				self,
-				member.decode("utf8"),
-				self.depth + 1,
-				self.namespace,
-				self.ttl
-			)
+			yield self._make_child(member.decode("utf8"))
 
 	def get_child(self, label, create=False):
-		if self.redis.sismember(self.children_key, label):
-			return RedisTreeNode(
-				self.redis,
-				self.tree,
-				self,
-				label,
-				self.depth + 1,
-				self.namespace,
-				self.ttl
-			)
-		elif create:
-			self.redis.sadd(self.children_key, label)
-			self.redis.expire(self.children_key, self.ttl)
-			return RedisTreeNode(
-				self.redis,
-				self.tree,
-				self,
-				label,
-				self.depth + 1,
-				self.namespace,
-				self.ttl
-			)
+		if create:
+			return self.add_child(label)
+		elif self.redis.sismember(self.children_key, label):
+			return self._make_child(label)
 		else:
 			return None
 
+	def add_child(self, label, pipeline=None):
+		"""
+		Add (or refresh) the child with the given label and return it.
+
+		If a pipeline is passed, the writes are only queued on it.
+		"""
+		pipe = pipeline if pipeline is not None else self.redis.pipeline(transaction=False)
+		pipe.sadd(self.children_key, label)
+		pipe.expire(self.children_key, self.ttl)
+		if pipeline is None:
+			pipe.execute()
+		return self._make_child(label)
+
+	def _make_child(self, label):
+		return self.tree.get_node(self, label)
+
 	def get(self, key):
 		return self.redis.hget(self.key, key).decode("utf8")
 
@@ -390,12 +707,38 @@ class RedisTreeNode:
 
 
 class RedisTree:
-	def __init__(self, redis, name, namespace="TREE", ttl=DEFAULT_TTL):
+	RESOLVE_PATH_SCRIPT = """
+		-- Walk down the tree from the node whose key is ARGV[1], following each of the
+		-- labels in ARGV[2..n] that is a child of the current node and skipping the others.
+		-- Return a flag per label: 1 if it was followed, 0 if it was skipped.
+
+		local node_key = ARGV[1]
+		local followed = {}
+
+		for i = 2, #ARGV do
+			if redis.call('SISMEMBER', node_key .. ':CHILDREN', ARGV[i]) == 1 then
+				node_key = node_key .. '->' .. ARGV[i]
+				followed[#followed+1] = 1
+			else
+				followed[#followed+1] = 0
+			end
+		end
+
+		return followed
+	"""
+
+	def __init__(
+		self, redis, name, namespace="TREE", ttl=DEFAULT_TTL, max_cached_nodes=100000
+	):
 		self.redis = redis
 		self.name = name
 		self.namespace = namespace
 		self.ttl = ttl
 		self.key = "%s:%s" % (self.namespace, self.name)
+		self.max_cached_nodes = max_cached_nodes
+		self.use_lua = isinstance(redis, StrictRedis)
+		self._nodes = OrderedDict()
+		self._nodes_lock = threading.Lock()
 		self.root = RedisTreeNode(redis, self, None, "ROOT", 0, ttl=self.ttl)
 
 	def __str__(self):
@@ -404,6 +747,55 @@ class RedisTree:
 	def __repr__(self):
 		return self.key
 
+	def get_node(self, parent, label):
+		"""
+		Return the handle of the child of parent with the given label.
+
+		Handles are kept in a bounded LRU cache, so walking the same paths over and over
+		does not create new node objects every time.
+		"""
+		key = (parent.fully_qualified_label, str(label))
+		with self._nodes_lock:
+			node = self._nodes.get(key)
+			if node is None:
+				node = RedisTreeNode(
+					self.redis, self, parent, label, parent.depth + 1, parent.namespace, self.ttl
+				)
+				self._nodes[key] = node
+				while len(self._nodes) > self.max_cached_nodes:
+					self._nodes.popitem(last=False)
+			else:
+				self._nodes.move_to_end(key)
+			return node
+
+	def resolve_path(self, labels, node=None):
+		"""
+		Walk down from node (the root by default), following each of the labels that is a
+		child of the current node and skipping the others.
+
+		Return the node each label was looked up from, followed by the node the walk ended
+		on. With Lua, the whole walk takes a single round trip.
+		"""
+		node = node or self.root
+		labels = list(labels)
+
+		if self.use_lua and labels:
+			script = register_script(self.redis, self.RESOLVE_PATH_SCRIPT)
+			followed = script(args=[node.key] + labels)
+		else:
+			followed = None
+
+		path = []
+		for i, label in enumerate(labels):
+			path.append(node)
+			if followed is not None:
+				if followed[i]:
+					node = self.get_node(node, label)
+			else:
+				node = node.get_child(label, create=False) or node
+		path.append(node)
+		return path
+
 
 class CappedDataFeed(RedisNamespace):
 	def __init__(self, redis, name, max_items, period, comparator, fast_backfill=False):
@@ -528,15 +920,12 @@ class RedisCounter(RedisBucket):
 	def __init__(self, redis, name, bucket_size, ttl):
 		super().__init__(redis, name, "COUNTER", bucket_size, ttl)
 
-	def increment(self):
+	def increment(self, amount=1):
 		key = self._bucket_key(0)
-
-		def internal_increment(pipe):
-			value = pipe.get(key) or 0
-			pipe.multi()
-			pipe.set(key, int(value) + 1)
-			pipe.expire(key, self.ttl)
-		self.redis.transaction(internal_increment, key)
+		pipe = self.redis.pipeline()
+		pipe.incrby(key, amount)
+		pipe.expire(key, self.ttl)
+		return pipe.execute()[0]
 
 	def get_count(self, start_bucket, end_bucket):
 		pipe = self.redis.pipeline()
@@ -549,31 +938,64 @@ class RedisCounter(RedisBucket):
 
 
 class RedisSet(RedisBucket):
-	def __init__(self, redis, name, bucket_size, ttl):
-		super().__init__(redis, name, "SET", bucket_size, ttl)
+	"""
+	A set of unique values per bucket.
+
+	If hyperloglog is True, the buckets are HyperLogLogs rather than sets: the values
+	themselves are not stored and get_count() returns an estimate (with a standard error
+	of 0.81%), but every bucket takes at most 12kB and counting across buckets does not
+	depend on how many values there are.
+	"""
+
+	def __init__(self, redis, name, bucket_size, ttl, hyperloglog=False):
+		namespace = "HLL" if hyperloglog else "SET"
+		super().__init__(redis, name, namespace, bucket_size, ttl)
+		self.hyperloglog = hyperloglog
 
 	def add(self, value):
 		key = self._bucket_key(0)
 		pipe = self.redis.pipeline()
-		pipe.multi()
-		pipe.sadd(key, value)
+		if self.hyperloglog:
+			pipe.pfadd(key, value)
+		else:
+			pipe.sadd(key, value)
 		pipe.expire(key, self.ttl)
 		pipe.execute()
 
 	def get_count(self, start_bucket, end_bucket):
 		if start_bucket == end_bucket:
 			key = self._bucket_key(start_bucket)
-			return self.redis.scard(key)
+			return self.redis.pfcount(key) if self.hyperloglog else self.redis.scard(key)
 
 		keys = [self._bucket_key(bucket) for bucket in range(start_bucket, end_bucket + 1)]
+
+		if self.hyperloglog:
+			if start_bucket == 0:
+				# PFCOUNT merges the HyperLogLogs on the fly
+				return self.redis.pfcount(*keys)
+
+			# Past buckets no longer change, so keep the merged HyperLogLog around
+			temp_key = "%s:MERGED" % self._bucket_key(start_bucket, end_bucket - start_bucket + 1)
+			pipe = self.redis.pipeline()
+			pipe.exists(temp_key)
+			pipe.pfcount(temp_key)
+			exists, count = pipe.execute()
+			if exists:
+				return count
+
+			pipe = self.redis.pipeline()
+			pipe.pfmerge(temp_key, *keys)
+			pipe.expire(temp_key, self.ttl)
+			pipe.pfcount(temp_key)
+			return pipe.execute()[-1]
+
 		temp_key = "%s:TEMP" % self._bucket_key(start_bucket, end_bucket - start_bucket + 1)
 
 		if start_bucket == 0:
-			def internal_get(pipe):
-				pipe.multi()
-				pipe.sunionstore(temp_key, keys)
-				pipe.delete(temp_key)
-			return self.redis.transaction(internal_get, temp_key)[0]
+			pipe = self.redis.pipeline()
+			pipe.sunionstore(temp_key, keys)
+			pipe.delete(temp_key)
+			return pipe.execute()[0]
 		elif self.redis.exists(temp_key):
 			return self.redis.scard(temp_key)
 		else:
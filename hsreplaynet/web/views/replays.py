@@ -98,7 +98,7 @@ class ReplayDetailView(View):
 			"opponent_name": self.replay.opposing_player.name,
 			"own_turns": self.replay.global_game.num_own_turns,
 			"player_name": self.replay.friendly_player.name,
-			"replay_url": self.replay.replay_xml.url,
+			"replay_url": self.replay.replay_xml_url,
 			"shortid": self.replay.shortid,
 			"views": self.replay.views,
 			"visibility": self.replay.visibility.value,
@@ -124,14 +124,41 @@ class ReplayEmbedView(View):
 		return render(request, self.template_name, {"replay": replay})
 
 
+def get_replay_with_xml(shortid):
+	"""
+	Return the replay with the given shortid once its hsreplay.xml exists, or None while
+	it is being rendered (see REPLAY_XML_LAZY_GENERATION).
+	"""
+	from hsreplaynet.games.processing import request_replay_xml
+
+	replay = GameReplay.objects.find_by_short_id(shortid)
+	if not replay or replay.is_deleted:
+		raise Http404("Replay not found.")
+
+	status = request_replay_xml(replay)
+	if status is None:
+		return None
+	elif not status:
+		raise Http404("Replay not found.")
+
+	return replay
+
+
+def replay_xml_pending_response():
+	response = HttpResponse("The replay is being prepared.", status=202)
+	response["Content-Type"] = "text/plain"
+	response["Retry-After"] = "2"
+	return response
+
+
 class AnnotatedReplayView(View):
 	def get(self, request, shortid):
 		from hsreplay.utils import annotate_replay
 		from io import BytesIO
 
-		replay = GameReplay.objects.find_by_short_id(shortid)
-		if not replay or replay.is_deleted:
-			raise Http404("Replay not found.")
+		replay = get_replay_with_xml(shortid)
+		if replay is None:
+			return replay_xml_pending_response()
 
 		replay_xml = replay.replay_xml.open()
 		annotated_replay = BytesIO()
@@ -142,6 +169,15 @@ class AnnotatedReplayView(View):
 		return response
 
 
+class ReplayXMLView(View):
+	def get(self, request, shortid):
+		replay = get_replay_with_xml(shortid)
+		if replay is None:
+			return replay_xml_pending_response()
+
+		return HttpResponseRedirect(replay.replay_xml.url)
+
+
 class UploadDetailView(SimpleReactView):
 	bundle = "upload_processing"
 	title = _("Uploading replay…")
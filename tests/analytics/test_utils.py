@@ -0,0 +1,81 @@
+import json
+from unittest.mock import Mock
+
+from hsreplaynet.analytics.utils import fetch_query_results_in_bulk, trigger_many_if_stale
+
+
+def _parameterized_query(payload):
+	return Mock(
+		result_available=payload is not None,
+		response_payload=payload,
+		response_payload_data=payload and json.dumps(payload),
+	)
+
+
+def test_fetch_query_results_in_bulk():
+	queries = [_parameterized_query({"n": n} if n % 3 else None) for n in range(10)]
+
+	results = fetch_query_results_in_bulk(queries, trigger=False)
+
+	assert [r.parameterized_query for r in results] == queries
+	for n, result in enumerate(results):
+		if n % 3:
+			assert result.available
+			assert result.payload == {"n": n}
+		else:
+			assert not result.available
+			assert result.payload is None
+
+
+def test_fetch_query_results_in_bulk_empty():
+	assert fetch_query_results_in_bulk([]) == []
+
+
+def test_fetch_query_results_in_bulk_triggers_stale_queries(mocker):
+	trigger_if_stale = mocker.patch(
+		"hsreplaynet.analytics.utils.trigger_if_stale",
+		side_effect=lambda pq, run_local, priority: pq.response_payload["n"] == 1
+	)
+	queries = [_parameterized_query({"n": n}) for n in range(3)]
+
+	results = fetch_query_results_in_bulk(queries, raw=True)
+
+	assert trigger_if_stale.call_count == 3
+	assert [r.triggered_refresh for r in results] == [False, True, False]
+	assert [r.payload for r in results] == ['{"n": 0}', '{"n": 1}', '{"n": 2}']
+
+
+def test_fetch_query_results_in_bulk_run_local_reads_after_refresh(mocker):
+	query = _parameterized_query({"n": 1})
+
+	def refresh(pq, run_local, priority):
+		assert run_local
+		pq.response_payload = {"n": 2}
+		return True
+
+	mocker.patch("hsreplaynet.analytics.utils.trigger_if_stale", side_effect=refresh)
+	get_executor = mocker.patch("hsreplaynet.analytics.utils._get_executor")
+
+	result, = fetch_query_results_in_bulk([query], run_local=True)
+	assert result.triggered_refresh
+	assert result.payload == {"n": 2}
+	assert not get_executor.called
+
+
+def test_fetch_query_results_in_bulk_ignores_trigger_errors(mocker):
+	mocker.patch(
+		"hsreplaynet.analytics.utils.trigger_if_stale", side_effect=OSError("Nope")
+	)
+
+	result, = fetch_query_results_in_bulk([_parameterized_query({"n": 1})])
+	assert result.available
+	assert not result.triggered_refresh
+
+
+def test_trigger_many_if_stale(mocker):
+	mocker.patch(
+		"hsreplaynet.analytics.utils.trigger_if_stale", side_effect=[True, False, True]
+	)
+
+	assert trigger_many_if_stale([Mock(), Mock(), Mock()]) == 2
+	assert trigger_many_if_stale([]) == 0
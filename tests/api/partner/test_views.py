@@ -131,7 +131,7 @@ class TestClassesView:
 			lambda name: Mock(**attrs)
 		)
 
-		trigger_if_stale = mocker.patch("hsreplaynet.api.partner.views.trigger_if_stale")
+		trigger_if_stale = mocker.patch("hsreplaynet.analytics.utils.trigger_if_stale")
 
 		response = client.get(
 			"/api/v1/partner-stats/classes/",
@@ -196,7 +196,7 @@ class TestClassesView:
 			lambda name: Mock(**attrs)
 		)
 
-		trigger_if_stale = mocker.patch("hsreplaynet.api.partner.views.trigger_if_stale")
+		trigger_if_stale = mocker.patch("hsreplaynet.analytics.utils.trigger_if_stale")
 
 		response = client.get(
 			"/api/v1/partner-stats/classes/",
@@ -5,6 +5,7 @@ from tests.games.test_processing import (  # noqa: F401
 )
 from tests.utils import create_deck_from_deckstring, create_player, create_replay
 
+from hsreplaynet.api.views.vods import ARCHETYPE_VOD_INDEX_CACHE, ARCHETYPE_VOD_LIST_CACHE
 from hsreplaynet.games.processing import record_twitch_vod
 
 from .fixtures import (
@@ -12,6 +13,12 @@ from .fixtures import (
 )
 
 
+@pytest.fixture(autouse=True)
+def clear_vod_caches():
+	ARCHETYPE_VOD_LIST_CACHE.clear()
+	ARCHETYPE_VOD_INDEX_CACHE.clear()
+
+
 @pytest.mark.django_db  # noqa: F811
 def test_vod_list_view_no_identifier(client, mocker):
 	mocker.patch.multiple(
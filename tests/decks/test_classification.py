@@ -0,0 +1,57 @@
+from unittest.mock import patch
+
+import pytest
+
+from hsreplaynet.decks.classification import ArchetypeClassifier
+
+
+SIGNATURE_WEIGHTS = {
+	101: {
+		"signature_weights": {1: 0.9, 2: 0.8, 3: 0.1},
+		"required_cards": [],
+		"rules": [],
+	},
+	102: {
+		"signature_weights": {3: 0.9, 4: 0.9, 5: 0.5},
+		"required_cards": [6],
+		"rules": [],
+	},
+	103: {
+		"signature_weights": {1: 1.0, 2: 1.0, 7: 1.0},
+		"required_cards": [],
+		"rules": ["SOME_RULE"],
+	},
+}
+
+
+@pytest.fixture
+def classifier():
+	return ArchetypeClassifier(SIGNATURE_WEIGHTS, batch_size=2)
+
+
+def test_classify_many(classifier):
+	with patch("hsreplaynet.decks.classification.classify_deck", return_value=None):
+		assert classifier.classify_many([
+			{1: 2, 2: 1},
+			{3: 2, 4: 2, 5: 1},
+			{3: 2, 4: 2, 5: 1, 6: 1},
+			{8: 2},
+			{},
+		]) == [101, 101, 102, None, None]
+
+
+def test_classify_rules(classifier):
+	with patch("hsreplaynet.decks.classification.classify_deck") as classify_deck:
+		classify_deck.return_value = 103
+		assert classifier.classify({1: 2, 2: 2, 7: 1}) == 103
+		classify_deck.assert_called_once_with({1: 2, 2: 2, 7: 1}, {103: SIGNATURE_WEIGHTS[103]})
+
+		# The deck fails the rules of the best candidate: fall back to the next one
+		classify_deck.return_value = None
+		assert classifier.classify({1: 2, 2: 2, 7: 1}) == 101
+
+
+def test_classify_no_signatures():
+	classifier = ArchetypeClassifier({})
+	assert not len(classifier)
+	assert classifier.classify_many([{1: 2}]) == [None]
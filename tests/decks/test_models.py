@@ -8,6 +8,8 @@ from tests.utils import create_deck_from_deckstring
 from hsreplaynet.decks.models import (
 	Archetype, ClassClusterSnapshot, ClusterManager, ClusterSetSnapshot, ClusterSnapshot
 )
+from hsreplaynet.decks.signatures import live_signature_weights
+from hsreplaynet.utils.cards import CardIndex
 
 
 MECHATHUN_DRUID = {
@@ -27,6 +29,10 @@ MECHATHUN_DRUID = {
 
 class TestClusterManager:
 
+	@pytest.fixture(autouse=True)
+	def invalidate_signature_weights(self):
+		live_signature_weights.invalidate()
+
 	@pytest.mark.django_db()
 	def test_get_signature_weights(self):
 		self.cluster_set = ClusterSetSnapshot(
@@ -106,8 +112,10 @@ class TestClusterSetSnapshot:
 class TestDeck:
 
 	@pytest.mark.django_db
-	@patch("hsreplaynet.decks.models.ClusterSnapshot")
-	def test_classify_into_archetype(self, _):
+	@patch("hsreplaynet.decks.classification.archetype_classifier")
+	def test_classify_into_archetype(self, archetype_classifier, settings):
+		settings.ARCHETYPE_CLASSIFICATION_FAILURE_SAMPLE_RATE = 1
+		archetype_classifier.return_value.classify.return_value = None
 		deck = create_deck_from_deckstring(
 			"AAECAZICApnTAvH7Ag5AX+kB/gHTA8QGpAf2B+QIktICmNICntICv/ICj/YCAA=="
 		)
@@ -129,16 +137,45 @@ class TestDeck:
 				mock_influx_client.assert_has_calls([
 					call(
 						"archetype_classification_blocked",
-						{"count": 2},
+						{"count": 2, "sample_rate": 1},
 						reason="bad_deck"
 					),
 					call(
 						"archetype_classification_blocked",
-						{"count": 1},
+						{"count": 1, "sample_rate": 1},
 						reason="too_many_firebats"
 					)
 				])
 
+	@pytest.mark.django_db
+	@patch("hsreplaynet.decks.classification.archetype_classifier")
+	def test_classify_into_archetype_samples_failures(self, archetype_classifier, settings):
+		settings.ARCHETYPE_CLASSIFICATION_FAILURE_SAMPLE_RATE = 0
+		archetype_classifier.return_value.classify.return_value = None
+		deck = create_deck_from_deckstring(
+			"AAECAZICApnTAvH7Ag5AX+kB/gHTA8QGpAf2B+QIktICmNICntICv/ICj/YCAA=="
+		)
+
+		with patch("hsreplaynet.decks.models.classify_deck") as classify_deck:
+			assert deck.classify_into_archetype(CardClass.DRUID, save=False) is None
+
+		assert classify_deck.call_count == 0
+
+	@pytest.mark.django_db
+	@patch("hsreplaynet.decks.classification.archetype_classifier")
+	def test_classify_into_archetype_uses_cached_classifier(self, archetype_classifier):
+		archetype_classifier.return_value.classify.return_value = 123
+		deck = create_deck_from_deckstring(
+			"AAECAZICApnTAvH7Ag5AX+kB/gHTA8QGpAf2B+QIktICmNICntICv/ICj/YCAA=="
+		)
+
+		with patch("hsreplaynet.decks.models.classify_deck") as classify_deck:
+			assert deck.classify_into_archetype(CardClass.DRUID, save=False) == 123
+
+		archetype_classifier.assert_called_once_with(deck.format, CardClass.DRUID)
+		archetype_classifier.return_value.classify.assert_called_once_with(deck.dbf_map())
+		assert classify_deck.call_count == 0
+
 	@pytest.mark.django_db
 	def test_card_lists(self):
 		deck = create_deck_from_deckstring(
@@ -209,6 +246,22 @@ class TestDeck:
 			205,
 		]
 
+	@pytest.mark.django_db
+	def test_card_lists_with_stale_card_index(self):
+		deck = create_deck_from_deckstring(
+			"AAECAZICAA9AzQHVAYECnALwA4sEiAXmBYUGtwbQB5oI2Qr5CgA="
+		)
+		card_id_list = deck.card_id_list()
+		card_dbf_id_list = deck.card_dbf_id_list()
+		dbf_map = deck.dbf_map()
+
+		# Cards missing from the index (even after a version check) are read from the db
+		with patch("hsreplaynet.utils.cards.card_index", return_value=CardIndex([])):
+			assert deck.card_id_list() == card_id_list
+			assert deck.card_dbf_id_list() == card_dbf_id_list
+			assert deck.dbf_map() == dbf_map
+			assert len(deck.as_dbf_json(serialized=False)) == len(dbf_map)
+
 	@pytest.mark.django_db
 	def test_len(self):
 		deck = create_deck_from_deckstring(
@@ -0,0 +1,76 @@
+import fakeredis
+import pytest
+from hearthstone.enums import CardClass, FormatType
+
+from hsreplaynet.decks import signatures
+from hsreplaynet.decks.signatures import SignatureWeightsCache
+
+
+@pytest.fixture
+def redis():
+	r = fakeredis.FakeStrictRedis()
+	yield r
+	r.flushall()
+
+
+@pytest.fixture
+def loaders(mocker):
+	live_cluster_set_id = mocker.patch(
+		"hsreplaynet.decks.signatures._get_live_cluster_set_id", return_value=1
+	)
+	signature_weights = mocker.patch(
+		"hsreplaynet.decks.signatures._get_signature_weights",
+		side_effect=lambda game_format, player_class: {player_class: {"rules": []}}
+	)
+	return live_cluster_set_id, signature_weights
+
+
+def test_signature_weights_cache(redis, loaders):
+	live_cluster_set_id, signature_weights = loaders
+	cache = SignatureWeightsCache(lambda: redis)
+
+	weights = cache.get(FormatType.FT_STANDARD, CardClass.DRUID)
+	assert weights == {CardClass.DRUID: {"rules": []}}
+	assert cache.get(FormatType.FT_STANDARD, CardClass.DRUID) is weights
+	assert cache.get_version(FormatType.FT_STANDARD) == (0, 1)
+	assert live_cluster_set_id.call_count == 1
+	assert signature_weights.call_count == 1
+
+	# Another process finds the weights in Redis
+	other_cache = SignatureWeightsCache(lambda: redis)
+	assert other_cache.get(FormatType.FT_STANDARD, CardClass.DRUID) == weights
+	assert live_cluster_set_id.call_count == 1
+	assert signature_weights.call_count == 1
+
+
+def test_signature_weights_cache_invalidate(redis, loaders):
+	live_cluster_set_id, signature_weights = loaders
+	cache = SignatureWeightsCache(lambda: redis)
+	other_cache = SignatureWeightsCache(lambda: redis, generation_check_interval=0)
+	cache.get(FormatType.FT_STANDARD, CardClass.DRUID)
+	other_cache.get(FormatType.FT_STANDARD, CardClass.DRUID)
+
+	live_cluster_set_id.return_value = 2
+	cache.invalidate()
+
+	assert cache.get_version(FormatType.FT_STANDARD) == (1, 2)
+	cache.get(FormatType.FT_STANDARD, CardClass.DRUID)
+	assert signature_weights.call_count == 2
+
+	# Other processes notice the new generation when they next check for one
+	assert other_cache.get_version(FormatType.FT_STANDARD) == (1, 2)
+	other_cache.get(FormatType.FT_STANDARD, CardClass.DRUID)
+	assert signature_weights.call_count == 2
+
+
+def test_warm_signature_weights_once(mocker, settings):
+	settings.SIGNATURE_WEIGHTS_WARM_ON_STARTUP = True
+	mocker.patch.object(signatures, "_signature_weights_warmed", False)
+	warm = mocker.patch.object(signatures.live_signature_weights, "warm")
+	close_all = mocker.patch("hsreplaynet.decks.signatures.connections.close_all")
+
+	signatures.warm_signature_weights()
+	signatures.warm_signature_weights()
+
+	assert warm.call_count == 1
+	assert close_all.call_count == 1
@@ -1,3 +1,4 @@
+import threading
 from datetime import datetime
 from unittest.mock import ANY, Mock, patch
 
@@ -21,7 +22,8 @@ from hearthsim.identity.accounts.models import User
 from hsreplaynet.decks.models import Archetype, Deck, update_deck_archetype
 from hsreplaynet.games.models import GameReplay, GlobalGame
 from hsreplaynet.games.processing import (
-	eligible_for_unification, has_twitch_vod_url, is_partial_game, record_twitch_vod,
+	ReplaySideEffects, eligible_for_unification, has_twitch_vod_url,
+	is_partial_game, record_twitch_vod, request_replay_xml, run_replay_side_effects,
 	should_load_into_redshift, update_last_replay_upload, update_replay_feed
 )
 from hsreplaynet.uploads.models import UploadEvent
@@ -435,3 +437,61 @@ def test_should_load_into_redshift_false(auth_token):
 
 	mock_exporter.configure_mock(is_valid_final_state=False)
 	assert not should_load_into_redshift(upload_event, {}, global_game, mock_exporter)
+
+
+def test_replay_side_effects(mocker):
+	mock_influx_metric = mocker.patch("hsreplaynet.games.processing.influx_metric")
+	mock_error_handler = mocker.patch("hsreplaynet.games.processing.error_handler")
+	release = threading.Event()
+	sink = Mock()
+
+	def failing_sink():
+		raise ValueError("Oops")
+
+	side_effects = ReplaySideEffects(Mock())
+	side_effects.run("ok", sink, 1, 2)
+	side_effects.run("failing", failing_sink)
+	side_effects.run("slow", release.wait, timeout=0.1)
+	side_effects.wait()
+	release.set()
+
+	sink.assert_called_once_with(1, 2)
+	assert mock_error_handler.call_count == 1
+	mock_influx_metric.assert_called_once_with(
+		"replay_side_effect_timeout", {"count": 1}, sink="slow"
+	)
+
+
+def test_run_replay_side_effects_skips_on_prefetch_error(mocker):
+	mocker.patch(
+		"hsreplaynet.games.processing.get_side_effect_replay",
+		side_effect=GameReplay.DoesNotExist
+	)
+	mock_error_handler = mocker.patch("hsreplaynet.games.processing.error_handler")
+	mock_run = mocker.patch.object(ReplaySideEffects, "run")
+
+	side_effects = run_replay_side_effects(Mock(), {})
+	side_effects.wait()
+
+	assert mock_error_handler.call_count == 1
+	assert not mock_run.called
+
+
+def test_request_replay_xml_schedules_render(mocker, settings):
+	settings.REPLAY_XML_RENDER_USE_LAMBDA = True
+	mock_lambda = mocker.patch("hsreplaynet.utils.aws.clients.LAMBDA")
+	mock_caches = mocker.patch("django.core.cache.caches")
+	mock_caches.__getitem__.return_value.add.side_effect = [True, False]
+	replay = Mock(shortid="abc", hsreplay_version="")
+
+	# The render is scheduled once, and the caller told to come back later
+	assert request_replay_xml(replay) is None
+	assert request_replay_xml(replay) is None
+	mock_lambda.invoke.assert_called_once_with(
+		FunctionName="RenderReplayXML",
+		InvocationType="Event",
+		Payload='{"shortid": "abc"}',
+	)
+
+	replay.hsreplay_version = "1.0"
+	assert request_replay_xml(replay) is True
@@ -9,6 +9,7 @@ DEBUG = True
 
 DEFAULT_FILE_STORAGE = "django.core.files.storage.FileSystemStorage"
 INFLUX_ENABLED = False
+SIGNATURE_WEIGHTS_WARM_ON_STARTUP = False
 
 STRIPE_TEST_PUBLIC_KEY = "pk_test_foo"
 STRIPE_TEST_SECRET_KEY = "sk_test_foo"
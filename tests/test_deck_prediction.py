@@ -1,11 +1,15 @@
+import threading
 from datetime import datetime
-from unittest.mock import patch
+from unittest.mock import Mock, patch
 
 import fakeredis
 import pytest
 from hearthstone.enums import CardClass, FormatType
 
-from hsreplaynet.utils.prediction import DeckPredictionTree, RedisInverseLookupTable
+from hsreplaynet.utils import prediction
+from hsreplaynet.utils.prediction import (
+	DeckPredictionTree, InMemoryInverseLookupTable, RedisInverseLookupTable
+)
 
 
 DOOMSAYER = 138
@@ -89,6 +93,58 @@ def test_prediction_tree(_mock_lock):
 	assert lookup_result_5 is None
 
 
+def test_prediction_tree_observe_many(redis):
+	tree = DeckPredictionTree(
+		CardClass.MAGE,
+		FormatType.FT_STANDARD,
+		redis, redis,
+		max_depth=6,
+		include_current_bucket=True
+	)
+	tree.observe_many([
+		(1, to_dbf_map(DECK_1), PLAY_SEQUENCES[1]),
+		(2, to_dbf_map(DECK_2), PLAY_SEQUENCES[2]),
+		(2, to_dbf_map(DECK_2), PLAY_SEQUENCES[2]),
+	])
+
+	lookup_result_1 = tree.lookup(
+		to_dbf_map(PLAY_SEQUENCES[1][:-1]),
+		PLAY_SEQUENCES[1][:-1]
+	)
+	assert lookup_result_1.predicted_deck_id == 1
+
+	# Both decks share the first two plays, but deck 2 was observed twice
+	lookup_result_2 = tree.lookup(
+		to_dbf_map(PLAY_SEQUENCES[1][:2]),
+		PLAY_SEQUENCES[1][:2]
+	)
+	assert lookup_result_2.predicted_deck_id == 2
+	assert lookup_result_2.popularity == 2
+
+
+def test_prediction_tree_lookup_reuses_nodes(redis):
+	tree = DeckPredictionTree(
+		CardClass.MAGE,
+		FormatType.FT_STANDARD,
+		redis, redis,
+		max_depth=6,
+		include_current_bucket=True
+	)
+	tree.observe(1, to_dbf_map(DECK_1), PLAY_SEQUENCES[1])
+
+	# Unknown cards are skipped, rather than ending the walk down the tree
+	sequence = [BLIZZARD] + PLAY_SEQUENCES[1][:2] + [BLIZZARD]
+	result = tree.lookup(to_dbf_map(PLAY_SEQUENCES[1][:2]), sequence)
+	assert result.predicted_deck_id == 1
+	assert result.path() == ["ROOT"] + PLAY_SEQUENCES[1][:2]
+	assert result.match_attempts == 1
+	assert set(result.timings) == {"resolve_path", "summary_keys", "ranked_match"}
+
+	second_result = tree.lookup(to_dbf_map(PLAY_SEQUENCES[1][:2]), sequence)
+	assert second_result.node is result.node
+	assert tree._popularity_distribution(result.node) is result.popularity_distribution
+
+
 @pytest.fixture(scope="function")
 def redis():
 	redis = fakeredis.FakeStrictRedis()
@@ -447,3 +503,252 @@ def test_inverse_lookup_table_observe_enforces_dbf_ids(redis):
 
 	with pytest.raises(ValueError):
 		ilt.observe({"GVG_006": 2, "GVG_037": 2}, 1)
+
+
+def test_in_memory_inverse_lookup_table_predicts_more_popular_deck(redis):
+	ilt = InMemoryInverseLookupTable(RedisInverseLookupTable(
+		redis,
+		FormatType.FT_STANDARD,
+		CardClass.DRUID,
+		full_deck_size=4,
+		min_cards_for_prediction=1
+	))
+	ilt.observe({1: 1, 2: 1, 3: 2}, 1)
+	ilt.observe({1: 1, 3: 2, 4: 1}, 2)
+	ilt.observe({1: 1, 2: 1, 3: 2}, 1)
+	assert ilt.predict({1: 1, 3: 2}) == 1
+	assert ilt.predict({1: 1, 4: 1}) == 2
+
+
+def test_in_memory_inverse_lookup_table_refreshes_from_redis(redis):
+	ilt = RedisInverseLookupTable(
+		redis,
+		FormatType.FT_STANDARD,
+		CardClass.DRUID,
+		full_deck_size=4
+	)
+	ilt.observe({1: 1, 2: 1, 3: 2}, 1)
+	remote_ilt = InMemoryInverseLookupTable(RedisInverseLookupTable(
+		redis,
+		FormatType.FT_STANDARD,
+		CardClass.DRUID,
+		min_cards_for_prediction=1
+	))
+
+	# Pretend the indexes have been kept up for the whole lookback window
+	redis.set(ilt._get_index_start_key(), 0)
+
+	# The keys to read are listed from their indexes, not from a SCAN
+	with patch.object(redis, "scan_iter", side_effect=AssertionError):
+		remote_ilt.refresh()
+		assert remote_ilt.predict({1: 1, 3: 2}) == 1
+
+		# Observations made elsewhere only show up after the next refresh
+		ilt.observe({1: 1, 2: 1, 4: 2}, 2)
+		assert remote_ilt.predict({4: 2}) is None
+		remote_ilt.refresh()
+		assert remote_ilt.predict({4: 2}) == 2
+
+
+def test_in_memory_inverse_lookup_table_loads_in_background(redis):
+	RedisInverseLookupTable(
+		redis,
+		FormatType.FT_STANDARD,
+		CardClass.DRUID,
+		full_deck_size=4
+	).observe({1: 1, 2: 1, 3: 2}, 1)
+	ilt = InMemoryInverseLookupTable(RedisInverseLookupTable(
+		redis,
+		FormatType.FT_STANDARD,
+		CardClass.DRUID,
+		min_cards_for_prediction=1
+	), refresh_interval=0)
+
+	with patch("threading.Thread") as thread:
+		# Until the first refresh has completed, predictions are served by Redis...
+		assert ilt.predict({1: 1, 3: 2}) == 1
+		assert ilt.predict({1: 1, 3: 2}) == 1
+
+		# ...and only one refresh is started, however often predict() is called
+		thread.assert_called_once_with(target=ilt._refresh_in_background, daemon=True)
+
+	ilt._refresh_in_background()
+	assert ilt._refreshed_at_msecs is not None
+	assert not ilt._refresh_lock.locked()
+
+
+def test_in_memory_inverse_lookup_table_waits_for_complete_index(redis, mock_time):
+	# 8am: Observe a deck with 1h lookbacks
+	mock_time(datetime(2019, 1, 1, 8, 0))
+	source = RedisInverseLookupTable(
+		redis,
+		FormatType.FT_STANDARD,
+		CardClass.DRUID,
+		full_deck_size=4,
+		min_cards_for_prediction=1,
+		ilt_lookback_mins=60,
+		deck_popularity_lookback_mins=60,
+	)
+	source.observe({1: 1, 2: 1, 3: 2}, 1)
+	ilt = InMemoryInverseLookupTable(source)
+
+	# 8:30am: The indexes don't go back a full hour, so Redis answers
+	mock_time(datetime(2019, 1, 1, 8, 30))
+	ilt.refresh()
+	with patch.object(source, "predict", return_value=2):
+		assert ilt.predict({1: 1, 3: 2}) == 2
+
+	# 9am: They do now, so the in-memory table answers
+	mock_time(datetime(2019, 1, 1, 9, 0))
+	source.observe({1: 1, 2: 1, 3: 2}, 1)
+	ilt.refresh()
+	with patch.object(source, "predict", side_effect=AssertionError):
+		assert ilt.predict({1: 1, 3: 2}) == 1
+
+
+def test_in_memory_inverse_lookup_table_predicts_fuzzy_deck(redis):
+	ilt = InMemoryInverseLookupTable(RedisInverseLookupTable(
+		redis,
+		FormatType.FT_STANDARD,
+		CardClass.DRUID,
+		full_deck_size=4,
+		min_cards_for_prediction=1,
+		required_cards={5},
+	))
+	ilt.observe({1: 1, 2: 1, 3: 2}, 1)
+	assert ilt.predict({1: 1, 2: 1, 4: 1}) == 1
+	assert ilt.predict({1: 1, 2: 1, 5: 1}) is None
+
+
+def test_in_memory_inverse_lookup_table_ilts_expire(redis, mock_time):
+	# 8am: Observe a deck with 1h expiry
+	mock_time(datetime(2019, 1, 1, 8, 0))
+	ilt = InMemoryInverseLookupTable(RedisInverseLookupTable(
+		redis,
+		FormatType.FT_STANDARD,
+		CardClass.DRUID,
+		full_deck_size=4,
+		min_cards_for_prediction=1,
+		ilt_lookback_mins=60,
+	))
+	ilt.observe({1: 1, 2: 1, 3: 2}, 1)
+	assert ilt.predict({1: 1, 3: 2}) == 1
+
+	# 10am: Ensure we have forgotten about the deck
+	mock_time(datetime(2019, 1, 1, 10, 0))
+	assert ilt.predict({1: 1, 3: 2}) is None
+
+
+def test_in_memory_inverse_lookup_table_prunes_observations(redis, mock_time):
+	# 8am: Observe a deck with 1h popularity expiry
+	mock_time(datetime(2019, 1, 1, 8, 0))
+	ilt = InMemoryInverseLookupTable(RedisInverseLookupTable(
+		redis,
+		FormatType.FT_STANDARD,
+		CardClass.DRUID,
+		full_deck_size=4,
+		min_cards_for_prediction=1,
+		deck_popularity_lookback_mins=60,
+	))
+	ilt.observe({1: 1, 2: 1, 3: 2}, 1, "a")
+
+	# 10am: Observe it again, ensure the first observation is forgotten on refresh
+	mock_time(datetime(2019, 1, 1, 10, 0))
+	ilt.observe({1: 1, 2: 1, 3: 2}, 1, "b")
+	ilt.refresh()
+	assert list(ilt._observations[ilt._columns[1]]) == ["b"]
+
+
+def test_in_memory_inverse_lookup_table_counts_observations(redis, mock_time):
+	mock_time(datetime(2019, 1, 1, 8, 0))
+	ilt = InMemoryInverseLookupTable(RedisInverseLookupTable(
+		redis,
+		FormatType.FT_STANDARD,
+		CardClass.DRUID,
+		full_deck_size=4,
+		min_cards_for_prediction=1,
+		deck_popularity_lookback_mins=60,
+	))
+	ilt.refresh()
+	ilt.observe({1: 1, 2: 1, 3: 2}, 1, "a")
+	ilt.observe({1: 1, 2: 1, 3: 2}, 1, "b")
+	ilt.observe({1: 1, 3: 2, 4: 1}, 2, "c")
+
+	# 8:05am: The observations read again by the refresh are only counted once...
+	mock_time(datetime(2019, 1, 1, 8, 5))
+	ilt.refresh()
+	ilt.observe({1: 1, 3: 2, 4: 1}, 2, "d")
+	ilt.observe({1: 1, 3: 2, 4: 1}, 2, "e")
+
+	# ...and then folded into per-minute counts
+	mock_time(datetime(2019, 1, 1, 8, 10))
+	ilt.refresh()
+	column = ilt._columns[1]
+	assert ilt._observations[column] == {}
+	assert sum(ilt._observation_counts[column].values()) == 2
+
+	now_msecs = int(datetime(2019, 1, 1, 8, 10).timestamp() * 1000)
+	columns = [ilt._columns[1], ilt._columns[2]]
+	assert ilt._most_popular(columns, now_msecs) == 2
+
+	# 9:30am: The counts drop out of the popularity lookback
+	mock_time(datetime(2019, 1, 1, 9, 30))
+	ilt.refresh()
+	assert ilt._observation_counts[column] == {}
+
+
+def test_inverse_lookup_table_observe_many(redis):
+	ilt = RedisInverseLookupTable(
+		redis,
+		FormatType.FT_STANDARD,
+		CardClass.DRUID,
+		full_deck_size=4,
+		min_cards_for_prediction=1
+	)
+	ilt.observe_many([
+		({1: 1, 2: 1, 3: 2}, 1, None),
+		({1: 1, 3: 2, 4: 1}, 2, "a"),
+		({1: 1, 3: 2, 4: 1}, 2, "b"),
+		({1: 1, 3: 2, 4: 1}, 2, "b"),
+	])
+	assert ilt._get_popularity_for_deck(1) == 1
+	assert ilt._get_popularity_for_deck(2) == 2
+	assert ilt.predict({1: 1, 3: 2}) == 2
+	assert ilt.predict({2: 1}) == 1
+
+	with pytest.raises(ValueError):
+		ilt.observe_many([({1: 1, 2: 1, 3: 2}, 1, None), ({1: 1}, 3, None)])
+
+
+def test_inverse_lookup_table_observe_many_empty(redis):
+	ilt = RedisInverseLookupTable(redis, FormatType.FT_STANDARD, CardClass.DRUID)
+
+	with patch.object(redis, "pipeline", side_effect=AssertionError):
+		ilt.observe_many([])
+
+
+def test_deck_prediction_tree_is_shared_between_threads():
+	redis = fakeredis.FakeStrictRedis()
+
+	def thread_local_cache(alias):
+		# Every thread gets cache objects (and Redis clients) of its own
+		cache = Mock()
+		cache.client.get_client.return_value = Mock(wraps=redis)
+		return cache
+
+	caches = Mock()
+	caches.__getitem__ = Mock(side_effect=thread_local_cache)
+	trees = []
+
+	def get_tree():
+		trees.append(prediction.deck_prediction_tree(CardClass.MAGE, FormatType.FT_STANDARD))
+
+	with patch("django.core.cache.caches", caches), \
+		patch.dict(prediction._DECK_PREDICTION_TREES, clear=True):
+		for _ in range(3):
+			thread = threading.Thread(target=get_tree)
+			thread.start()
+			thread.join()
+
+		assert trees[0] is trees[1] is trees[2]
+		assert len(prediction._DECK_PREDICTION_TREES) == 1
@@ -1,10 +1,13 @@
-from datetime import timedelta
+from datetime import datetime, timedelta
 
 from django.conf import settings
 from django.utils import timezone
 
 from hsreplaynet.games.processing import _dates_within_etl_threshold
-from hsreplaynet.uploads.models import RedshiftETLTask
+from hsreplaynet.uploads import etl, models
+from hsreplaynet.uploads.models import (
+	HandleStatus, RedshiftETLStage, RedshiftETLTask, RedshiftStagingTrackTable
+)
 
 
 def test_etl_task():
@@ -63,3 +66,115 @@ def test_replay_meets_recency_requirements():
 		log_upload_date,
 		later_match_start_outside_threshold
 	), "A match start outside the threshold was not rejected"
+
+
+def _table(target_table, stage, is_materialized_view=False):
+	return RedshiftStagingTrackTable(
+		target_table=target_table, stage=stage, is_materialized_view=is_materialized_view
+	)
+
+
+def test_table_operations_form_a_chain():
+	stage = RedshiftETLStage.READY_TO_LOAD
+	for operation in etl.TABLE_OPERATIONS:
+		assert operation.ready_stage == stage
+		assert operation.ready_stage < operation.stage < operation.complete_stage
+		stage = operation.complete_stage
+	assert stage == RedshiftETLStage.FINISHED
+
+	assert etl.get_table_operation(_table("game", RedshiftETLStage.INSERTING)) is None
+	cleaning_up = _table("game", RedshiftETLStage.CLEANING_UP)
+	assert str(etl.get_table_operation(cleaning_up)) == "cleaning_up"
+
+
+def test_tables_advance_independently_until_views(monkeypatch):
+	monkeypatch.setattr(
+		etl, "get_view_dependencies", lambda view: ["view_a"] if view == "view_b" else []
+	)
+	game = _table("game", RedshiftETLStage.DEDUPLICATION_COMPLETE)
+	block = _table("block", RedshiftETLStage.GATHERING_STATS_COMPLETE)
+	view_a = _table("view_a", RedshiftETLStage.INSERT_COMPLETE, is_materialized_view=True)
+	view_b = _table("view_b", RedshiftETLStage.INSERT_COMPLETE, is_materialized_view=True)
+	tables = [game, block, view_a, view_b]
+
+	# game can be inserted while block is still waiting to be deduplicated
+	for table in (game, block):
+		operation = etl.get_table_operation(table)
+		assert etl.dependencies_are_met(operation, table, tables)
+
+	# Views wait for every staging table to be inserted
+	refresh = etl.get_table_operation(view_a)
+	assert not etl.dependencies_are_met(refresh, view_a, tables)
+
+	game.stage = RedshiftETLStage.INSERT_COMPLETE
+	block.stage = RedshiftETLStage.REFRESHING_MATERIALIZED_VIEWS_COMPLETE
+	assert etl.dependencies_are_met(refresh, view_a, tables)
+	# ... and for the views they depend on
+	assert not etl.dependencies_are_met(refresh, view_b, tables)
+
+	# Nothing is vacuumed until every view is refreshed
+	vacuum = etl.get_table_operation(block)
+	assert not etl.dependencies_are_met(vacuum, block, tables)
+
+	view_a.stage = RedshiftETLStage.REFRESHING_MATERIALIZED_VIEWS_COMPLETE
+	assert etl.dependencies_are_met(refresh, view_b, tables)
+	view_b.stage = RedshiftETLStage.REFRESHING_MATERIALIZED_VIEWS_COMPLETE
+	game.stage = RedshiftETLStage.REFRESHING_MATERIALIZED_VIEWS_COMPLETE
+	assert etl.dependencies_are_met(vacuum, block, tables)
+
+
+def test_select_tasks():
+	operations = {op.name: op for op in etl.TABLE_OPERATIONS}
+	analyze = operations["analyzing"]
+	vacuum = operations["vacuuming"]
+	insert = operations["inserting"]
+
+	tasks = [(analyze, "a1"), (analyze, "a2"), (vacuum, "v1"), (insert, "i1"), (None, "l1")]
+	assert etl.select_tasks(tasks, 0) == []
+	assert etl.select_tasks(tasks, 2) == ["a1", "a2"]
+	# Exclusive tasks are skipped unless they can run on their own
+	assert etl.select_tasks(tasks, 4) == ["a1", "a2", "i1", "l1"]
+	assert etl.select_tasks(tasks[2:], 4) == ["v1"]
+
+
+def test_refresh_table_states_fetches_every_handle_at_once(monkeypatch):
+	finished_at = datetime(2018, 1, 1, 12, 0, 0)
+	statuses = {
+		"handle-1": HandleStatus(False, True, False, 1, finished_at, False, None),
+		"handle-2": HandleStatus(True, False, None, None, None, False, None),
+		"handle-3": HandleStatus(False, True, True, 1, finished_at, False, None),
+		"handle-4": HandleStatus(False, False, None, None, None, False, finished_at),
+	}
+	fetched = []
+
+	def get_handle_statuses(handles):
+		handles = list(handles)
+		fetched.append(sorted(h for h in handles if h))
+		return statuses
+
+	monkeypatch.setattr(models, "get_handle_statuses", get_handle_statuses)
+	monkeypatch.setattr(RedshiftStagingTrackTable, "save", lambda self: None)
+	monkeypatch.setattr(
+		RedshiftStagingTrackTable, "heartbeat_track_status_metrics", lambda self: None
+	)
+
+	inserted = _table("game", RedshiftETLStage.INSERTING)
+	inserted.insert_query_handle = "handle-1"
+	in_flight = _table("block", RedshiftETLStage.DEDUPLICATING)
+	in_flight.dedupe_query_handle = "handle-2"
+	failed = _table("player", RedshiftETLStage.ANALYZING)
+	failed.analyze_query_handle = "handle-3"
+	vacuumed = _table("choices", RedshiftETLStage.VACUUMING)
+	vacuumed.vacuum_query_handle = "handle-4"
+	waiting = _table("options", RedshiftETLStage.INSERT_COMPLETE)
+	tables = [inserted, in_flight, failed, vacuumed, waiting]
+
+	RedshiftStagingTrackTable.objects.refresh_table_states(tables)
+
+	assert fetched == [["handle-1", "handle-2", "handle-3", "handle-4"]]
+	assert inserted.stage == RedshiftETLStage.INSERT_COMPLETE
+	assert inserted.inserting_ended_at == timezone.make_aware(finished_at)
+	assert in_flight.stage == RedshiftETLStage.DEDUPLICATING
+	assert failed.stage == RedshiftETLStage.ERROR
+	assert vacuumed.stage == RedshiftETLStage.VACUUM_COMPLETE
+	assert waiting.stage == RedshiftETLStage.INSERT_COMPLETE
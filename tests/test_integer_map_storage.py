@@ -31,3 +31,29 @@ def test_integer_map_storage():
 		expected_deck_id = i + 1
 		partial_map = {dbf: c for dbf, c in dbf_list[:-1]}
 		assert int(storage.match(partial_map, *deck_ids)[0]) == expected_deck_id
+
+
+def test_integer_map_storage_ranked_match():
+	r = fakeredis.FakeStrictRedis()
+	r.flushdb()
+
+	storage = RedisIntegerMapStorage((r, r), "DECK")
+	for i, dbf_list in enumerate(DECKS):
+		storage.store(i + 1, {dbf: c for dbf, c in dbf_list})
+
+	ranking_key = "DECK_POPULARITY"
+	r.zadd(ranking_key, 10, 1)
+	r.zadd(ranking_key, 5, 2)
+	r.zadd(ranking_key, 5, 3)
+
+	# Deck 1 and 3 both contain 2x 395, but deck 1 is more popular
+	assert storage.ranked_match({395: 2}, ranking_key) == [("1", 10)]
+
+	# Deck 2 is the only one with 2x 2029
+	assert storage.ranked_match({2029: 2}, ranking_key) == [("2", 5)]
+
+	# Decks 1 and 3 both contain 2x 77 and are tied once deck 1 drops in popularity
+	r.zadd(ranking_key, 5, 1)
+	assert sorted(storage.ranked_match({77: 2}, ranking_key)) == [("1", 5), ("3", 5)]
+
+	assert storage.ranked_match({77: 3}, ranking_key) == []
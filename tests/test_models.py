@@ -83,6 +83,31 @@ def test_deck_deck_class():
 	assert deck.deck_class == CardClass.NEUTRAL
 
 
+@pytest.mark.django_db
+def test_deck_bulk_creation(settings):
+	settings.ARCHETYPE_CLASSIFICATION_ENABLED = False
+	existing_deck, _ = Deck.objects.get_or_create_from_id_list(DECK_LIST[:10])
+
+	results = Deck.objects.get_or_create_from_id_lists([
+		(DECK_LIST, HERO_CARD_ID),
+		(DECK_LIST[:10], HERO_CARD_ID),
+		([], HERO_CARD_ID),
+	])
+	assert len(results) == 3
+
+	deck, created = results[0]
+	assert created
+	assert deck.size == 30
+	assert deck.deck_class == CardClass.HUNTER
+
+	deck, created = results[1]
+	assert not created
+	assert deck.id == existing_deck.id
+
+	deck, _ = results[2]
+	assert deck.size == 0
+
+
 def test_deck_pick_card_class():
 	DRUID = CardClass.DRUID
 	WARLOCK = CardClass.WARLOCK
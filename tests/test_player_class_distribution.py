@@ -45,3 +45,27 @@ def test_player_class_distribution(_mock_lock):
 		player_class_data = data[player_class.name]
 		assert player_class_data["games"] == actual_games[player_class.name]
 		assert player_class_data["wins"] == actual_wins[player_class.name]
+
+
+@patch("redis_lock.Lock")
+def test_player_class_distribution_series(_mock_lock):
+	redis = fakeredis.FakeStrictRedis()
+	distribution = get_player_class_distribution("FT_STANDARD_SERIES", redis)
+
+	current_ts = datetime.utcnow()
+	t_0 = current_ts - timedelta(seconds=600, microseconds=current_ts.microsecond)
+	for i in range(0, 601, 3):
+		for game_num in range(randrange(0, 4)):
+			distribution.increment(
+				key=CardClass(randrange(2, 11)).name,
+				win=bool(randrange(0, 2)),
+				as_of=t_0 + timedelta(seconds=i)
+			)
+
+	window = timedelta(seconds=300)
+	window_end_timestamps = [t_0 + window + timedelta(seconds=i) for i in range(0, 301, 5)]
+	series = distribution.distribution_series(window_end_timestamps, window=window)
+
+	assert len(series) == len(window_end_timestamps)
+	for end_ts, data in zip(window_end_timestamps, series):
+		assert data == distribution.distribution(start_ts=end_ts - window, end_ts=end_ts)
@@ -173,3 +173,164 @@ def test_bucket_sizes():
 		# Assert the total number of buckets matches the expected number
 		expected_num_buckets = ceil((end_token - yesterday_start_token) / bucket_size)
 		assert len(buckets) == expected_num_buckets
+
+
+def test_increment_many():
+	r = fakeredis.FakeStrictRedis()
+	observations = RedisPopularityDistribution(r, "OBSERVATIONS", namespace="test")
+	wins = RedisPopularityDistribution(r, "WINS", namespace="test")
+
+	RedisPopularityDistribution.increment_many([
+		(observations, "A"),
+		(observations, "B"),
+		(observations, "A"),
+		(wins, "A"),
+	])
+
+	assert observations.distribution() == {"A": 2, "B": 1}
+	assert wins.distribution() == {"A": 1}
+
+
+def test_increment_many_evicts_least_popular():
+	r = fakeredis.FakeStrictRedis()
+	distribution = RedisPopularityDistribution(r, "SEQUENTIAL", namespace="test", max_items=2)
+	batched = RedisPopularityDistribution(r, "BATCHED", namespace="test", max_items=2)
+
+	for deck in DECKS:
+		distribution.increment(deck)
+	for i in range(0, len(DECKS), 5):
+		RedisPopularityDistribution.increment_many((batched, deck) for deck in DECKS[i:i + 5])
+
+	assert batched.size() == 2
+	assert batched.distribution() == distribution.distribution()
+
+
+def test_sliding_window_summaries():
+	r = fakeredis.FakeStrictRedis()
+	distribution = RedisPopularityDistribution(
+		r, "SLIDING", namespace="test", ttl=60, bucket_size=1
+	)
+
+	current_ts = datetime.utcnow()
+	t_0 = current_ts - timedelta(seconds=30, microseconds=current_ts.microsecond)
+	observations = [(t_0 + timedelta(seconds=i), DECKS[i % len(DECKS)]) for i in range(30)]
+	for ts, deck in observations:
+		distribution.increment(deck, as_of=ts)
+
+	def expected(start_ts, end_ts):
+		result = defaultdict(int)
+		for ts, deck in observations:
+			if start_ts <= ts <= end_ts:
+				result[str(deck)] += 1
+		return dict(result)
+
+	# Each window after the first is derived from the one before it
+	for i in range(20):
+		start_ts = t_0 + timedelta(seconds=i)
+		end_ts = start_ts + timedelta(seconds=9)
+		assert distribution.distribution(start_ts, end_ts) == expected(start_ts, end_ts)
+
+	# Windows including the current bucket combine the complete buckets with it
+	distribution.increment("LIVE")
+	start_ts = t_0 + timedelta(seconds=20)
+	end_ts = datetime.utcnow()
+	actual = distribution.distribution(start_ts, end_ts)
+	assert actual == dict(expected(start_ts, end_ts), LIVE=1)
+
+
+def test_existing_summary_keys():
+	r = fakeredis.FakeStrictRedis()
+	distributions = [
+		RedisPopularityDistribution(r, name, namespace="test", ttl=3600, bucket_size=60)
+		for name in ("A", "B", "C")
+	]
+	now = datetime.utcnow()
+	start_ts = now - timedelta(seconds=1800)
+	end_ts = now - timedelta(seconds=120)
+	RedisPopularityDistribution.increment_many([
+		(distributions[0], 1, end_ts),
+		(distributions[1], 2, end_ts),
+	])
+	summary_key = distributions[0].summary_key(start_ts, end_ts)
+
+	assert RedisPopularityDistribution.existing_summary_keys(
+		distributions, start_ts, end_ts
+	) == [summary_key, None, None]
+
+	# Summaries including the current bucket (or the one that just closed) are only
+	# reused for live_summary_ttl
+	live_key = distributions[0].summary_key(start_ts, now)
+	assert live_key.endswith(":LIVE")
+	assert RedisPopularityDistribution.existing_summary_keys(
+		distributions, start_ts, now
+	) == [live_key, None, None]
+	distributions[0].live_summary_ttl = 0
+	assert RedisPopularityDistribution.existing_summary_keys(
+		distributions, start_ts, now
+	) == [None, None, None]
+	assert RedisPopularityDistribution.existing_summary_keys(
+		distributions, start_ts, now - timedelta(seconds=60)
+	) == [None, None, None]
+
+
+def test_summaries_include_late_observations():
+	r = fakeredis.FakeStrictRedis()
+	distribution = RedisPopularityDistribution(
+		r, "LATE", namespace="test", ttl=86400, bucket_size=3600, live_summary_ttl=0
+	)
+	now = datetime.utcnow()
+	start_ts = now - timedelta(hours=5)
+	closed_ts = now - timedelta(hours=1)
+	distribution.increment(1, as_of=start_ts)
+	assert distribution.distribution(start_ts, closed_ts) == {"1": 1}
+
+	# An observation in the bucket which just closed, recorded after it closed
+	distribution.increment(2, as_of=closed_ts)
+	assert distribution.distribution(start_ts, closed_ts) == {"1": 1, "2": 1}
+
+
+def test_live_summaries_are_reused():
+	r = fakeredis.FakeStrictRedis()
+	distribution = RedisPopularityDistribution(
+		r, "LIVE", namespace="test", ttl=86400, bucket_size=3600, live_summary_ttl=30
+	)
+	now = datetime.utcnow()
+	start_ts = now - timedelta(hours=5)
+	distribution.increment(1, as_of=start_ts)
+	summary_key = distribution.summary_key(start_ts, now)
+	assert 0 < r.ttl(summary_key) <= 30
+
+	# Until it expires, the live summary is not rebuilt
+	distribution.increment(2)
+	with patch.object(r, "pipeline", side_effect=AssertionError):
+		assert distribution.distribution(start_ts, now) == {"1": 1}
+
+	r.delete(summary_key)
+	assert distribution.distribution(start_ts, now) == {"1": 1, "2": 1}
+
+
+def test_summaries_are_rebuilt_periodically():
+	r = fakeredis.FakeStrictRedis()
+	distribution = RedisPopularityDistribution(
+		r, "REBUILD", namespace="test", ttl=3600, bucket_size=60
+	)
+	now = datetime.utcnow()
+	observed_ts = now - timedelta(minutes=30)
+	distribution.increment(1, as_of=observed_ts)
+
+	def window(i):
+		start_ts = now - timedelta(minutes=40 - i)
+		return start_ts, start_ts + timedelta(minutes=20)
+
+	for i in range(3):
+		distribution.distribution(*window(i))
+
+	# An observation recorded long after its bucket settled is missed by the summaries
+	# derived from the ones which already included that bucket...
+	distribution.increment(2, as_of=observed_ts)
+	with patch.object(RedisPopularityDistribution, "SUMMARY_REBUILD_INTERVAL", 1000):
+		assert distribution.distribution(*window(3)) == {"1": 1}
+
+	# ... until they are rebuilt from the buckets
+	with patch.object(RedisPopularityDistribution, "SUMMARY_REBUILD_INTERVAL", 1):
+		assert distribution.distribution(*window(4)) == {"1": 1, "2": 1}
@@ -1,5 +1,6 @@
 import json
 import os
+from base64 import b64encode
 from io import BytesIO
 
 import pytest
@@ -12,7 +13,9 @@ from storages.backends.s3boto3 import S3Boto3Storage
 from hearthsim.identity.accounts.models import AuthToken
 from hearthsim.identity.api.models import APIKey
 from hsreplaynet.games.exporters import GameDigestExporter
-from hsreplaynet.lambdas.uploads import process_raw_upload
+from hsreplaynet.games.models import _generate_source_log_path, _generate_source_path
+from hsreplaynet.games.processing import ensure_replay_xml
+from hsreplaynet.lambdas.uploads import process_kinesis_records_in_batch, process_raw_upload
 from hsreplaynet.uploads.models import UploadEvent, UploadEventStatus, _generate_upload_key
 
 from .conftest import LOG_DATA_DIR, UPLOAD_SUITE
@@ -153,6 +156,34 @@ def do_process_raw_upload(raw_upload, is_reprocessing):
 	assert exporter.digest == replay.global_game.digest
 
 
+@pytest.mark.django_db
+@pytest.mark.usefixtures("multi_db")
+def test_upload_lazy_replay_xml(db, settings):
+	settings.REPLAY_XML_LAZY_GENERATION = True
+	shortid = sorted(os.listdir(UPLOAD_SUITE))[0]
+	raw_upload = MockRawUpload(os.path.join(UPLOAD_SUITE, shortid), default_storage)
+	process_raw_upload(raw_upload, False)
+
+	replay = UploadEvent.objects.get(shortid=raw_upload.shortid).game
+	assert not replay.hsreplay_version
+	assert replay.replay_xml_url == "/replay/%s/hsreplay.xml" % (replay.shortid)
+	assert default_storage.exists(_generate_source_path(replay.shortid))
+	assert default_storage.exists(_generate_source_log_path(replay.shortid))
+
+	# The source does not depend on the UploadEvent's log, which gets reaped
+	default_storage.delete(UploadEvent.objects.get(shortid=raw_upload.shortid).file.name)
+
+	assert ensure_replay_xml(replay)
+	assert replay.hsreplay_version
+	assert not default_storage.exists(_generate_source_path(replay.shortid))
+	assert not default_storage.exists(_generate_source_log_path(replay.shortid))
+
+	replay_data = HSReplayDocument.from_xml_file(replay.replay_xml)
+	exporter = GameDigestExporter(replay_data.to_packet_tree()[0])
+	exporter.export()
+	assert exporter.digest == replay.global_game.digest
+
+
 @mock_s3
 @pytest.mark.django_db
 @pytest.mark.usefixtures("multi_db")
@@ -222,6 +253,57 @@ def test_process_raw_upload_timeout(mocker):
 	assert S3Boto3Storage.open.call_count == 2
 
 
+def _make_kinesis_record(shortid):
+	data = {
+		"bucket": "hsreplaynet-uploads",
+		"log_key": "raw/2018/01/01/10/00/%s.power.log" % (shortid),
+		"attempt_reprocessing": False,
+	}
+	return {"kinesis": {
+		"partitionKey": shortid,
+		"data": b64encode(json.dumps(data).encode("utf8")).decode("ascii"),
+	}}
+
+
+def test_process_kinesis_records_in_batch(mocker):
+	shortids = ["%s%02i" % ("a" * 20, i) for i in range(10)]
+	records = [_make_kinesis_record(shortid) for shortid in shortids]
+
+	def fake_process_raw_upload(raw_upload, *args):
+		if raw_upload.shortid == shortids[3]:
+			raise ValidationError("Boom")
+
+	mock_process = mocker.patch(
+		"hsreplaynet.lambdas.uploads.process_raw_upload",
+		side_effect=fake_process_raw_upload
+	)
+	mock_error_handler = mocker.patch("hsreplaynet.utils.instrumentation.error_handler")
+
+	process_kinesis_records_in_batch(records, num_workers=3)
+
+	processed = sorted(call[0][0].shortid for call in mock_process.call_args_list)
+	assert processed == shortids
+	assert mock_error_handler.call_count == 1
+
+
+def test_process_kinesis_records_in_batch_requeues_when_out_of_time(mocker):
+	shortids = ["%s%02i" % ("a" * 20, i) for i in range(5)]
+	records = [_make_kinesis_record(shortid) for shortid in shortids]
+
+	mock_process = mocker.patch("hsreplaynet.lambdas.uploads.process_raw_upload")
+	mock_requeue = mocker.patch("hsreplaynet.lambdas.uploads.requeue_kinesis_records")
+	remaining_millis = iter([600000, 600000, 1000])
+
+	process_kinesis_records_in_batch(
+		records, num_workers=1,
+		get_remaining_time_in_millis=lambda: next(remaining_millis)
+	)
+
+	processed = [call[0][0].shortid for call in mock_process.call_args_list]
+	assert processed == shortids[:2]
+	mock_requeue.assert_called_once_with(records[2:])
+
+
 def validate_fuzzy_date_match(upload_date, replay_date):
 	assert upload_date.year == replay_date.year
 	assert upload_date.month == replay_date.month
@@ -0,0 +1,51 @@
+import fakeredis
+
+from hsreplaynet.utils.redis import RedisCounter, RedisSet
+
+
+DAY = 24 * 60 * 60
+
+
+def test_redis_counter():
+	r = fakeredis.FakeStrictRedis()
+	counter = RedisCounter(r, "TEST_REDIS_COUNTER", bucket_size=DAY, ttl=7 * DAY)
+
+	assert counter.increment() == 1
+	assert counter.increment() == 2
+	assert counter.increment(3) == 5
+	assert counter.get_count(0, 0) == 5
+	assert counter.get_count(1, 7) == 0
+	assert 0 < r.ttl(counter._bucket_key(0)) <= 7 * DAY
+
+
+def test_redis_set():
+	r = fakeredis.FakeStrictRedis()
+	contributors = RedisSet(r, "TEST_REDIS_SET", bucket_size=DAY, ttl=7 * DAY)
+
+	for value in ("a", "b", "a", "c"):
+		contributors.add(value)
+	r.sadd(contributors._bucket_key(1), "a", "d")
+
+	assert contributors.get_count(0, 0) == 3
+	assert contributors.get_count(0, 1) == 4
+	assert contributors.get_count(1, 2) == 2
+
+
+def test_redis_set_hyperloglog():
+	r = fakeredis.FakeStrictRedis()
+	contributors = RedisSet(
+		r, "TEST_REDIS_SET_HLL", bucket_size=DAY, ttl=7 * DAY, hyperloglog=True
+	)
+
+	for value in ("a", "b", "a", "c"):
+		contributors.add(value)
+	r.pfadd(contributors._bucket_key(1), "a", "d")
+	r.pfadd(contributors._bucket_key(2), "e")
+
+	assert contributors.get_count(0, 0) == 3
+	assert contributors.get_count(0, 1) == 4
+	assert contributors.get_count(1, 2) == 3
+
+	# The merged HyperLogLog of past buckets is reused
+	r.pfadd(contributors._bucket_key(2), "f")
+	assert contributors.get_count(1, 2) == 3
@@ -0,0 +1,42 @@
+from unittest.mock import Mock, patch
+
+import fakeredis
+
+from hsreplaynet.api.live.distributions import (
+	get_active_twitch_stream_keys, record_twitch_stream_heartbeat
+)
+
+
+@patch("hsreplaynet.api.live.distributions.caches")
+@patch("hsreplaynet.api.live.distributions.time")
+@patch("hsreplaynet.api.live.distributions.get_live_stats_redis")
+def test_active_twitch_streams(get_live_stats_redis, mock_time, caches):
+	redis = fakeredis.FakeStrictRedis()
+	redis.flushall()
+	get_live_stats_redis.return_value = redis
+	caches.__getitem__.return_value = Mock()
+
+	mock_time.time.return_value = 1000
+	record_twitch_stream_heartbeat(1, {"deck": "..."}, timeout=300)
+	mock_time.time.return_value = 1100
+	record_twitch_stream_heartbeat(2, {"deck": "..."}, timeout=300)
+	caches["live_stats"].set.assert_called_with("twitch_2", {"deck": "..."}, timeout=300)
+
+	# The streams are listed from the index, most recent first, without a SCAN
+	with patch.object(redis, "scan_iter", side_effect=AssertionError):
+		assert get_active_twitch_stream_keys(max_age=120) == ["twitch_2", "twitch_1"]
+
+		mock_time.time.return_value = 1150
+		assert get_active_twitch_stream_keys(max_age=120) == ["twitch_2"]
+
+
+@patch("hsreplaynet.api.live.distributions.get_live_stats_redis")
+def test_active_twitch_streams_without_index(get_live_stats_redis):
+	redis = fakeredis.FakeStrictRedis()
+	redis.flushall()
+	get_live_stats_redis.return_value = redis
+
+	# Streams published without a heartbeat are found with a SCAN
+	redis.set(":1:twitch_1", "...")
+	redis.set(":1:other", "...")
+	assert get_active_twitch_stream_keys(max_age=120) == ["twitch_1"]
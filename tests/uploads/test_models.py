@@ -0,0 +1,46 @@
+import gzip
+from io import BufferedReader, BytesIO
+
+import pytest
+
+from hsreplaynet.uploads.models import UploadEvent
+from hsreplaynet.uploads.utils import InflatingReader
+
+
+LOG_DATA = b"D 10:00:00.000000 GameState.DebugPrintPower() - CREATE_GAME\n" * 1000
+
+
+@pytest.fixture
+def log_streams(mocker):
+	streams = []
+
+	def open_log_stream(data):
+		stream = BufferedReader(InflatingReader(BytesIO(data)))
+		streams.append(stream)
+		return stream
+
+	def patch(data):
+		return mocker.patch.object(
+			UploadEvent, "open_log_stream", side_effect=lambda: open_log_stream(data)
+		)
+
+	return patch, streams
+
+
+def test_check_log_stream(log_streams):
+	patch, streams = log_streams
+	patch(gzip.compress(LOG_DATA))
+	upload_event = UploadEvent()
+
+	upload_event.check_log_stream()
+	assert streams[0].closed
+
+
+def test_check_log_stream_corrupt(log_streams):
+	patch, streams = log_streams
+	patch(LOG_DATA)
+	upload_event = UploadEvent()
+
+	with pytest.raises(OSError):
+		upload_event.check_log_stream()
+	assert streams[0].closed
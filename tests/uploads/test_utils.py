@@ -1,4 +1,14 @@
-from hsreplaynet.uploads.utils import user_agent_product
+import gzip
+from io import BufferedReader, BytesIO
+
+import pytest
+
+from hsreplaynet.uploads.utils import ChunkedReader, InflatingReader, user_agent_product
+
+
+LOG_DATA = b"".join(
+	b"D 10:00:00.000000 GameState.DebugPrintPower() - %i\n" % i for i in range(5000)
+)
 
 
 def test_user_agent_product():
@@ -21,3 +31,34 @@ def test_user_agent_product_invalid():
 	assert user_agent_product("") is None
 	assert user_agent_product("/") is None
 	assert user_agent_product(";") is None
+
+
+def test_chunked_reader():
+	reader = BufferedReader(ChunkedReader(BytesIO(LOG_DATA), chunk_size=512))
+	assert reader.readlines() == BytesIO(LOG_DATA).readlines()
+
+
+def test_inflating_reader():
+	compressed = BytesIO(gzip.compress(LOG_DATA))
+	reader = BufferedReader(InflatingReader(compressed, chunk_size=512))
+	assert reader.read() == LOG_DATA
+
+
+def test_inflating_reader_multiple_members():
+	half = len(LOG_DATA) // 2
+	compressed = gzip.compress(LOG_DATA[:half]) + gzip.compress(LOG_DATA[half:])
+	reader = BufferedReader(InflatingReader(BytesIO(compressed), chunk_size=512))
+	assert reader.read() == LOG_DATA
+
+
+def test_inflating_reader_not_compressed():
+	reader = BufferedReader(InflatingReader(BytesIO(LOG_DATA)))
+	with pytest.raises(OSError):
+		reader.read()
+
+
+def test_inflating_reader_truncated():
+	compressed = gzip.compress(LOG_DATA)
+	reader = BufferedReader(InflatingReader(BytesIO(compressed[:len(compressed) // 2])))
+	with pytest.raises(EOFError):
+		reader.read()
@@ -0,0 +1,88 @@
+from unittest.mock import Mock, call
+
+import fakeredis
+import pytest
+
+from hsreplaynet.utils.cache import SharedCache
+
+
+@pytest.fixture
+def redis():
+	r = fakeredis.FakeStrictRedis()
+	yield r
+	r.flushall()
+
+
+@pytest.fixture(autouse=True)
+def mock_lock(mocker):
+	lock = Mock()
+	lock.acquire.return_value = True
+	return mocker.patch("hsreplaynet.utils.cache.RedisLock", return_value=lock)
+
+
+def test_shared_cache(redis, mocker):
+	mock_time = mocker.patch("hsreplaynet.utils.cache.time.time", return_value=1000)
+	compute = Mock(return_value={1: [1, 2]})
+	cache = SharedCache("TEST", lambda: redis, ttl=5)
+
+	assert cache.get("key", compute) == {1: [1, 2]}
+	assert cache.get("key", compute) == {1: [1, 2]}
+	assert compute.call_count == 1
+
+	# Another worker finds the value in Redis
+	other_cache = SharedCache("TEST", lambda: redis, ttl=5)
+	assert other_cache.get("key", compute) == {1: [1, 2]}
+	assert compute.call_count == 1
+
+	mock_time.return_value = 1006
+	compute.return_value = {1: [3]}
+	assert cache.get("key", compute) == {1: [3]}
+	assert compute.call_count == 2
+
+
+def test_shared_cache_serves_stale_values_while_locked(redis, mocker, mock_lock):
+	mock_time = mocker.patch("hsreplaynet.utils.cache.time.time", return_value=1000)
+	compute = Mock(return_value="old")
+	cache = SharedCache("TEST_STALE", lambda: redis, ttl=5)
+	cache.get("key", compute)
+
+	# Someone else is recomputing the expired value
+	mock_time.return_value = 1006
+	mock_lock.return_value.acquire.return_value = False
+	compute.return_value = "new"
+	assert cache.get("key", compute) == "old"
+	assert compute.call_count == 1
+
+
+def test_shared_cache_aggregates_metrics(redis, mocker):
+	mock_time = mocker.patch("hsreplaynet.utils.cache.time.time", return_value=1000)
+	mock_influx_metric = mocker.patch("hsreplaynet.utils.cache.influx_metric")
+	compute = Mock(return_value="value")
+	cache = SharedCache("TEST_METRICS", lambda: redis, ttl=60, metric_interval=10)
+
+	for _ in range(3):
+		cache.get("key", compute)
+	assert mock_influx_metric.call_count == 0
+
+	# The counts are reported together once the interval has passed
+	mock_time.return_value = 1010
+	cache.get("key", compute)
+	mock_influx_metric.assert_has_calls([
+		call("shared_cache", {"count": 1}, cache="TEST_METRICS", result="miss"),
+		call("shared_cache", {"count": 3}, cache="TEST_METRICS", result="local_hit"),
+	], any_order=True)
+	assert mock_influx_metric.call_count == 2
+
+
+def test_shared_cache_clear(redis):
+	compute = Mock(return_value="value")
+	cache = SharedCache("TEST_CLEAR", lambda: redis, ttl=60)
+	cache.get("a", compute)
+	cache.get("b", compute)
+
+	cache.clear("a")
+	cache.get("a", compute)
+	assert compute.call_count == 3
+
+	cache.clear()
+	assert not list(redis.scan_iter(match="SHARED_CACHE:TEST_CLEAR:*"))
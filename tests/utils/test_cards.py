@@ -0,0 +1,81 @@
+from unittest.mock import Mock
+
+import pytest
+from django_hearthstone.cards.models import Card
+from hearthstone.enums import CardClass, CardType
+
+from hsreplaynet.utils import cards
+from hsreplaynet.utils.cards import (
+	CardIndex, CardInfo, card_index, get_card, get_card_data_version
+)
+
+
+def test_card_index():
+	index = CardIndex([
+		CardInfo(1, "CARD_A", CardClass.MAGE, 2, 3, "Card A", CardType.SPELL),
+		CardInfo(5, "CARD_B", CardClass.NEUTRAL, 2, 1, "Card B", CardType.MINION),
+	])
+
+	assert len(index) == 2
+	assert index.get(1).card_id == "CARD_A"
+	assert index.get("CARD_B").dbf_id == 5
+	assert index.get_dbf_id("CARD_A") == 1
+	assert index.get(3) is None
+	assert index.get(100) is None
+	assert index.get("CARD_C") is None
+	assert "CARD_A" in index
+	assert sorted([1, 5], key=index.sort_key) == [5, 1]
+
+	# Unknown cards sort last
+	assert index.get(None) is None
+	assert None not in index
+	assert sorted(["CARD_C", 1, None, 5], key=index.sort_key) == [5, 1, "CARD_C", None]
+
+
+@pytest.mark.django_db
+def test_card_index_from_db():
+	hero = Card.objects.get(card_id="HERO_05")
+	card = get_card("HERO_05")
+	assert card.dbf_id == hero.dbf_id
+	assert card.card_class == CardClass.HUNTER
+	assert card.type == CardType.HERO
+	assert get_card(hero.dbf_id) is card
+	assert len(card_index()) == Card.objects.exclude(dbf_id=None).count()
+
+
+@pytest.mark.django_db
+def test_card_data_version_changes_with_content():
+	version = get_card_data_version()
+	assert get_card_data_version() == version
+
+	Card.objects.filter(card_id="HERO_05").update(cost=7)
+	assert get_card_data_version() != version
+
+
+def test_card_index_limits_version_checks(settings, mocker):
+	settings.CARD_INDEX_VERSION_CHECK_SECONDS = 300
+	settings.CARD_INDEX_MIN_VERSION_CHECK_SECONDS = 30
+	mock_time = mocker.patch("hsreplaynet.utils.cards.time.time", return_value=1000)
+	from_db = mocker.patch(
+		"hsreplaynet.utils.cards.CardIndex.from_db",
+		side_effect=lambda: Mock(version=1)
+	)
+	get_version = mocker.patch(
+		"hsreplaynet.utils.cards.get_card_data_version", return_value=1
+	)
+	mocker.patch.dict(cards._CARD_INDEX_CACHE, clear=True)
+
+	index = card_index()
+	assert card_index(check_version=True) is index
+	assert get_version.call_count == 0
+
+	mock_time.return_value = 1031
+	assert card_index() is index
+	assert card_index(check_version=True) is index
+	assert card_index(check_version=True) is index
+	assert get_version.call_count == 1
+
+	get_version.return_value = 2
+	mock_time.return_value = 1400
+	assert card_index() is not index
+	assert from_db.call_count == 2
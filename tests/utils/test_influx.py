@@ -0,0 +1,41 @@
+from unittest.mock import Mock
+
+import pytest
+
+from hsreplaynet.utils.influx import InfluxBuffer
+
+
+def _point(n):
+	return {"measurement": "test", "tags": {}, "fields": {"value": n}}
+
+
+@pytest.fixture(autouse=True)
+def no_flusher_thread(mocker):
+	# Flush synchronously only, so the background flusher can't race the assertions
+	mocker.patch.object(InfluxBuffer, "_ensure_thread")
+
+
+def test_influx_buffer_flush():
+	client = Mock()
+	client.write_points.return_value = True
+	buffer = InfluxBuffer(client, batch_size=3, flush_interval=3600)
+
+	buffer.put([_point(n) for n in range(7)])
+	buffer.flush()
+
+	batches = [call[0][0] for call in client.write_points.call_args_list]
+	assert [len(batch) for batch in batches] == [3, 3, 1]
+	assert [p["fields"]["value"] for batch in batches for p in batch] == list(range(7))
+
+
+def test_influx_buffer_drops_when_full():
+	client = Mock()
+	client.write_points.return_value = True
+	buffer = InfluxBuffer(client, max_size=5, batch_size=100, flush_interval=3600)
+
+	buffer.put([_point(n) for n in range(8)])
+	assert buffer.dropped == 3
+
+	buffer.flush()
+	assert buffer.dropped == 0
+	assert len(client.write_points.call_args[0][0]) == 5
@@ -0,0 +1,125 @@
+from unittest.mock import Mock
+
+import pytest
+from sqlalchemy import Column, Integer, MetaData, Table, event
+from sqlalchemy.pool import NullPool, QueuePool
+
+from hsreplaynet.utils.aws import redshift
+
+
+@pytest.fixture(autouse=True)
+def clear_registry():
+	redshift._engines.clear()
+	redshift._metadata.clear()
+	yield
+	redshift._engines.clear()
+	redshift._metadata.clear()
+
+
+def test_get_redshift_engine_is_reused(settings):
+	settings.REDSHIFT_CONNECTION_POOL_SIZE = 2
+	settings.REDSHIFT_CONNECTION_POOL_MAX_OVERFLOW = 3
+
+	engine = redshift.get_redshift_engine()
+	assert redshift.get_redshift_engine() is engine
+	assert isinstance(engine.pool, QueuePool)
+	assert engine.pool.size() == 2
+
+
+def test_get_redshift_engine_resets_session_state(settings):
+	settings.REDSHIFT_CONNECTION_POOL_SIZE = 2
+
+	engine = redshift.get_redshift_engine(etl_user=True)
+	assert event.contains(engine, "checkin", redshift._reset_session_state)
+
+	dbapi_connection, connection_record = Mock(), Mock()
+	redshift._reset_session_state(dbapi_connection, connection_record)
+	dbapi_connection.cursor.return_value.execute.assert_called_once_with(
+		"RESET wlm_query_slot_count; RESET query_group;"
+	)
+	dbapi_connection.commit.assert_called_once_with()
+	connection_record.invalidate.assert_not_called()
+
+	error = Exception("Connection closed")
+	dbapi_connection.cursor.return_value.execute.side_effect = error
+	redshift._reset_session_state(dbapi_connection, connection_record)
+	connection_record.invalidate.assert_called_once_with(error)
+
+
+def test_get_redshift_engine_without_pooling(settings):
+	settings.REDSHIFT_CONNECTION_POOL_SIZE = 0
+
+	assert isinstance(redshift.get_redshift_engine().pool, NullPool)
+
+
+def test_get_redshift_background_engine(settings):
+	settings.REDSHIFT_CONNECTION_POOL_SIZE = 2
+
+	engine = redshift.get_redshift_background_engine(etl_user=True)
+	assert isinstance(engine.pool, NullPool)
+	assert engine is not redshift.get_redshift_engine(etl_user=True)
+	assert not event.contains(engine, "checkin", redshift._reset_session_state)
+
+
+def test_get_redshift_engine_after_fork(mocker):
+	engine = redshift.get_redshift_engine()
+	mocker.patch("hsreplaynet.utils.aws.redshift.os.getpid", return_value=-1)
+
+	assert redshift.get_redshift_engine() is not engine
+
+
+def _metadata(*table_names):
+	md = MetaData()
+	for name in table_names:
+		Table(name, md, Column("id", Integer))
+	return md
+
+
+def test_get_redshift_metadata_ttl(settings, mocker):
+	settings.REDSHIFT_METADATA_TTL_SECONDS = 60
+	mock_time = mocker.patch("hsreplaynet.utils.aws.redshift.time.time", return_value=1000)
+	reflect = mocker.patch(
+		"hsreplaynet.utils.aws.redshift._reflect_redshift_metadata",
+		side_effect=lambda engine: _metadata("game"),
+	)
+
+	md = redshift.get_redshift_metadata(etl_user=False)
+	assert redshift.get_redshift_metadata(etl_user=False) is md
+	assert reflect.call_count == 1
+
+	assert redshift.get_redshift_metadata(refresh=True, etl_user=False) is not md
+	assert reflect.call_count == 2
+
+	mock_time.return_value = 1061
+	redshift.get_redshift_metadata(etl_user=False)
+	assert reflect.call_count == 3
+
+
+def test_get_redshift_table_reflects_new_tables(mocker):
+	reflect = mocker.patch(
+		"hsreplaynet.utils.aws.redshift._reflect_redshift_metadata",
+		side_effect=[_metadata("game"), _metadata("game", "stage_1234_game")],
+	)
+
+	assert redshift.get_redshift_table("game", etl_user=False).name == "game"
+	assert redshift.get_redshift_table("game", etl_user=False).name == "game"
+	assert reflect.call_count == 1
+
+	table = redshift.get_redshift_table("stage_1234_game", etl_user=False)
+	assert table.name == "stage_1234_game"
+	assert reflect.call_count == 2
+
+
+def test_report_redshift_pool_metrics(settings, mocker):
+	settings.REDSHIFT_CONNECTION_POOL_SIZE = 2
+	influx_metric = mocker.patch("hsreplaynet.utils.aws.redshift.influx_metric")
+	redshift.get_redshift_engine()
+
+	redshift.report_redshift_pool_metrics()
+
+	influx_metric.assert_called_once_with("redshift_connection_pool", {
+		"size": 2,
+		"checked_in": 0,
+		"checked_out": 0,
+		"overflow": 0,
+	}, user="postgres")
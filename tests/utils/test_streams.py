@@ -0,0 +1,280 @@
+import threading
+from unittest.mock import Mock
+
+import pytest
+from botocore.exceptions import ClientError
+
+from hsreplaynet.utils.aws import streams
+
+
+@pytest.fixture
+def firehose(mocker):
+	mocker.patch("hsreplaynet.utils.aws.streams._backoff")
+	mocker.patch("hsreplaynet.utils.aws.streams.influx_metric")
+	return mocker.patch("hsreplaynet.utils.aws.streams.FIREHOSE")
+
+
+def _response(*error_codes):
+	return {
+		"FailedPutCount": len([code for code in error_codes if code]),
+		"RequestResponses": [
+			{"ErrorCode": code, "ErrorMessage": "Nope"} if code else {"RecordId": "1"}
+			for code in error_codes
+		]
+	}
+
+
+def test_to_data_blobs():
+	records = ["%i|é\n" % (i) for i in range(10)]
+
+	blobs = streams.to_data_blobs(records, max_blob_size=13)
+	assert [blob["Data"] for blob in blobs] == [
+		"0|é\n1|é\n".encode("utf-8"),
+		"2|é\n3|é\n".encode("utf-8"),
+		"4|é\n5|é\n".encode("utf-8"),
+		"6|é\n7|é\n".encode("utf-8"),
+		"8|é\n9|é\n".encode("utf-8"),
+	]
+
+	# Records larger than a blob get a blob of their own
+	assert len(streams.to_data_blobs(["a" * 20, "b", "c"], max_blob_size=10)) == 2
+
+	blobs = streams.to_data_blobs(records)
+	assert len(blobs) == 1
+	assert blobs[0]["Data"].decode("utf-8") == "".join(records)
+
+
+def test_to_firehose_batches():
+	blobs = [{"Data": b"x" * size} for size in (3, 3, 3, 5, 1, 1, 1)]
+
+	batches = list(streams.to_firehose_batches(blobs, max_records=3, max_size=8))
+	assert [[len(blob["Data"]) for blob in batch] for batch in batches] == [
+		[3, 3], [3, 5], [1, 1, 1]
+	]
+
+
+def test_publish_batch_to_firehose_retries_failures(firehose):
+	batch = [{"Data": b"1"}, {"Data": b"2"}, {"Data": b"3"}]
+	firehose.put_record_batch.side_effect = [
+		_response(None, "ServiceUnavailableException", "InternalFailure"),
+		_response(None, "ServiceUnavailableException"),
+		_response(None),
+	]
+
+	assert streams.publish_batch_to_firehose("stream", batch) == []
+	assert [
+		call[1]["Records"] for call in firehose.put_record_batch.call_args_list
+	] == [batch, batch[1:], batch[2:]]
+	assert streams._backoff.call_count == 2
+
+
+def test_publish_batch_to_firehose_gives_up(firehose):
+	batch = [{"Data": b"1"}, {"Data": b"2"}]
+	firehose.put_record_batch.side_effect = [
+		ClientError({"Error": {"Code": "ServiceUnavailableException"}}, "PutRecordBatch"),
+		_response(None, "ServiceUnavailableException"),
+		_response("ServiceUnavailableException"),
+	]
+
+	failures = streams.publish_batch_to_firehose("stream", batch, max_attempts=3)
+	assert firehose.put_record_batch.call_count == 3
+	assert [failure["record"] for failure in failures] == [{"Data": b"2"}]
+	assert failures[0]["error_code"] == "ServiceUnavailableException"
+
+
+def test_firehose_publisher(firehose):
+	firehose.put_record_batch.side_effect = lambda **kwargs: _response(
+		*([None] * len(kwargs["Records"]))
+	)
+	publisher = streams.FirehosePublisher(max_buffer_size=10)
+
+	publisher.add("stream_1", ["a\n", "b\n"])
+	publisher.add("stream_2", ["c\n"])
+	assert firehose.put_record_batch.call_count == 0
+
+	# A full buffer is published right away
+	publisher.add("stream_1", ["d" * 8])
+	firehose.put_record_batch.assert_called_once_with(
+		DeliveryStreamName="stream_1", Records=[{"Data": b"a\nb\ndddddddd"}]
+	)
+
+	assert publisher.flush() == {"stream_2": []}
+	assert firehose.put_record_batch.call_count == 2
+	assert publisher.flush() == {}
+
+
+def test_firehose_publisher_measures_encoded_records(firehose):
+	firehose.put_record_batch.side_effect = lambda **kwargs: _response(
+		*([None] * len(kwargs["Records"]))
+	)
+	publisher = streams.FirehosePublisher(max_buffer_size=10)
+
+	# Five characters, but ten bytes once encoded
+	publisher.add("stream", ["\u00e9" * 5])
+	firehose.put_record_batch.assert_called_once_with(
+		DeliveryStreamName="stream", Records=[{"Data": "\u00e9".encode("utf-8") * 5}]
+	)
+
+
+def test_buffered_firehose_publishing(firehose):
+	firehose.put_record_batch.return_value = _response(None)
+
+	with streams.buffered_firehose_publishing() as publisher:
+		assert streams.publish_to_firehose("stream", ["a\n"]) == []
+		assert streams.publish_to_firehose("stream", ["b\n"]) == []
+		assert firehose.put_record_batch.call_count == 0
+		assert isinstance(publisher, streams.FirehosePublisher)
+
+	firehose.put_record_batch.assert_called_once_with(
+		DeliveryStreamName="stream", Records=[{"Data": b"a\nb\n"}]
+	)
+
+	streams.publish_to_firehose("stream", ["c\n"])
+	assert firehose.put_record_batch.call_count == 2
+
+
+def test_buffered_firehose_publishing_is_thread_local(firehose):
+	firehose.put_record_batch.return_value = _response(None)
+
+	with streams.buffered_firehose_publishing():
+		# Other threads keep publishing right away
+		thread = threading.Thread(target=streams.publish_to_firehose, args=("other", ["a\n"]))
+		thread.start()
+		thread.join()
+		firehose.put_record_batch.assert_called_once_with(
+			DeliveryStreamName="other", Records=[{"Data": b"a\n"}]
+		)
+
+
+def test_firehose_publisher_reports_errors(firehose):
+	firehose.put_record_batch.side_effect = Mock(side_effect=RuntimeError("Boom"))
+	publisher = streams.FirehosePublisher()
+	publisher.add("stream", ["a\n"])
+
+	failures = publisher.flush()["stream"]
+	assert [failure["error_code"] for failure in failures] == ["RuntimeError"]
+	assert publisher.failure_reports["stream"] == failures
+
+
+def test_token_bucket(mocker):
+	mock_time = mocker.patch("hsreplaynet.utils.aws.streams.time")
+	mock_time.monotonic.return_value = 100
+	bucket = streams.TokenBucket(10)
+
+	assert bucket.acquire(10) == 0
+	assert bucket.acquire(5) == 0.5
+	mock_time.sleep.assert_called_once_with(0.5)
+
+	# Concurrent callers queue up behind each other's debt
+	assert bucket.acquire(5) == 1
+
+	mock_time.monotonic.return_value = 102
+	assert bucket.acquire(1) == 0
+
+	bucket.set_rate(2)
+	assert bucket.tokens == 2
+	assert bucket.acquire(4) == 1
+
+
+def test_publish_from_iterable_at_fixed_speed(mocker):
+	acquire = mocker.patch("hsreplaynet.utils.aws.streams.TokenBucket.acquire")
+	publisher_func = Mock()
+
+	streams.publish_from_iterable_at_fixed_speed(
+		iter(range(1, 6)), publisher_func, max_records_per_second=2, publish_batch_size=2
+	)
+	assert [c[0][0] for c in publisher_func.call_args_list] == [[1, 2], [3, 4], [5]]
+	assert [c[0][0] for c in acquire.call_args_list] == [2, 2, 1]
+
+
+def _shard(shard_id, starting_hash_key):
+	return {"ShardId": shard_id, "HashKeyRange": {"StartingHashKey": str(starting_hash_key)}}
+
+
+# Partition keys whose MD5 hashes land in the lower and upper half of the hash key range
+LOW_KEY = "a"
+HIGH_KEY = "b"
+
+
+def test_kinesis_shard_map():
+	shard_map = streams.KinesisShardMap([_shard("2", 2 ** 127), _shard("1", 0)])
+
+	assert len(shard_map) == 2
+	assert shard_map.get_shard_id(LOW_KEY) == "1"
+	assert shard_map.get_shard_id(HIGH_KEY) == "2"
+
+
+@pytest.fixture
+def kinesis_publisher(mocker):
+	mocker.patch("hsreplaynet.utils.aws.streams.TokenBucket.acquire")
+	mocker.patch("hsreplaynet.utils.aws.streams.influx_metric")
+
+	def publisher_func(batch):
+		calls.append(batch)
+		return {"Records": [
+			{"ErrorCode": "ProvisionedThroughputExceededException"}
+			if key == HIGH_KEY and len(calls) == 1 else {"ShardId": shard_map[key]}
+			for key in batch
+		]}
+
+	calls = []
+	shard_map = {LOW_KEY: "1", HIGH_KEY: "2"}
+	publisher = streams.AdaptiveKinesisPublisher(
+		"stream", publisher_func, [_shard("1", 0), _shard("2", 2 ** 127)],
+		partition_key=lambda key: key, batch_size=4, total=6,
+	)
+	return publisher, calls
+
+
+def test_adaptive_kinesis_publisher_retries_throttled_records(kinesis_publisher):
+	publisher, calls = kinesis_publisher
+	publisher.max_in_flight_batches = 1
+
+	publisher.run([LOW_KEY, HIGH_KEY, LOW_KEY, HIGH_KEY, LOW_KEY, LOW_KEY])
+	assert calls == [
+		[LOW_KEY, HIGH_KEY, LOW_KEY, HIGH_KEY], [LOW_KEY, LOW_KEY], [HIGH_KEY, HIGH_KEY]
+	]
+	assert publisher.published == 6
+	assert publisher.retried == publisher.throttled == 2
+	assert publisher.failed == 0
+	assert publisher.shard_records == {"1": 4, "2": 2}
+
+	# Only the throttled shard was slowed down
+	assert publisher.buckets["1"].rate == 840
+	assert publisher.buckets["2"].rate == 420
+
+	progress = publisher.get_progress()
+	assert progress["published"] == 6
+	assert progress["eta_seconds"] == 0
+
+
+def test_adaptive_kinesis_publisher_gives_up(kinesis_publisher):
+	publisher, calls = kinesis_publisher
+	publisher.max_attempts = 1
+
+	publisher.run([HIGH_KEY, LOW_KEY])
+	assert publisher.published == 1
+	assert publisher.failed == 1
+	assert publisher.retried == 0
+
+
+def test_adaptive_kinesis_publisher_without_partition_key(mocker):
+	mocker.patch("hsreplaynet.utils.aws.streams.TokenBucket.acquire")
+	mocker.patch("hsreplaynet.utils.aws.streams.influx_metric")
+	publisher_func = Mock(side_effect=[
+		ClientError(
+			{"Error": {"Code": "ProvisionedThroughputExceededException"}}, "PutRecords"
+		),
+		{"Records": [{"ShardId": "1"}, {"ShardId": "2"}]},
+	])
+	publisher = streams.AdaptiveKinesisPublisher(
+		"stream", publisher_func, [_shard("1", 0), _shard("2", 2 ** 127)]
+	)
+
+	assert list(publisher.buckets) == [None]
+	assert publisher.buckets[None].rate == 1600
+
+	publisher.run(["x", "y"])
+	assert publisher_func.call_count == 2
+	assert publisher.published == 2
+	assert publisher.buckets[None].rate == 840
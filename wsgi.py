@@ -17,3 +17,7 @@ sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
 os.environ.setdefault("DJANGO_SETTINGS_MODULE", "hsreplaynet.settings")
 
 application = get_wsgi_application()
+
+# Load the live archetype signatures before serving the first request
+from hsreplaynet.decks.signatures import warm_signature_weights  # noqa: E402, isort:skip
+warm_signature_weights()